@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上傳准入控制
+在讀取請求內容之前，依宣告的大小檢查剩餘磁碟空間與儲存配額，並限制整體與單一用戶端的同時上傳數。
+通過檢查的上傳會預留空間，寫入磁碟後逐步轉為實際使用量（剩餘空間已反映寫入的部分，不會重複計算）；
+沒有宣告大小或解壓後超出宣告大小的內容，超出預留的部分在寫入時檢查。
+寫入量先累積在各自的 AdmissionTicket（不需要鎖），每 METER_STEP 位元組才更新共用的統計。
+被拒絕的請求回應429/507與Retry-After，手機不必先把整個檔案傳過WiFi才發現伺服器放不下
+"""
+
+import shutil
+import threading
+import time
+
+DEFAULT_MAX_UPLOADS = 16                       # 整體同時上傳數
+DEFAULT_MAX_UPLOADS_PER_CLIENT = 6             # 單一用戶端同時上傳數（平行分段上傳會用到多條連線）
+DEFAULT_QUEUE_TIMEOUT = 5                      # 額滿時最多排隊等待的秒數
+MIN_FREE_SPACE = 200 * 1024 * 1024             # 保留給系統的最小剩餘空間
+BUSY_RETRY_AFTER = 3                           # 429 建議重試秒數
+FULL_RETRY_AFTER = 60                          # 507 建議重試秒數
+METER_STEP = 1024 * 1024                       # 寫入量每累積這麼多才更新共用的統計與檢查空間
+
+
+class AdmissionError(Exception):
+    """上傳被拒絕"""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """一個已獲准的上傳，請求結束時必須 release()"""
+
+    def __init__(self, controller, client, reserved, metered=False):
+        self._controller = controller
+        self.client = client
+        self.reserved = reserved        # 尚未寫入的預留空間
+        self.unrecorded = 0             # 已寫入但尚未計入 used_bytes 的位元組
+        self.metered = metered          # 是否以 wrote() 回報寫入的位元組
+        self._unmetered = 0             # 已寫入但尚未交給控制器的位元組（只有處理請求的執行緒會用到）
+        self._released = False
+
+    def wrote(self, nbytes):
+        """
+        寫入磁碟後呼叫：預留空間轉為實際使用量；
+        超出預留的部分（未宣告大小或壓縮的內容）每 METER_STEP 位元組檢查一次空間，不足時拋出AdmissionError
+        """
+        self._unmetered += nbytes
+        if self._unmetered >= METER_STEP:
+            self._flush()
+
+    def _flush(self):
+        nbytes, self._unmetered = self._unmetered, 0
+        if nbytes:
+            self._controller._wrote(self, nbytes)
+
+    def recorded(self, nbytes):
+        """寫入的檔案已計入 used_bytes（完成登記）後呼叫，配額不重複計算"""
+        self._flush()
+        self._controller._recorded(self, nbytes)
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._unmetered = 0
+            self._controller._release(self)
+
+
+class AdmissionController:
+    """上傳准入控制"""
+
+    def __init__(self, folder, max_uploads=DEFAULT_MAX_UPLOADS,
+                 max_uploads_per_client=DEFAULT_MAX_UPLOADS_PER_CLIENT, quota_bytes=None,
+                 min_free_bytes=MIN_FREE_SPACE, queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+                 used_bytes=None, pending_bytes=None):
+        """
+        used_bytes: 回傳上傳資料夾目前使用量的函式（檢查配額用）
+        pending_bytes: 回傳其他已承諾但尚未寫入的位元組數（例如分段上傳尚未收到的部分）
+        """
+        self.folder = folder
+        self.max_uploads = max_uploads
+        self.max_uploads_per_client = max_uploads_per_client
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self.queue_timeout = queue_timeout
+        self._used_bytes = used_bytes or (lambda: 0)
+        self._pending_bytes = pending_bytes or (lambda: 0)
+        self._condition = threading.Condition()
+        self._active = 0
+        self._per_client = {}
+        self._reserved = 0
+        self._unrecorded = 0
+
+    def _has_slot(self, client):
+        return (self._active < self.max_uploads and
+                self._per_client.get(client, 0) < self.max_uploads_per_client)
+
+    def _check_space_locked(self, size, disk_free=None):
+        """disk_free 為呼叫端在取得鎖之前查詢的剩餘空間（None時在此查詢）"""
+        if disk_free is None:
+            disk_free = shutil.disk_usage(self.folder).free
+        committed = self._reserved + self._pending_bytes()
+        free = disk_free - self.min_free_bytes - committed
+        if size > free:
+            raise AdmissionError(f'電腦磁碟空間不足（剩餘約 {max(0, free) / 1024 / 1024:.0f} MB）',
+                                 507, FULL_RETRY_AFTER)
+        if self.quota_bytes is not None:
+            remaining = self.quota_bytes - self._used_bytes() - self._unrecorded - committed
+            if size > remaining:
+                raise AdmissionError(f'超過儲存配額（剩餘約 {max(0, remaining) / 1024 / 1024:.0f} MB）',
+                                     507, FULL_RETRY_AFTER)
+
+    def check_space(self, size):
+        """只檢查空間（不佔用上傳名額），空間不足時拋出AdmissionError"""
+        with self._condition:
+            self._check_space_locked(size)
+
+    def admit(self, client, size=0, metered=False):
+        """
+        取得上傳名額並預留 size 位元組，回傳AdmissionTicket
+        名額已滿時最多排隊 queue_timeout 秒，仍無名額則拋出429；空間不足拋出507。
+        metered 為True時由 ticket.wrote() 回報寫入量（size 只是宣告的大小，實際寫入可能更多）
+        """
+        deadline = time.monotonic() + self.queue_timeout
+        with self._condition:
+            self._check_space_locked(size)
+            while not self._has_slot(client):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    if not self._has_slot(client):
+                        raise AdmissionError('伺服器忙碌中，請稍後再試', 429, BUSY_RETRY_AFTER)
+            # 排隊期間其他上傳可能已用掉空間，重新檢查
+            self._check_space_locked(size)
+            self._active += 1
+            self._per_client[client] = self._per_client.get(client, 0) + 1
+            self._reserved += size
+        return AdmissionTicket(self, client, size, metered)
+
+    def _wrote(self, ticket, nbytes):
+        with self._condition:
+            released = min(ticket.reserved, nbytes)
+            ticket.reserved -= released
+            self._reserved -= released
+            ticket.unrecorded += nbytes
+            self._unrecorded += nbytes
+        if nbytes > released:
+            # 超出的位元組已在磁碟上（也已計入 _unrecorded），只需確認沒有低於下限；
+            # 查詢磁碟不佔用鎖，其他上傳的准入與寫入不必等待
+            disk_free = shutil.disk_usage(self.folder).free
+            with self._condition:
+                self._check_space_locked(0, disk_free)
+
+    def _recorded(self, ticket, nbytes):
+        with self._condition:
+            recorded = min(ticket.unrecorded, nbytes)
+            ticket.unrecorded -= recorded
+            self._unrecorded -= recorded
+
+    def _release(self, ticket):
+        with self._condition:
+            self._active -= 1
+            count = self._per_client.get(ticket.client, 0) - 1
+            if count > 0:
+                self._per_client[ticket.client] = count
+            else:
+                self._per_client.pop(ticket.client, None)
+            self._reserved -= ticket.reserved
+            self._unrecorded -= ticket.unrecorded
+            self._condition.notify_all()
+
+    def status(self):
+        """目前的上傳數與預留空間"""
+        with self._condition:
+            return {
+                'active_uploads': self._active,
+                'max_uploads': self.max_uploads,
+                'reserved_bytes': self._reserved,
+            }
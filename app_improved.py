@@ -8,20 +8,52 @@
 """
 
 import os
+import sys
 import socket
 import threading
 import webbrowser
 import subprocess
 import re
-import json
+import queue
+import argparse
+import hashlib
+import shutil
+import time
+import multiprocessing
 from datetime import datetime
-from flask import Flask, request, render_template, flash, redirect, url_for, jsonify
-from werkzeug.utils import secure_filename
+from flask import (Flask, Response, request, render_template, flash, redirect, url_for, jsonify,
+                   send_file, g)
+from werkzeug.utils import secure_filename, safe_join
+from werkzeug.exceptions import RequestEntityTooLarge, ClientDisconnected
+from werkzeug.wsgi import get_input_stream
 import mimetypes
-import qrcode
-from PIL import Image, ImageTk
-import tkinter as tk
-from tkinter import messagebox, ttk
+from chunked_upload import (UploadSessionManager, UploadSessionError, IncompleteChunkError,
+                            DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE, PARALLEL_UPLOAD_THRESHOLD,
+                            PARALLEL_UPLOAD_CONNECTIONS)
+from multipart_stream import MultipartStreamReader, get_multipart_boundary
+from content_encoding import decode_request_stream, supported_encodings, is_identity_encoding
+from archive_stream import iter_archive_entries, ArchiveFormatError, ArchiveEntryError
+from file_index import FileIndex, hash_file, is_sha256, DEFAULT_PAGE_SIZE
+from storage_stats import StorageStats
+from network_discovery import InterfaceDiscovery, read_netlink_addresses, netlink_available
+from production_server import (run_production_server, production_server_available, DEFAULT_THREADS,
+                               DEFAULT_BACKLOG, DEFAULT_TIMEOUT, DEFAULT_KEEPALIVE_CONNECTIONS,
+                               SOCKET_BUFFER_SIZE)
+from metrics import MetricsRegistry, LATENCY_BUCKETS, THROUGHPUT_BUCKETS, COUNT_BUCKETS
+from thumbnails import ThumbnailService, is_image_file
+from downloads import send_file_range, iter_zip_stream, content_disposition
+from admission import (AdmissionController, AdmissionError, DEFAULT_MAX_UPLOADS,
+                       DEFAULT_MAX_UPLOADS_PER_CLIENT, BUSY_RETRY_AFTER)
+from qr_codes import QRCodeCache
+from post_processing import JobQueue, verify_checksum, make_organize_step
+from atomic_store import FileStore, FSYNC_POLICIES, DEFAULT_FSYNC_POLICY
+from ip_ranking import IPRanker, ReceiveMeter, load_config, update_config
+from progress_events import EventHub, EventStreamFull, subscriber_limit
+from bandwidth import BandwidthScheduler, parse_priorities, PRIORITY_WEIGHTS
+from profiling import RequestProfiler, TimedStream, DEFAULT_THRESHOLD as PROFILE_THRESHOLD
+from tiered_storage import (ArchiveMover, make_target, ARCHIVE_TIER, DEFAULT_ARCHIVE_WORKERS)
+from speedtest import (iter_download, discard_request_body, BLOCK_SIZE as SPEEDTEST_BLOCK_SIZE,
+                       DEFAULT_DOWNLOAD_MB, MAX_DOWNLOAD_MB, MAX_UPLOAD_SIZE as MAX_SPEEDTEST_UPLOAD)
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
@@ -32,24 +64,337 @@ if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB限制
+app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 單次請求500MB限制（分段上傳不受此限）
+MAX_ARCHIVE_SIZE = 20 * 1024 * 1024 * 1024             # 封存檔上傳的大小上限
+
+# 內部資料資料夾（分段上傳暫存檔等），以點開頭避免被當成上傳的檔案
+DATA_FOLDER = os.path.join(UPLOAD_FOLDER, '.transfer')
+
+# 分段續傳上傳
+upload_sessions = UploadSessionManager(os.path.join(DATA_FOLDER, 'partial'),
+                                       fsync_policy=os.environ.get('TRANSFER_FSYNC', DEFAULT_FSYNC_POLICY))
+upload_sessions.cleanup_expired()
+
+# 上傳檔案的寫入：先寫暫存檔，完成後才以不衝突的檔名原子發布
+file_store = FileStore(UPLOAD_FOLDER, os.path.join(DATA_FOLDER, 'incoming'),
+                       policy=os.environ.get('TRANSFER_FSYNC', DEFAULT_FSYNC_POLICY))
+
+# 內容雜湊索引（秒傳與去重）
+file_index = FileIndex(os.path.join(DATA_FOLDER, 'file_index.db'), UPLOAD_FOLDER)
+
+# 檔案數與總大小統計（上傳時更新，背景與磁碟同步）
+storage_stats = StorageStats(UPLOAD_FOLDER, os.path.join(DATA_FOLDER, 'storage_stats.json'),
+                             exclude=[os.path.basename(DATA_FOLDER)])
+storage_stats.start()
+
+# 上傳准入控制（讀取請求內容前檢查空間與同時上傳數）
+# 配額的使用量包含分段上傳已收到的部分（暫存檔在 .transfer 中，不在資料夾統計內）
+admission = AdmissionController(UPLOAD_FOLDER,
+                                used_bytes=lambda: (storage_stats.snapshot()[1] +
+                                                    upload_sessions.received_bytes()),
+                                pending_bytes=upload_sessions.pending_bytes)
+
+# 上傳頻寬依手機公平分配（預設不限制，由 --bandwidth-limit 等參數啟用）
+bandwidth = BandwidthScheduler()
+
+# 效能剖析（預設關閉，由 --profile 或 TRANSFER_PROFILE=1 啟用）
+profiler = RequestProfiler(os.path.join(DATA_FOLDER, 'profiles'),
+                           enabled=os.environ.get('TRANSFER_PROFILE') == '1')
+
+# 縮圖（上傳後於背景程序產生並快取）
+thumbnail_service = ThumbnailService(os.path.join(DATA_FOLDER, 'thumbnails'))
+
+# 上傳進度事件（/events 與電腦端視窗共用同一個串流）
+event_hub = EventHub()
+
+def publish_job_event(job, state):
+    """後處理工作狀態 → 進度事件"""
+    event_hub.job_changed(job.id, os.path.basename(job.path), state, job.current_step,
+                          job.error if state in ('retry', 'failed') else None)
+
+# 分層儲存（由 --archive 啟用）：後處理完成後在背景搬到封存層，上傳只需寫入落地層（上傳資料夾）
+archive_mover = None
+archive_stats = None
+
+def archived_name_taken(filepath):
+    """上傳資料夾中的這個檔名是否已被搬到封存層的檔案使用"""
+    if archive_mover is None:
+        return False
+    entry = file_index.get(file_index.relative_path(filepath))
+    return entry is not None and entry['tier'] is not None
+
+# 上傳後處理（寫入日誌後由背景執行緒處理，不影響上傳的回應時間）
+ORGANIZE_BY_DATE = os.environ.get('TRANSFER_ORGANIZE') == '1'   # 照片依拍攝日期整理到 YYYY/MM
+job_queue = JobQueue(os.path.join(DATA_FOLDER, 'post_processing.jsonl'), on_event=publish_job_event)
+job_queue.register_step('verify', verify_checksum)
+job_queue.register_step('organize', make_organize_step(UPLOAD_FOLDER, on_moved=file_index.rename,
+                                                       name_taken=archived_name_taken))
+
+def schedule_archive(job):
+    """後處理的最後一步：排入封存搬移"""
+    if archive_mover is not None:
+        archive_mover.schedule(job.path, job.sha256)
+
+job_queue.register_step('archive', schedule_archive)
+
+# 效能指標（/metrics）
+metrics = MetricsRegistry()
+uploads_in_flight = metrics.gauge('transfer_uploads_in_flight', '進行中的上傳請求數', ['api'])
+received_bytes = metrics.counter('transfer_received_bytes_total', '收到並寫入磁碟的位元組數', ['api'])
+uploaded_files_total = metrics.counter('transfer_uploaded_files_total', '成功上傳的檔案數', ['api'])
+sent_bytes = metrics.counter('transfer_sent_bytes_total', '下載送出的位元組數')
+compressed_requests = metrics.counter('transfer_compressed_requests_total', '以壓縮內容上傳的請求數',
+                                      ['encoding'])
+upload_errors = metrics.counter('transfer_upload_errors_total', '上傳錯誤數', ['type'])
+file_upload_seconds = metrics.histogram('transfer_file_upload_duration_seconds',
+                                        '單一檔案從開始接收到完成登記的時間', ['api'])
+file_upload_throughput = metrics.histogram('transfer_file_upload_throughput_bytes_per_second',
+                                           '單一檔案的上傳速度', ['api'], THROUGHPUT_BUCKETS)
+file_save_seconds = metrics.histogram('transfer_file_save_seconds',
+                                      '檔案儲存（接收並寫入）花費的時間', ['api'])
+file_commit_seconds = metrics.histogram('transfer_file_commit_seconds',
+                                       '檔案發布（fsync與改名）花費的時間', ['policy'], LATENCY_BUCKETS)
+disk_write_seconds = metrics.histogram('transfer_disk_write_seconds',
+                                       '每次磁碟寫入系統呼叫的延遲（multipart與封存檔先累積在緩衝區再整塊寫入）',
+                                       ['api'], LATENCY_BUCKETS)
+request_uploaded_files = metrics.histogram('transfer_request_uploaded_files',
+                                           '每個 /upload 請求成功上傳的檔案數', buckets=COUNT_BUCKETS)
+request_errors = metrics.histogram('transfer_request_errors',
+                                   '每個 /upload 請求的錯誤數', buckets=COUNT_BUCKETS)
+
+def current_trace():
+    """目前請求的效能剖析紀錄，未啟用時為None"""
+    return g.get('profile_trace')
+
+def observe_disk_write(api, transfer=None):
+    """建立記錄磁碟寫入延遲與收到位元組數的回呼（指定 transfer 時同時更新上傳進度）"""
+    trace = current_trace()
+    ticket = g.get('admission_ticket')
+    if ticket is not None and not ticket.metered:
+        ticket = None
+    def on_write(nbytes, seconds):
+        received_bytes.inc(nbytes, api=api)
+        disk_write_seconds.observe(seconds, api=api)
+        if transfer is not None:
+            transfer.add(nbytes)
+        if ticket is not None:
+            # 超出宣告大小且空間不足時拋出AdmissionError，中止接收
+            ticket.wrote(nbytes)
+        if trace is not None:
+            trace.add('write', seconds)
+    return on_write
+
+def observe_file_uploaded(api, size, duration):
+    """記錄一個檔案完成上傳"""
+    uploaded_files_total.inc(api=api)
+    file_upload_seconds.observe(duration, api=api)
+    if duration > 0:
+        file_upload_throughput.observe(size / duration, api=api)
 
 # 設定檔案路徑
 CONFIG_FILE = 'ip_preferences.json'
 
+# 需要准入控制的端點 → 是否依 Content-Length 預留空間
+# （分段上傳的空間在建立工作階段時已檢查，並以尚未收到的位元組計入預留）
+ADMISSION_ENDPOINTS = {
+    'upload_file': True,
+    'upload_archive': True,
+    'upload_chunk': False,
+}
+
+def admission_error_response(error):
+    """准入被拒絕時的回應"""
+    upload_errors.inc(type='rejected_busy' if error.status_code == 429 else 'rejected_space')
+    response = jsonify({'success': False, 'message': error.message})
+    response.status_code = error.status_code
+    response.headers['Retry-After'] = str(error.retry_after)
+    # 請求內容尚未讀取，關閉連線讓手機立即停止傳送
+    response.headers['Connection'] = 'close'
+    return response
+
+@app.before_request
+def start_profile_trace():
+    """啟用效能剖析時開始記錄這個請求（在准入之前，排隊的時間也記錄下來）"""
+    trace = profiler.start_trace(request.method, request.path, request.endpoint,
+                                 request.remote_addr, request.content_length)
+    if trace is not None:
+        g.profile_trace = trace
+
+@app.before_request
+def admit_upload():
+    """在讀取上傳內容之前檢查是否接受這個請求"""
+    reserve = ADMISSION_ENDPOINTS.get(request.endpoint)
+    if reserve is None:
+        return None
+    # 沒有 Content-Length（chunked傳送）或壓縮的內容，超出宣告大小的部分在寫入時檢查
+    size = (request.content_length or 0) if reserve else 0
+    try:
+        g.admission_ticket = admission.admit(request.remote_addr, size, metered=reserve)
+    except AdmissionError as e:
+        return admission_error_response(e)
+    return None
+
+@app.teardown_request
+def release_admission(exc=None):
+    """請求結束時釋放上傳名額與預留空間"""
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        ticket.release()
+
+@app.before_request
+def start_request_timer():
+    """記錄開始處理的時間（在准入之後，排隊時間不算在處理時間內）"""
+    g.request_started = time.perf_counter()
+    trace = current_trace()
+    if trace is not None:
+        trace.handler_started = g.request_started
+
+def request_local_ip():
+    """手機連線使用的本機IP（請求的Host），不是候選IP（例如localhost）時回傳None"""
+    local_ip = request.host.rsplit(':', 1)[0]
+    return local_ip if local_ip in network_discovery.get_ips() else None
+
+@app.after_request
+def record_client_connection(response):
+    """
+    記錄手機是透過哪個本機IP連進來，以及上傳的實際速度（IP排名使用）
+    速度只以讀取請求內容的時間計算，頻寬限制的等待、寫入磁碟與處理的時間都不算在內
+    """
+    local_ip = request_local_ip()
+    if g.get('request_started') is None or local_ip is None:
+        return response
+    ip_ranker.record_connection(local_ip, request.remote_addr)
+    meter = g.get('receive_meter')
+    if meter is not None:
+        ip_ranker.record_transfer(local_ip, meter.bytes, meter.seconds)
+    return response
+
+@app.after_request
+def mark_handler_finished(response):
+    """
+    處理函式已完成（最後註冊的after_request最先執行，之後的時間算在respond階段）
+    回應內容送完（伺服器關閉回應）時才結束追蹤，串流下載的時間也算在respond階段
+    """
+    trace = g.pop('profile_trace', None)
+    if trace is not None:
+        trace.handler_finished = time.perf_counter()
+        status_code = response.status_code
+        response.call_on_close(lambda: profiler.finish_trace(trace, status_code))
+    return response
+
+@app.teardown_request
+def finish_profile_trace(exc=None):
+    """沒有產生回應就結束的請求（未處理的例外），慢請求的報告交給背景執行緒寫出"""
+    trace = g.pop('profile_trace', None)
+    if trace is not None:
+        profiler.finish_trace(trace, 500)
+
 def allowed_file(filename):
     """檢查檔案類型是否被允許（現在允許所有檔案類型）"""
     return filename and filename.strip() != ''
 
-def save_preferred_ip(ip):
-    """儲存偏好的IP到設定檔"""
+def build_stored_filename(original_filename):
+    """產生儲存用的檔名（時間戳記 + 安全檔名）"""
+    filename = secure_filename(original_filename)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
+    return timestamp + filename
+
+def publish_uploaded_file(tmp_path, filename):
+    """將寫完的暫存檔發布到上傳資料夾（同名時自動加上流水號），回傳最終路徑"""
+    started = time.perf_counter()
+    filepath = file_store.publish(tmp_path, filename)
+    elapsed = time.perf_counter() - started
+    file_commit_seconds.observe(elapsed, policy=file_store.policy)
+    trace = current_trace()
+    if trace is not None:
+        trace.add('fsync', elapsed)
+    return filepath
+
+def remove_incomplete_file(filepath):
+    """刪除寫到一半的檔案"""
+    try:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+    except OSError as e:
+        print(f"刪除不完整檔案失敗 {filepath}: {e}")
+
+def link_duplicate(existing_path, filepath):
+    """將重複的檔案改為指向既有檔案的硬連結，不支援時保留原檔"""
+    try:
+        if os.path.samefile(existing_path, filepath):
+            # 已經是硬連結（例如秒傳建立的檔案）
+            return True
+    except OSError:
+        return False
+    tmp_path = filepath + '.link'
+    try:
+        os.link(existing_path, tmp_path)
+        os.replace(tmp_path, filepath)
+        return True
+    except OSError:
+        return False
+    finally:
+        # 兩個名稱指向同一個檔案時 os.replace 不會移除來源，連結仍然存在
+        remove_incomplete_file(tmp_path)
+
+def register_uploaded_file(filepath, sha256, original_name=None, client_ip=None):
+    """登記新儲存的檔案：內容重複時改為硬連結，並加入檔案目錄"""
+    started = time.perf_counter()
+    existing_path = file_index.lookup(sha256)
+    if existing_path and os.path.abspath(existing_path) != os.path.abspath(filepath):
+        link_duplicate(existing_path, filepath)
+    stat = os.stat(filepath)
+    file_index.add(filepath, sha256, stat.st_size, stat.st_mtime, original_name=original_name,
+                   client_ip=client_ip, uploaded_at=time.time())
+    storage_stats.add_file(filepath, stat.st_size)
+    ticket = g.get('admission_ticket')
+    if ticket is not None:
+        ticket.recorded(stat.st_size)
+    if is_image_file(filepath):
+        thumbnail_service.schedule(filepath, thumbnail_service.cache_key(sha256, stat.st_mtime_ns))
+    try:
+        job_queue.enqueue(filepath, sha256, post_processing_steps(filepath))
+    except OSError as e:
+        print(f"加入後處理佇列失敗 {filepath}: {e}")
+    trace = current_trace()
+    if trace is not None:
+        trace.add('index', time.perf_counter() - started)
+
+def post_processing_steps(filepath):
+    """上傳完成後要執行的處理步驟"""
+    steps = ['verify']
+    if ORGANIZE_BY_DATE and is_image_file(filepath):
+        steps.append('organize')
+    if archive_mover is not None:
+        steps.append('archive')
+    return steps
+
+def configure_archive(spec, workers=DEFAULT_ARCHIVE_WORKERS, bandwidth_limit=None, delay=0):
+    """啟用封存層並開始搬移（繼續上次未完成的搬移）"""
+    global archive_mover, archive_stats
+    target = make_target(ARCHIVE_TIER, spec)
+    os.makedirs(target.root, exist_ok=True)
+    archive_stats = StorageStats(target.root, os.path.join(DATA_FOLDER, 'archive_stats.json'))
+    archive_stats.start()
+
+    def on_archived(filepath, archived_path, size):
+        storage_stats.remove_file(filepath, size)
+        archive_stats.add_file(archived_path, size)
+
+    archive_mover = ArchiveMover(os.path.join(DATA_FOLDER, 'archive.jsonl'), target, file_index,
+                                 workers=workers, bandwidth=bandwidth_limit,
+                                 on_archived=on_archived, delay=delay)
+    file_store.name_taken = archived_name_taken
+    archive_mover.start()
+
+def save_preferred_ip(ip, source='manual'):
+    """儲存偏好的IP到設定檔（合併寫入，保留IP量測結果等其他設定）"""
     try:
-        config = {
+        update_config(CONFIG_FILE, {
             'preferred_ip': ip,
+            'preferred_source': source,
             'last_updated': datetime.now().isoformat()
-        }
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        })
         return True
     except Exception as e:
         print(f"儲存偏好IP失敗: {e}")
@@ -57,39 +402,44 @@ def save_preferred_ip(ip):
 
 def load_preferred_ip():
     """從設定檔載入偏好的IP"""
-    try:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                return config.get('preferred_ip')
-    except Exception as e:
-        print(f"載入偏好IP失敗: {e}")
-    return None
+    return load_config(CONFIG_FILE).get('preferred_ip')
+
+def learn_preferred_ip(ip):
+    """量測到速度最快的IP改變時自動設為偏好IP"""
+    if ip != load_preferred_ip() and save_preferred_ip(ip, source='measured'):
+        print(f"⭐ 依實際傳輸速度將 {ip} 設為偏好IP")
 
 def reorder_ips_by_preference(available_ips):
-    """根據偏好重新排序IP列表"""
+    """依實際量測（速度、連線紀錄、路由）與偏好IP排序IP列表"""
     preferred_ip = load_preferred_ip()
-    if preferred_ip and preferred_ip in available_ips:
-        # 將偏好IP移到第一位
-        reordered = [preferred_ip] + [ip for ip in available_ips if ip != preferred_ip]
-        return reordered, preferred_ip
-    return available_ips, None
+    reordered = ip_ranker.rank(available_ips, preferred_ip)
+    return reordered, preferred_ip if preferred_ip in available_ips else None
 
 def get_all_local_ips():
     """獲取所有可用的本機IP位址"""
     ips = []
     
     try:
-        # 方法1: 使用socket獲取所有網路介面
-        hostname = socket.gethostname()
+        # 方法1: Linux直接透過netlink向核心讀取介面位址
+        if netlink_available():
+            try:
+                for _label, ip, _prefixlen in read_netlink_addresses():
+                    if is_valid_ip(ip):
+                        ips.append(ip)
+            except OSError:
+                pass
         
-        # 獲取所有IP位址
-        for info in socket.getaddrinfo(hostname, None):
-            ip = info[4][0]
-            if is_valid_ip(ip):
-                ips.append(ip)
+        # 方法2: 使用socket獲取所有網路介面（netlink已取得時略過，避免主機名稱查詢延遲）
+        if not ips:
+            hostname = socket.gethostname()
+            
+            # 獲取所有IP位址
+            for info in socket.getaddrinfo(hostname, None):
+                ip = info[4][0]
+                if is_valid_ip(ip):
+                    ips.append(ip)
         
-        # 方法2: 嘗試連接外部服務器獲取預設路由IP
+        # 方法3: 嘗試連接外部服務器獲取預設路由IP（UDP不會實際送出封包）
         try:
             s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             s.connect(("8.8.8.8", 80))
@@ -100,16 +450,18 @@ def get_all_local_ips():
         except:
             pass
         
-        # 方法3: 使用ipconfig命令 (Windows)
-        try:
-            result = subprocess.run(['ipconfig'], capture_output=True, text=True)
-            ip_pattern = r'IPv4.*?(\d+\.\d+\.\d+\.\d+)'
-            found_ips = re.findall(ip_pattern, result.stdout)
-            for ip in found_ips:
-                if is_valid_ip(ip) and ip not in ips:
-                    ips.append(ip)
-        except:
-            pass
+        # 方法4: 使用ipconfig命令 (僅Windows)
+        if os.name == 'nt':
+            try:
+                result = subprocess.run(['ipconfig'], capture_output=True, text=True,
+                                        creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+                ip_pattern = r'IPv4.*?(\d+\.\d+\.\d+\.\d+)'
+                found_ips = re.findall(ip_pattern, result.stdout)
+                for ip in found_ips:
+                    if is_valid_ip(ip) and ip not in ips:
+                        ips.append(ip)
+            except:
+                pass
             
     except Exception as e:
         print(f"獲取IP位址時發生錯誤: {e}")
@@ -145,22 +497,29 @@ def is_valid_ip(ip):
     except:
         return False
 
-def generate_qr_code(url):
-    """生成QR code"""
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
-    
-    qr_image = qr.make_image(fill_color="black", back_color="white")
-    return qr_image
+# 網路介面偵測（快取並在背景更新，/status 與QR視窗讀取快取結果）
+network_discovery = InterfaceDiscovery(get_all_local_ips)
+
+# 候選IP排名（依手機實際連線與傳輸速度學習偏好IP）
+ip_ranker = IPRanker(CONFIG_FILE, on_best_changed=learn_preferred_ip)
+
+# QR Code快取（圖形介面模式才會用到）
+qr_cache = QRCodeCache()
+
+def qr_url(ip, port):
+    return f"http://{ip}:{port}"
 
 def show_switchable_qr_window(available_ips, port):
     """顯示可切換的QR code視窗"""
+    # 圖形介面相關模組只在開啟視窗時才載入
+    try:
+        import tkinter as tk
+        from tkinter import messagebox
+        from PIL import ImageTk
+    except ImportError as e:
+        print(f"無法載入圖形介面，請改用 --headless 模式: {e}")
+        return
+    
     if not available_ips:
         messagebox.showerror("錯誤", "未找到可用的IP位址")
         return
@@ -233,11 +592,24 @@ def show_switchable_qr_window(available_ips, port):
         analysis_frame = tk.LabelFrame(main_frame, text="🔍 IP分析", font=("Arial", 10))
         analysis_frame.pack(fill=tk.X, pady=(10, 0))
         
-        analysis_text = tk.Text(analysis_frame, height=4, font=("Arial", 9), wrap=tk.WORD)
+        analysis_text = tk.Text(analysis_frame, height=5, font=("Arial", 9), wrap=tk.WORD)
         analysis_text.pack(fill=tk.X, padx=5, pady=5)
         
+        # 網址 → Tk圖片
+        qr_photos = {}
+        
         def get_ip_analysis(ip):
-            """獲取IP分析資訊"""
+            """獲取IP分析資訊（有實際量測結果時優先顯示）"""
+            info = ip_ranker.describe(ip)
+            if info['throughput'] is not None:
+                return (f"✅ 手機已透過此IP連線，上傳速度約 {info['throughput'] / 1024 / 1024:.1f} MB/s"
+                        f"（{info['clients']} 台裝置）")
+            if info['requests']:
+                return f"✅ 手機已透過此IP連線（{info['clients']} 台裝置）"
+            if info['virtual']:
+                return f"⚠️ 虛擬網卡 {info['interface']} - 通常無法與手機連接"
+            if info['default_route']:
+                return "🌐 預設路由使用的介面 - 最可能與手機在同一個網路"
             if ip.startswith('192.168.1.'):
                 return "常見家用網路 - 大多數路由器的預設網段"
             elif ip.startswith('192.168.0.'):
@@ -257,7 +629,7 @@ def show_switchable_qr_window(available_ips, port):
             """更新QR Code顯示"""
             current_index = current_ip_index.get()
             ip = available_ips[current_index]
-            url = f"http://{ip}:{port}"
+            url = qr_url(ip, port)
             
             # 更新計數器
             ip_counter_label.config(text=f"IP選項: {current_index + 1} / {len(available_ips)}")
@@ -268,10 +640,10 @@ def show_switchable_qr_window(available_ips, port):
                 ip_display += " ⭐"
             current_ip_label.config(text=ip_display)
             
-            # 生成並顯示QR code
-            qr_image = generate_qr_code(url)
-            qr_image = qr_image.resize((300, 300), Image.Resampling.LANCZOS)
-            photo = ImageTk.PhotoImage(qr_image)
+            # 顯示QR code（背景已預先產生，切換時不需要重新產生）
+            photo = qr_photos.get(url)
+            if photo is None:
+                photo = qr_photos[url] = ImageTk.PhotoImage(qr_cache.get(url))
             qr_label.config(image=photo)
             qr_label.image = photo  # 保持引用
             
@@ -279,8 +651,20 @@ def show_switchable_qr_window(available_ips, port):
             url_label.config(text=f"網址: {url}")
             
             # 更新分析資訊
+            update_analysis()
+        
+        def update_analysis():
+            """更新分析資訊（手機連線後會出現實際速度）"""
+            ip = available_ips[current_ip_index.get()]
+            analysis_text.config(state=tk.NORMAL)
             analysis_text.delete(1.0, tk.END)
             analysis_info = f"當前IP: {ip}\n類型: {get_ip_analysis(ip)}\n"
+            speed = ip_ranker.describe(ip)['speedtest']
+            if speed:
+                measured_at = datetime.fromtimestamp(speed['measured_at']).strftime('%m/%d %H:%M')
+                results = [f"{label} {speed[key] * 8 / 1000 / 1000:.0f} Mbps"
+                           for key, label in (('download', '下載'), ('upload', '上傳')) if key in speed]
+                analysis_info += f"🚀 測速（{measured_at}）: {'，'.join(results)}\n"
             if len(available_ips) > 1:
                 analysis_info += f"如果此IP無法連接，請嘗試其他 {len(available_ips)-1} 個選項"
             else:
@@ -324,7 +708,8 @@ def show_switchable_qr_window(available_ips, port):
             ip = available_ips[current_index]
             if save_preferred_ip(ip):
                 messagebox.showinfo("設定成功", 
-                                   f"已將 {ip} 設為預設IP\n下次啟動時會優先使用此IP")
+                                   f"已將 {ip} 設為預設IP\n下次啟動時會優先使用此IP\n"
+                                   "（手機連線後會依實際速度自動調整）")
             else:
                 messagebox.showerror("設定失敗", "無法儲存偏好設定")
         
@@ -373,6 +758,30 @@ def show_switchable_qr_window(available_ips, port):
         root.bind('<KeyPress>', on_key_press)
         root.focus_set()
         
+        # 上傳進度：與 /events 共用同一個事件串流，顯示整體吞吐量
+        progress_subscription = event_hub.subscribe(local=True)
+        received_files = {'completed': 0}
+        
+        def update_progress():
+            """讀取新的進度事件（不等待），更新狀態列"""
+            progress = None
+            for event in progress_subscription.poll():
+                if event.type == 'progress':
+                    progress = event.data
+                elif event.type == 'files':
+                    received_files['completed'] = event.data['completed']
+            if progress is not None:
+                text = "🟢 伺服器運行中"
+                if progress['active']:
+                    text += (f"  ⬆️ {progress['active']} 個檔案上傳中，"
+                             f"{progress['throughput'] / 1024 / 1024:.1f} MB/s")
+                if received_files['completed']:
+                    text += f"  ✅ 已接收 {received_files['completed']} 個檔案"
+                status_label.config(text=text)
+            root.after(500, update_progress)
+        
+        root.after(500, update_progress)
+        
         # 在底部添加快捷鍵說明
         if len(available_ips) > 1:
             shortcut_label = tk.Label(main_frame, 
@@ -380,8 +789,32 @@ def show_switchable_qr_window(available_ips, port):
                                     font=("Arial", 8), fg="gray")
             shortcut_label.pack(pady=(5, 0))
         
+        # 網路介面變動時更新IP清單（事件來自背景執行緒，交給Tk主迴圈處理）
+        interface_events = queue.Queue()
+        network_discovery.subscribe(lambda ips, added, removed: interface_events.put(ips))
+        
+        def apply_interface_changes():
+            """套用背景偵測到的介面變動"""
+            latest_ips = None
+            while not interface_events.empty():
+                latest_ips = interface_events.get_nowait()
+            if latest_ips:
+                current_ip = available_ips[current_ip_index.get()]
+                available_ips[:] = reorder_ips_by_preference(latest_ips)[0]
+                qr_cache.prefetch([qr_url(ip, port) for ip in available_ips])
+                if current_ip in available_ips:
+                    current_ip_index.set(available_ips.index(current_ip))
+                else:
+                    current_ip_index.set(0)
+                ip_count_label.config(text=f"🔍 偵測到 {len(available_ips)} 個可用IP位址")
+                update_qr_display()
+            else:
+                update_analysis()
+            root.after(1000, apply_interface_changes)
+        
         # 初始化顯示
         update_qr_display()
+        root.after(1000, apply_interface_changes)
         
         # 如果只有一個IP，顯示提示
         if len(available_ips) == 1:
@@ -391,13 +824,16 @@ def show_switchable_qr_window(available_ips, port):
             single_ip_info.pack(pady=(10, 0))
         
         root.mainloop()
+        progress_subscription.close()
         
     except Exception as e:
         print(f"無法顯示QR code視窗: {e}")
 
 def start_qr_window(available_ips, port):
     """啟動QR code視窗"""
-    qr_thread = threading.Thread(target=show_switchable_qr_window, args=(available_ips, port))
+    # 在背景先產生所有候選IP的QR Code，視窗顯示與切換時直接使用
+    qr_cache.prefetch([qr_url(ip, port) for ip in available_ips])
+    qr_thread = threading.Thread(target=show_switchable_qr_window, args=(list(available_ips), port))
     qr_thread.daemon = True
     qr_thread.start()
 
@@ -408,32 +844,96 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    """處理檔案上傳"""
-    if 'files' not in request.files:
+    """處理檔案上傳（邊接收邊寫入最終檔案，不經過暫存檔）"""
+    boundary = get_multipart_boundary(request)
+    if not boundary:
         return jsonify({'success': False, 'message': '沒有選擇檔案'})
     
-    files = request.files.getlist('files')
+    stream = open_request_body(request.stream, app.config['MAX_CONTENT_LENGTH'])
     uploaded_files = []
     errors = []
+    received_files = False
     
-    for file in files:
-        if file.filename == '':
-            errors.append('檔案名稱為空')
-            continue
-            
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-            filename = timestamp + filename
+    uploads_in_flight.inc(api='multipart')
+    try:
+        for part in MultipartStreamReader(stream, boundary).parts():
+            if part.name != 'files' or part.filename is None:
+                continue
+            received_files = True
             
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            try:
-                file.save(filepath)
-                uploaded_files.append(filename)
-            except Exception as e:
-                errors.append(f'儲存檔案 {file.filename} 時發生錯誤: {str(e)}')
-        else:
-            errors.append(f'檔案名稱無效: {file.filename}')
+            if part.filename == '':
+                errors.append('檔案名稱為空')
+                upload_errors.inc(type='empty_filename')
+                continue
+                
+            if allowed_file(part.filename):
+                filename = build_stored_filename(part.filename)
+                
+                tmp_path = file_store.temp_path()
+                hasher = hashlib.sha256()
+                started = time.perf_counter()
+                transfer = event_hub.begin(part.filename, 'multipart', request.remote_addr)
+                try:
+                    size = part.save(tmp_path, on_data=hasher.update,
+                                     on_write=observe_disk_write('multipart', transfer))
+                    file_save_seconds.observe(time.perf_counter() - started, api='multipart')
+                    filepath = publish_uploaded_file(tmp_path, filename)
+                    register_uploaded_file(filepath, hasher.hexdigest(), part.filename,
+                                           request.remote_addr)
+                    uploaded_files.append(os.path.basename(filepath))
+                    observe_file_uploaded('multipart', size, time.perf_counter() - started)
+                    event_hub.finish(transfer, os.path.basename(filepath), size)
+                except OSError as e:
+                    errors.append(f'儲存檔案 {part.filename} 時發生錯誤: {str(e)}')
+                    upload_errors.inc(type='disk_error')
+                    event_hub.finish(transfer, error=str(e))
+                except BaseException:
+                    # 連線中斷等錯誤由外層處理，這裡只結束進度
+                    event_hub.finish(transfer, error='接收中斷')
+                    raise
+                finally:
+                    # 沒有發布的暫存檔（寫入失敗或連線中斷）不會出現在上傳資料夾
+                    remove_incomplete_file(tmp_path)
+            else:
+                errors.append(f'檔案名稱無效: {part.filename}')
+                upload_errors.inc(type='invalid_filename')
+    except RequestEntityTooLarge:
+        upload_errors.inc(type='too_large')
+        raise
+    except AdmissionError as e:
+        # 接收途中空間或配額用完（未宣告大小或解壓後超出宣告大小的內容）
+        return admission_error_response(e)
+    except Exception as e:
+        errors.append(f'接收上傳內容時發生錯誤: {str(e)}')
+        upload_errors.inc(type='receive_error')
+    finally:
+        uploads_in_flight.dec(api='multipart')
+    
+    return upload_result_response(uploaded_files, errors, received_files)
+
+def open_request_body(stream, max_size):
+    """
+    依 Content-Encoding 邊接收邊解壓請求內容（解壓後最多 max_size 位元組）
+    讀取速度受頻寬分配限制，以網路上實際傳送（解壓前）的位元組計算
+    """
+    encoding = request.headers.get('Content-Encoding')
+    # 在頻寬限制之下量測，IP排名的速度不受頻寬分配影響
+    stream = g.receive_meter = ReceiveMeter(stream)
+    stream = bandwidth.throttle(stream, request.remote_addr)
+    trace = current_trace()
+    if trace is not None:
+        stream = TimedStream(stream, trace)
+    if not is_identity_encoding(encoding):
+        compressed_requests.inc(encoding=encoding.strip().lower())
+    return decode_request_stream(stream, encoding, max_size)
+
+def upload_result_response(uploaded_files, errors, received_files=True):
+    """彙整一次上傳請求的結果"""
+    request_uploaded_files.observe(len(uploaded_files))
+    request_errors.observe(len(errors))
+    
+    if not received_files and not errors:
+        return jsonify({'success': False, 'message': '沒有選擇檔案'})
     
     if uploaded_files:
         message = f'成功上傳 {len(uploaded_files)} 個檔案'
@@ -443,74 +943,657 @@ def upload_file():
     else:
         return jsonify({'success': False, 'message': '沒有檔案上傳成功', 'errors': errors})
 
+@app.route('/upload/archive', methods=['POST'])
+def upload_archive():
+    """
+    上傳一個zip或tar（可壓縮）封存檔，邊接收邊解開到上傳資料夾
+    每個項目的命名規則與 /upload 相同，大量小檔案只需要一個請求
+    """
+    # 封存檔可能超過單次請求的限制，改用封存檔專用的上限
+    stream = open_request_body(
+        get_input_stream(request.environ, max_content_length=MAX_ARCHIVE_SIZE), MAX_ARCHIVE_SIZE)
+    uploaded_files = []
+    errors = []
+    received_files = False
+    
+    uploads_in_flight.inc(api='archive')
+    try:
+        for entry in iter_archive_entries(stream):
+            received_files = True
+            if not allowed_file(entry.basename):
+                errors.append(f'檔案名稱無效: {entry.name}')
+                upload_errors.inc(type='invalid_filename')
+                continue
+            
+            filename = build_stored_filename(entry.basename)
+            tmp_path = file_store.temp_path()
+            hasher = hashlib.sha256()
+            started = time.perf_counter()
+            transfer = event_hub.begin(entry.basename, 'archive', request.remote_addr)
+            try:
+                size = entry.save(tmp_path, on_data=hasher.update,
+                                  on_write=observe_disk_write('archive', transfer))
+                file_save_seconds.observe(time.perf_counter() - started, api='archive')
+                filepath = publish_uploaded_file(tmp_path, filename)
+                register_uploaded_file(filepath, hasher.hexdigest(), entry.basename,
+                                       request.remote_addr)
+                uploaded_files.append(os.path.basename(filepath))
+                observe_file_uploaded('archive', size, time.perf_counter() - started)
+                event_hub.finish(transfer, os.path.basename(filepath), size)
+            except OSError as e:
+                errors.append(f'儲存檔案 {entry.name} 時發生錯誤: {str(e)}')
+                upload_errors.inc(type='disk_error')
+                event_hub.finish(transfer, error=str(e))
+            except ArchiveEntryError as e:
+                errors.append(f'{entry.name}: {e}')
+                upload_errors.inc(type='corrupt_entry')
+                event_hub.finish(transfer, error=str(e))
+            except BaseException:
+                event_hub.finish(transfer, error='接收中斷')
+                raise
+            finally:
+                remove_incomplete_file(tmp_path)
+    except RequestEntityTooLarge:
+        upload_errors.inc(type='too_large')
+        raise
+    except AdmissionError as e:
+        # 接收途中空間或配額用完（未宣告大小或解壓後超出宣告大小的內容）
+        return admission_error_response(e)
+    except ArchiveFormatError as e:
+        errors.append(str(e))
+        upload_errors.inc(type='invalid_archive')
+    except Exception as e:
+        errors.append(f'接收上傳內容時發生錯誤: {str(e)}')
+        upload_errors.inc(type='receive_error')
+    finally:
+        uploads_in_flight.dec(api='archive')
+    
+    return upload_result_response(uploaded_files, errors, received_files)
+
+@app.route('/upload/check', methods=['POST'])
+def check_uploaded_hashes():
+    """查詢哪些SHA-256已經存在伺服器上（可略過上傳）"""
+    data = request.get_json(silent=True) or {}
+    hashes = [h.lower() for h in data.get('hashes', []) if is_sha256(h)]
+    return jsonify({'success': True, 'existing': file_index.existing_hashes(hashes)})
+
+@app.route('/upload/instant', methods=['POST'])
+def instant_upload():
+    """秒傳：內容已存在時直接以硬連結建立新檔案，不需要傳送資料"""
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename', '')
+    sha256 = str(data.get('sha256', '')).lower()
+    if not allowed_file(filename) or not is_sha256(sha256):
+        return jsonify({'success': False, 'message': '檔案名稱或雜湊值無效'}), 400
+    
+    existing_path = file_index.lookup(sha256)
+    if not existing_path:
+        return jsonify({'success': False, 'message': '伺服器上沒有相同內容的檔案'}), 404
+    
+    tmp_path = file_store.temp_path()
+    try:
+        try:
+            os.link(existing_path, tmp_path)
+        except OSError:
+            # 檔案系統不支援硬連結時改為複製
+            shutil.copyfile(existing_path, tmp_path)
+        filepath = publish_uploaded_file(tmp_path, build_stored_filename(filename))
+    except OSError as e:
+        remove_incomplete_file(tmp_path)
+        return jsonify({'success': False, 'message': f'儲存檔案時發生錯誤: {str(e)}'}), 500
+    register_uploaded_file(filepath, sha256, filename, request.remote_addr)
+    event_hub.file_completed(os.path.basename(filepath), filename, os.path.getsize(filepath),
+                             'instant', request.remote_addr)
+    return jsonify({'success': True, 'message': '成功上傳 1 個檔案',
+                    'files': [os.path.basename(filepath)]})
+
+@app.route('/upload/config')
+def upload_config():
+    """分段上傳與平行上傳的建議參數"""
+    return jsonify({
+        'chunk_size': DEFAULT_CHUNK_SIZE,
+        'max_chunk_size': MAX_CHUNK_SIZE,
+        'parallel_threshold': PARALLEL_UPLOAD_THRESHOLD,
+        'recommended_connections': PARALLEL_UPLOAD_CONNECTIONS,
+        'content_encodings': supported_encodings(),
+    })
+
+@app.route('/upload/sessions', methods=['POST'])
+def create_upload_session():
+    """建立分段上傳（相同 upload_key 會回傳既有進度以便續傳）"""
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename', '')
+    if not allowed_file(filename):
+        return jsonify({'success': False, 'message': f'檔案名稱無效: {filename}'}), 400
+    
+    size, upload_key = data.get('size'), data.get('upload_key')
+    try:
+        if upload_sessions.find_session(filename, size, upload_key) is None and isinstance(size, int):
+            admission.check_space(size)
+        session = upload_sessions.create_session(filename, size, upload_key)
+    except AdmissionError as e:
+        return admission_error_response(e)
+    except UploadSessionError as e:
+        return jsonify({'success': False, 'message': e.message}), e.status_code
+    
+    return jsonify({'success': True, 'chunk_size': DEFAULT_CHUNK_SIZE, **session.to_dict()})
+
+@app.route('/upload/sessions/<session_id>', methods=['GET'])
+def get_upload_session(session_id):
+    """查詢伺服器已收到的位元組區間"""
+    try:
+        session = upload_sessions.get_session(session_id)
+    except UploadSessionError as e:
+        return jsonify({'success': False, 'message': e.message}), e.status_code
+    return jsonify({'success': True, **session.to_dict()})
+
+def track_session_transfer(session_id):
+    """分段上傳的進度（同一個工作階段的所有區塊共用一筆，續傳時從已收到的位元組開始）"""
+    session = upload_sessions.get_session(session_id)
+    return event_hub.begin(session.filename, 'chunked', request.remote_addr,
+                           total=session.total_size, key=session_id,
+                           received=session.received_bytes)
+
+@app.route('/upload/sessions/<session_id>', methods=['PUT'])
+def upload_chunk(session_id):
+    """將請求內容寫入 ?offset= 指定的位移"""
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'success': False, 'message': '缺少 offset 參數'}), 400
+    
+    stream = open_request_body(request.stream, MAX_CHUNK_SIZE)
+    # 壓縮的區塊在解壓前不知道實際長度，讀到結束為止
+    length = (request.content_length
+              if is_identity_encoding(request.headers.get('Content-Encoding')) else None)
+    
+    uploads_in_flight.inc(api='chunked')
+    try:
+        transfer = track_session_transfer(session_id)
+        session = upload_sessions.write_chunk(session_id, offset, stream, length,
+                                              on_write=observe_disk_write('chunked', transfer))
+    except IncompleteChunkError as e:
+        upload_errors.inc(type='receive_error')
+        return jsonify({'success': False, 'message': e.message}), e.status_code
+    except UploadSessionError as e:
+        upload_errors.inc(type='chunk_error')
+        return jsonify({'success': False, 'message': e.message}), e.status_code
+    except RequestEntityTooLarge:
+        upload_errors.inc(type='too_large')
+        raise
+    except ClientDisconnected:
+        # 連線中斷：已寫入的部分已經記錄，手機從 next_offset 續傳
+        upload_errors.inc(type='receive_error')
+        return jsonify({'success': False, 'message': '接收區塊時連線中斷，請從 next_offset 續傳'}), 400
+    except ValueError as e:
+        # 壓縮內容損壞或不完整
+        upload_errors.inc(type='receive_error')
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        upload_errors.inc(type='disk_error')
+        return jsonify({'success': False, 'message': f'寫入區塊時發生錯誤: {str(e)}'}), 500
+    finally:
+        uploads_in_flight.dec(api='chunked')
+    return jsonify({'success': True, **session.to_dict()})
+
+@app.route('/upload/sessions/<session_id>/complete', methods=['POST'])
+def complete_upload_session(session_id):
+    """確認所有區塊都已收到，並將檔案移到上傳資料夾"""
+    def store(session):
+        # 平行上傳的區塊不依順序抵達，完成時才計算雜湊
+        sha256 = hash_file(session.part_path)
+        filepath = publish_uploaded_file(session.part_path, build_stored_filename(session.filename))
+        register_uploaded_file(filepath, sha256, session.filename, request.remote_addr)
+        observe_file_uploaded('chunked', session.total_size, time.time() - session.created)
+        return os.path.basename(filepath)
+    
+    try:
+        transfer = track_session_transfer(session_id)
+        filename = upload_sessions.finalize(session_id, store)
+    except UploadSessionError as e:
+        return jsonify({'success': False, 'message': e.message}), e.status_code
+    except Exception as e:
+        event_hub.finish(transfer, error=str(e))
+        return jsonify({'success': False, 'message': f'儲存檔案時發生錯誤: {str(e)}'}), 500
+    event_hub.finish(transfer, filename, transfer.total)
+    return jsonify({'success': True, 'message': '成功上傳 1 個檔案', 'files': [filename]})
+
+@app.route('/upload/sessions/<session_id>', methods=['DELETE'])
+def abort_upload_session(session_id):
+    """取消分段上傳"""
+    try:
+        transfer = track_session_transfer(session_id)
+        upload_sessions.abort(session_id)
+        event_hub.finish(transfer, error='已取消上傳')
+    except UploadSessionError as e:
+        return jsonify({'success': False, 'message': e.message}), e.status_code
+    return jsonify({'success': True, 'message': '已取消上傳'})
+
 @app.route('/status')
 def status():
     """系統狀態"""
-    upload_count = len([f for f in os.listdir(UPLOAD_FOLDER) if os.path.isfile(os.path.join(UPLOAD_FOLDER, f))])
-    
-    total_size = 0
-    for dirpath, dirnames, filenames in os.walk(UPLOAD_FOLDER):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            total_size += os.path.getsize(fp)
-    
+    upload_count, total_size = storage_stats.snapshot()
+    storage = {'landing': {'files': upload_count, 'bytes': total_size}}
+    if archive_mover is not None:
+        archived_count, archived_size = archive_stats.snapshot()
+        storage['archive'] = {'files': archived_count, 'bytes': archived_size,
+                              **archive_mover.status()}
+        upload_count += archived_count
+        total_size += archived_size
     size_mb = round(total_size / (1024 * 1024), 2)
     
     return jsonify({
         'upload_folder': UPLOAD_FOLDER,
         'total_files': upload_count,
         'total_size_mb': size_mb,
-        'available_ips': get_all_local_ips()
+        'available_ips': network_discovery.get_ips(),
+        'ip_ranking': ip_ranker.report(network_discovery.get_ips()),
+        'uploads': admission.status(),
+        'post_processing': job_queue.status(),
+        'event_watchers': event_hub.subscribers,
+        'profiling': profiler.status(),
+        'storage': storage
     })
 
-if __name__ == '__main__':
-    print("=" * 60)
-    print("📱 行動裝置檔案傳輸伺服器 (IP切換版)")
-    print("=" * 60)
+@app.route('/events')
+def progress_events():
+    """
+    上傳進度的Server-Sent Events串流（EventSource）
+    事件：progress（進行中的上傳與整體吞吐量）、files（完成的檔案）、jobs（後處理狀態）
+    """
+    try:
+        subscription = event_hub.subscribe(request.headers.get('Last-Event-ID', type=int))
+    except EventStreamFull as e:
+        response = jsonify({'success': False, 'message': str(e)})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(BUSY_RETRY_AFTER)
+        return response
+    response = Response(event_hub.stream(subscription), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # 避免反向代理緩衝事件
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def describe_indexed_file(entry):
+    """將檔案目錄紀錄轉為API回應格式"""
+    path = entry['path']
+    info = {
+        'name': path,
+        'original_name': entry['original_name'],
+        'size': entry['size'],
+        'mime_type': entry['mime_type'],
+        'uploaded_at': datetime.fromtimestamp(entry['uploaded_at']).isoformat(),
+        'client_ip': entry['client_ip'],
+        'sha256': entry['sha256'],
+        'tier': entry['tier'] or 'landing',
+        'url': url_for('download_file', name=path),
+    }
+    if is_image_file(path):
+        info['thumbnails'] = {str(size): url_for('get_thumbnail', size=size, name=path)
+                              for size in thumbnail_service.sizes}
+    return info
+
+def parse_date_param(value):
+    """將 YYYY-MM-DD 或ISO日期時間參數轉為epoch秒，未提供時回傳None"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f'無效的日期: {value}')
+
+def catalog_filters(args):
+    """/files 與 /files/zip 共用的排序與篩選參數"""
+    return {
+        'sort': args.get('sort', 'uploaded'),
+        'descending': args.get('order', 'desc') != 'asc',
+        'since': parse_date_param(args.get('since')),
+        'until': parse_date_param(args.get('until')),
+        'file_type': args.get('type'),
+        'client_ip': args.get('client'),
+    }
+
+@app.route('/files')
+def list_files():
+    """
+    列出已上傳的檔案（游標分頁）
+    參數: sort=uploaded|name|size, order=desc|asc, limit, cursor,
+          since/until（上傳日期）, type（image 或 image/jpeg）, client（來源IP）
+    """
+    args = request.args
+    try:
+        files, next_cursor = file_index.list_files(
+            cursor=args.get('cursor'),
+            limit=args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+            **catalog_filters(args)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    return jsonify({
+        'success': True,
+        'files': [describe_indexed_file(entry) for entry in files],
+        'next_cursor': next_cursor,
+    })
+
+@app.route('/thumbnails/<int:size>/<path:name>')
+def get_thumbnail(size, name):
+    """回傳快取的縮圖，尚未產生時排入背景並回應202"""
+    entry = file_index.get(name)
+    if size not in thumbnail_service.sizes or entry is None or not is_image_file(name):
+        return jsonify({'success': False, 'message': '找不到縮圖'}), 404
+    
+    # 封存的副本保留原本的修改時間，搬移前後的快取鍵相同
+    filepath = file_index.absolute_path(name, entry['tier'])
+    try:
+        mtime_ns = os.stat(filepath).st_mtime_ns
+    except OSError:
+        return jsonify({'success': False, 'message': '找不到檔案'}), 404
+    
+    key = thumbnail_service.cache_key(entry['sha256'], mtime_ns)
+    cached = thumbnail_service.get(key, size)
+    if cached:
+        return send_file(cached, mimetype='image/jpeg', max_age=86400)
+    
+    thumbnail_service.schedule(filepath, key)
+    return jsonify({'success': False, 'message': '縮圖產生中，請稍後再試'}), 202
+
+@app.route('/files/zip', methods=['GET', 'POST'])
+def download_zip():
+    """
+    將多個檔案即時打包成一個zip下載（邊讀邊送，不產生暫存檔）
+    參數 names（可重複，POST表單或JSON皆可）指定檔案；未指定時打包所有符合 /files 篩選條件的檔案
+    """
+    payload = request.get_json(silent=True) if request.is_json else None
+    names = payload.get('names', []) if isinstance(payload, dict) else request.values.getlist('names')
+    if names:
+        entries = []
+        for name in names:
+            filepath = resolve_upload_path(name) if isinstance(name, str) else None
+            if filepath is None:
+                return jsonify({'success': False, 'message': f'找不到檔案: {name}'}), 404
+            entries.append((filepath, name))
+    else:
+        try:
+            filters = catalog_filters(request.values)
+            file_index.list_files(limit=1, **filters)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        entries = ((file_index.absolute_path(entry['path'], entry['tier']), entry['path'])
+                   for entry in file_index.iter_files(**filters))
+
+    def generate():
+        for chunk in iter_zip_stream(entries):
+            sent_bytes.inc(len(chunk))
+            yield chunk
+
+    download_name = f"files_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return Response(generate(), mimetype='application/zip',
+                    headers={'Content-Disposition': content_disposition(download_name),
+                             'Cache-Control': 'no-store'})
+
+def resolve_upload_path(name):
+    """
+    上傳檔案的實際路徑，不存在或不允許存取時回傳None
+    先找落地層（上傳資料夾），已搬到封存層的檔案依檔案目錄記錄的儲存層找到同一個名稱
+    """
+    filepath = safe_join(UPLOAD_FOLDER, name)
+    if filepath is None or name.split('/')[0] == os.path.basename(DATA_FOLDER):
+        return None
+    if os.path.isfile(filepath):
+        return filepath
+    entry = file_index.get(name) if archive_mover is not None else None
+    if entry is None or entry['tier'] is None:
+        return None
+    # 名稱已由 safe_join 檢查，不會跳出資料夾
+    filepath = file_index.absolute_path(name, entry['tier'])
+    return filepath if os.path.isfile(filepath) else None
+
+@app.route('/download/<path:name>')
+def download_file(name):
+    """下載上傳資料夾中的檔案（支援Range與條件式請求），?inline=1 時直接在瀏覽器播放"""
+    filepath = resolve_upload_path(name)
+    if filepath is None:
+        return jsonify({'success': False, 'message': '找不到檔案'}), 404
     
-    # 獲取所有可用IP
-    original_ips = get_all_local_ips()
-    available_ips, preferred_ip = reorder_ips_by_preference(original_ips)
+    response = send_file_range(request, filepath,
+                               as_attachment=request.args.get('inline') != '1')
+    if request.method != 'HEAD' and response.content_length:
+        sent_bytes.inc(response.content_length)
+    return response
+
+@app.route('/speedtest/download')
+def speedtest_download():
+    """測速下載：送出 size MB 的資料（不讀取磁碟）"""
+    size_mb = max(1, min(MAX_DOWNLOAD_MB, request.args.get('size', DEFAULT_DOWNLOAD_MB, type=int)))
+    local_ip = request_local_ip()
+    
+    def generate():
+        started = time.perf_counter()
+        yield from iter_download(size_mb)
+        # 全部交給socket後才記錄（中斷時不記錄）
+        seconds = time.perf_counter() - started
+        sent_bytes.inc(size_mb * SPEEDTEST_BLOCK_SIZE)
+        if local_ip and seconds > 0:
+            ip_ranker.record_speedtest(local_ip, 'download', size_mb * SPEEDTEST_BLOCK_SIZE / seconds)
+    
+    response = Response(generate(), mimetype='application/octet-stream',
+                        headers={'Cache-Control': 'no-store'})
+    response.content_length = size_mb * SPEEDTEST_BLOCK_SIZE
+    return response
+
+@app.route('/speedtest/upload', methods=['POST'])
+def speedtest_upload():
+    """測速上傳：接收並丟棄請求內容（不寫入磁碟），回傳伺服器量到的速度"""
+    length = request.content_length
+    if not length:
+        return jsonify({'success': False, 'message': '需要Content-Length'}), 411
+    if length > MAX_SPEEDTEST_UPLOAD:
+        return jsonify({'success': False, 'message': '測速資料過大'}), 413
+    
+    started = time.perf_counter()
+    received = discard_request_body(request.environ, length)
+    seconds = time.perf_counter() - started
+    if received < length:
+        return jsonify({'success': False, 'message': '連線中斷'}), 400
     
+    rate = received / seconds if seconds > 0 else 0
+    local_ip = request_local_ip()
+    if local_ip:
+        ip_ranker.record_speedtest(local_ip, 'upload', rate)
+    return jsonify({
+        'success': True,
+        'bytes': received,
+        'seconds': round(seconds, 4),
+        'upload_mbps': round(rate * 8 / 1000 / 1000, 1),
+        'server_ip': local_ip,
+    })
+
+@app.route('/bandwidth')
+def bandwidth_status():
+    """各手機分配到的上傳速率、實際速度與佔整體的比例"""
+    return jsonify({'success': True, **bandwidth.status()})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus格式的效能指標"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+def parse_args(argv=None):
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description='行動裝置檔案傳輸伺服器')
+    parser.add_argument('--mode', choices=['production', 'dev'],
+                        default=os.environ.get('TRANSFER_SERVER_MODE', 'production'),
+                        help='production: cheroot多執行緒伺服器（預設）；dev: Flask開發伺服器')
+    parser.add_argument('--host', default='0.0.0.0', help='監聽的位址')
+    parser.add_argument('--port', type=int, default=5000, help='伺服器埠號')
+    parser.add_argument('--headless', action='store_true',
+                        default=os.environ.get('TRANSFER_HEADLESS') == '1',
+                        help='無介面模式：不開啟QR Code視窗，也不載入圖形介面模組')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help='同時處理的請求數')
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG, help='等待中的連線佇列長度')
+    parser.add_argument('--timeout', type=int, default=DEFAULT_TIMEOUT, help='連線閒置逾時（秒）')
+    parser.add_argument('--keepalive-connections', type=int, default=DEFAULT_KEEPALIVE_CONNECTIONS,
+                        help='保留的keep-alive閒置連線數')
+    parser.add_argument('--socket-buffer', type=int, default=SOCKET_BUFFER_SIZE,
+                        help='socket收送緩衝區大小（位元組）')
+    parser.add_argument('--max-uploads', type=int, default=DEFAULT_MAX_UPLOADS,
+                        help='整體同時上傳數上限')
+    parser.add_argument('--max-uploads-per-client', type=int, default=DEFAULT_MAX_UPLOADS_PER_CLIENT,
+                        help='單一手機同時上傳數上限')
+    parser.add_argument('--quota-gb', type=float, default=None,
+                        help='上傳資料夾的容量上限（GB），預設不限制')
+    parser.add_argument('--fsync', choices=FSYNC_POLICIES, default=file_store.policy,
+                        help='none: 交給作業系統（預設，最快，斷電可能遺失最近的檔案）；'
+                             'file: 每個檔案都寫入磁碟才回應；group: 檔案逐一寫入磁碟，資料夾批次寫入')
+    parser.add_argument('--organize-by-date', action='store_true', default=ORGANIZE_BY_DATE,
+                        help='上傳後在背景將照片依拍攝日期移動到 YYYY/MM 資料夾')
+    parser.add_argument('--bandwidth-limit', type=float, default=None,
+                        help='整體上傳頻寬（MB/s）；設定後依優先等級在手機之間公平分配')
+    parser.add_argument('--client-bandwidth-limit', type=float, default=None,
+                        help='單一手機的上傳頻寬上限（MB/s）')
+    parser.add_argument('--profile', action='store_true', default=profiler.enabled,
+                        help='記錄每個請求各階段的時間，慢請求的報告寫到剖析資料夾')
+    parser.add_argument('--profile-threshold', type=float, default=PROFILE_THRESHOLD,
+                        help='超過這個秒數的請求寫出剖析報告')
+    parser.add_argument('--profile-sample', type=float, default=0.0,
+                        help='以cProfile記錄函式呼叫的請求比例（0～1，預設0）')
+    parser.add_argument('--profile-dir', default=profiler.directory, help='剖析報告的資料夾')
+    parser.add_argument('--archive', default=os.environ.get('TRANSFER_ARCHIVE'), metavar='位置',
+                        help='封存層（例如 /mnt/nas/photos 或 dir:/mnt/nas/photos）；'
+                             '上傳寫入上傳資料夾後在背景搬到封存層')
+    parser.add_argument('--archive-workers', type=int, default=DEFAULT_ARCHIVE_WORKERS,
+                        help='同時搬移的檔案數')
+    parser.add_argument('--archive-bandwidth', type=float, default=None,
+                        help='搬移到封存層的頻寬上限（MB/s），預設不限制')
+    parser.add_argument('--archive-delay', type=float, default=0,
+                        help='上傳後經過幾秒才搬到封存層')
+    parser.add_argument('--priority', action='append', default=[], metavar='IP=等級',
+                        help=f'手機的優先等級（{"、".join(PRIORITY_WEIGHTS)}），可重複指定')
+    args = parser.parse_args(argv)
+    try:
+        args.priority = parse_priorities(args.priority)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+def display_available():
+    """是否有可用的圖形顯示環境（Linux沒有DISPLAY時無法開啟視窗）"""
+    if sys.platform.startswith('linux'):
+        return bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+    return True
+
+def print_startup_info(available_ips, preferred_ip, port, headless):
+    """顯示啟動資訊"""
     print(f"🔍 偵測到 {len(available_ips)} 個網路介面:")
     for i, ip in enumerate(available_ips, 1):
         prefix = "⭐ " if ip == preferred_ip else "   "
         print(f"{prefix}{i}. {ip}")
     
     print(f"📁 檔案將儲存到: {os.path.abspath(UPLOAD_FOLDER)}")
+    if archive_mover is not None:
+        print(f"🗄️ 上傳完成後在背景搬到封存層: {os.path.abspath(archive_mover.target.root)}")
     print("✅ 檔案類型: 支援所有類型的檔案上傳")
+    if profiler.enabled:
+        print(f"🔬 效能剖析已啟用: 超過 {profiler.threshold} 秒的請求寫入 {os.path.abspath(profiler.directory)}")
     
-    port = 5000
-    
-    if len(available_ips) == 1:
-        print(f"\n🌐 伺服器將啟動在: http://{available_ips[0]}:{port}")
+    if headless:
+        print("\n🖥️ 無介面模式，請在手機瀏覽器輸入以下任一網址:")
+        for ip in available_ips:
+            print(f"   {qr_url(ip, port)}")
+    elif len(available_ips) == 1:
+        print(f"\n🌐 伺服器已啟動在: http://{available_ips[0]}:{port}")
         print("📱 將顯示QR Code視窗...")
     else:
-        print(f"\n🌐 伺服器將啟動在埠號: {port}")
+        print(f"\n🌐 伺服器已啟動在埠號: {port}")
         print("📱 將顯示可切換IP的QR Code視窗...")
         print("🔄 可使用「下一個IP」按鈕或快捷鍵切換不同網路")
     
-    print("\n💡 使用提示:")
-    if preferred_ip:
-        print(f"   - ⭐ 將優先使用偏好IP: {preferred_ip}")
-    print("   - 先嘗試第一個IP")
-    print("   - 如果手機無法連接，點擊「下一個IP」")
-    print("   - 連接成功後，可點擊「⭐ 設為預設IP」儲存偏好")
-    print("   - 可使用 ← → 鍵或空白鍵快速切換")
-    print("   - Ctrl+C 可快速複製當前網址")
+    if not headless:
+        print("\n💡 使用提示:")
+        if preferred_ip:
+            print(f"   - ⭐ 將優先使用偏好IP: {preferred_ip}")
+        print("   - 先嘗試第一個IP")
+        print("   - 如果手機無法連接，點擊「下一個IP」")
+        print("   - 連接成功後，可點擊「⭐ 設為預設IP」儲存偏好")
+        print("   - 可使用 ← → 鍵或空白鍵快速切換")
+        print("   - Ctrl+C 可快速複製當前網址")
     
     print("\n按 Ctrl+C 停止伺服器")
     print("=" * 60)
+
+def main(argv=None):
+    """啟動伺服器"""
+    global ORGANIZE_BY_DATE
+    args = parse_args(argv)
+    ORGANIZE_BY_DATE = args.organize_by_date
+    file_store.policy = args.fsync
+    upload_sessions.fsync_policy = args.fsync
+    # 繼續上次未完成的後處理工作
+    job_queue.start()
+    # 補登索引建立前就存在的檔案（已登記且未變動的直接略過）
+    file_index.start_backfill(exclude=[os.path.basename(DATA_FOLDER)])
+    admission.max_uploads = args.max_uploads
+    admission.max_uploads_per_client = args.max_uploads_per_client
+    if args.quota_gb is not None:
+        admission.quota_bytes = int(args.quota_gb * 1024 ** 3)
+    profiler.configure(args.profile, args.profile_threshold, args.profile_sample, args.profile_dir)
+    bandwidth.configure(
+        total_limit=int(args.bandwidth_limit * 1024 * 1024) if args.bandwidth_limit else None,
+        client_limit=(int(args.client_bandwidth_limit * 1024 * 1024)
+                      if args.client_bandwidth_limit else None),
+        priorities=args.priority)
+    if args.archive:
+        try:
+            configure_archive(args.archive, args.archive_workers,
+                              int(args.archive_bandwidth * 1024 * 1024) if args.archive_bandwidth else None,
+                              args.archive_delay)
+        except (ValueError, OSError) as e:
+            print(f"❌ 無法啟用封存層: {e}")
+            return
+    headless = args.headless or not display_available()
+    port = args.port
     
-    # 啟動QR code視窗
-    start_qr_window(available_ips, port)
+    print("=" * 60)
+    print("📱 行動裝置檔案傳輸伺服器 (IP切換版)")
+    print("=" * 60)
     
-    import time
-    time.sleep(1)
+    def on_ready():
+        """socket已開始監聽後才偵測網路與開啟視窗，手機不必等待介面載入"""
+        # 獲取所有可用IP，之後由背景執行緒監看介面變動
+        original_ips = network_discovery.get_ips()
+        network_discovery.start()
+        available_ips, preferred_ip = reorder_ips_by_preference(original_ips)
+        print_startup_info(available_ips, preferred_ip, port, headless)
+        if not headless:
+            start_qr_window(available_ips, port)
     
     try:
-        app.run(host='0.0.0.0', port=port, debug=False)
+        if args.mode == 'production' and production_server_available():
+            print(f"🚀 正式環境模式: {args.threads} 個工作執行緒，keep-alive 已啟用")
+            # 每條 /events 連線佔用一個工作執行緒，最多讓觀看者用掉一半
+            event_hub.max_subscribers = subscriber_limit(args.threads)
+            run_production_server(app, args.host, port,
+                                  on_ready=on_ready,
+                                  threads=args.threads,
+                                  backlog=args.backlog,
+                                  timeout=args.timeout,
+                                  keepalive_connections=args.keepalive_connections,
+                                  socket_buffer_size=args.socket_buffer)
+        else:
+            if args.mode == 'production':
+                print("⚠️ 未安裝cheroot，改用開發伺服器（pip install cheroot）")
+            on_ready()
+            app.run(host=args.host, port=port, debug=False, threaded=True)
     except KeyboardInterrupt:
         print("\n\n👋 伺服器已停止")
     except Exception as e:
-        print(f"\n❌ 伺服器錯誤: {e}") 
\ No newline at end of file
+        print(f"\n❌ 伺服器錯誤: {e}")
+    finally:
+        event_hub.close()
+        thumbnail_service.shutdown()
+        ip_ranker.save()
+
+if __name__ == '__main__':
+    # 打包成執行檔後，縮圖工作程序需要這一行才能正常啟動
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+串流解開封存檔上傳
+zip與tar（可gzip/bz2/xz壓縮）邊接收邊逐一取出項目，每個項目直接寫入最終位置，
+不需要先把整個封存檔存到磁碟。zip依序讀取各項目前的本地檔頭，不需要檔尾的中央目錄
+"""
+
+import struct
+import tarfile
+import zlib
+
+from multipart_stream import READ_BUFFER_SIZE, save_chunks
+
+ZIP_LOCAL_HEADER = 0x04034b50
+ZIP_CENTRAL_HEADER = 0x02014b50
+ZIP_END_RECORD = 0x06054b50
+ZIP_DATA_DESCRIPTOR = 0x08074b50
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+
+# 作業系統自動產生、不屬於使用者檔案的項目
+IGNORED_PREFIXES = ('__MACOSX/',)
+
+
+class ArchiveFormatError(ValueError):
+    """封存檔格式錯誤，無法繼續解析"""
+
+
+class ArchiveEntryError(ValueError):
+    """單一項目損壞（其餘項目仍可繼續）"""
+
+
+class _StreamReader:
+    """包裝請求串流，可將多讀的資料退回"""
+
+    def __init__(self, stream, buffer_size=READ_BUFFER_SIZE):
+        self._stream = stream
+        self._buffer_size = buffer_size
+        self._pending = b''
+
+    def read(self, size=-1):
+        if self._pending:
+            if size < 0 or size >= len(self._pending):
+                data, self._pending = self._pending, b''
+            else:
+                data, self._pending = self._pending[:size], self._pending[size:]
+            return data
+        return self._stream.read(size if size >= 0 else self._buffer_size)
+
+    def read_exact(self, size):
+        parts = []
+        while size > 0:
+            data = self.read(min(size, self._buffer_size))
+            if not data:
+                raise ArchiveFormatError('封存檔內容不完整')
+            parts.append(data)
+            size -= len(data)
+        return b''.join(parts)
+
+    def unread(self, data):
+        if data:
+            self._pending = data + self._pending
+
+
+class ArchiveEntry:
+    """封存檔中的一個檔案，資料必須在取得下一個項目前讀完"""
+
+    def __init__(self, name, chunks):
+        self.name = name
+        self._chunks = chunks
+        self.finished = False
+
+    @property
+    def basename(self):
+        """去掉目錄的檔名（與手機瀏覽器上傳時送出的檔名相同）"""
+        return self.name.replace('\\', '/').rstrip('/').rsplit('/', 1)[-1]
+
+    def iter_chunks(self):
+        for data in self._chunks:
+            yield data
+        self.finished = True
+
+    def drain(self):
+        for _ in self.iter_chunks():
+            pass
+
+    def save(self, path, **options):
+        """寫入指定路徑，回傳寫入的位元組數（參數同 save_chunks）"""
+        try:
+            return save_chunks(path, self.iter_chunks(), **options)
+        except OSError:
+            self.drain()
+            raise
+
+
+def _iter_tar(reader):
+    try:
+        with tarfile.open(fileobj=reader, mode='r|*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                fileobj = tar.extractfile(member)
+                remaining = member.size
+
+                def chunks(fileobj=fileobj, remaining=remaining):
+                    while remaining > 0:
+                        data = fileobj.read(min(READ_BUFFER_SIZE, remaining))
+                        if not data:
+                            raise ArchiveFormatError('封存檔內容不完整')
+                        remaining -= len(data)
+                        yield data
+
+                yield ArchiveEntry(member.name, chunks())
+    except tarfile.TarError as e:
+        raise ArchiveFormatError(f'tar格式錯誤: {e}')
+
+
+def _zip64_sizes(extra, compressed, uncompressed):
+    """從zip64延伸欄位取出實際大小"""
+    position = 0
+    while position + 4 <= len(extra):
+        header_id, length = struct.unpack_from('<HH', extra, position)
+        if header_id == 0x0001:
+            values = extra[position + 4:position + 4 + length]
+            offset = 0
+            if uncompressed == 0xFFFFFFFF:
+                uncompressed = struct.unpack_from('<Q', values, offset)[0]
+                offset += 8
+            if compressed == 0xFFFFFFFF:
+                compressed = struct.unpack_from('<Q', values, offset)[0]
+            return compressed, uncompressed, True
+        position += 4 + length
+    return compressed, uncompressed, False
+
+
+def _iter_zip_data(reader, method, compressed, uncompressed, crc, has_descriptor, zip64):
+    """產生一個zip項目解壓後的資料並檢查CRC"""
+    actual_crc = 0
+    produced = 0
+    if method == ZIP_STORED:
+        remaining = compressed
+        while remaining > 0:
+            data = reader.read(min(READ_BUFFER_SIZE, remaining))
+            if not data:
+                raise ArchiveFormatError('封存檔內容不完整')
+            remaining -= len(data)
+            actual_crc = zlib.crc32(data, actual_crc)
+            produced += len(data)
+            yield data
+    else:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        remaining = None if has_descriptor else compressed
+        while not decompressor.eof:
+            size = READ_BUFFER_SIZE if remaining is None else min(READ_BUFFER_SIZE, remaining)
+            data = reader.read(size) if size else b''
+            if not data:
+                raise ArchiveFormatError('封存檔內容不完整')
+            if remaining is not None:
+                remaining -= len(data)
+            output = decompressor.decompress(data)
+            if output:
+                produced += len(output)
+                if not has_descriptor and produced > uncompressed:
+                    raise ArchiveFormatError('zip項目解壓後大小與宣告不符')
+                actual_crc = zlib.crc32(output, actual_crc)
+                yield output
+        # 壓縮資料結束後多讀的部分屬於下一個項目
+        reader.unread(decompressor.unused_data)
+        if remaining:
+            reader.read_exact(remaining)
+
+    if has_descriptor:
+        signature = reader.read_exact(4)
+        if struct.unpack('<I', signature)[0] == ZIP_DATA_DESCRIPTOR:
+            signature = reader.read_exact(4)
+        crc = struct.unpack('<I', signature)[0]
+        reader.read_exact(16 if zip64 else 8)
+    if actual_crc != crc:
+        raise ArchiveEntryError('CRC檢查失敗，檔案內容損壞')
+
+
+def _iter_zip(reader):
+    while True:
+        header = reader.read_exact(4)
+        signature = struct.unpack('<I', header)[0]
+        if signature in (ZIP_CENTRAL_HEADER, ZIP_END_RECORD):
+            # 之後是中央目錄，所有項目都已讀完
+            while reader.read(READ_BUFFER_SIZE):
+                pass
+            return
+        if signature != ZIP_LOCAL_HEADER:
+            raise ArchiveFormatError('zip格式錯誤')
+
+        (_, _version, flags, method, _time, _date, crc, compressed, uncompressed,
+         name_length, extra_length) = _LOCAL_HEADER.unpack(header + reader.read_exact(26))
+        raw_name = reader.read_exact(name_length)
+        extra = reader.read_exact(extra_length)
+        name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437', 'replace')
+        compressed, uncompressed, zip64 = _zip64_sizes(extra, compressed, uncompressed)
+        has_descriptor = bool(flags & 0x08)
+
+        if flags & 0x01:
+            raise ArchiveFormatError(f'不支援加密的zip: {name}')
+        if method not in (ZIP_STORED, ZIP_DEFLATED):
+            raise ArchiveFormatError(f'不支援的壓縮方式 {method}: {name}')
+        if method == ZIP_STORED and has_descriptor:
+            raise ArchiveFormatError(f'無法串流解開未壓縮且沒有大小資訊的項目: {name}')
+
+        chunks = _iter_zip_data(reader, method, compressed, uncompressed, crc, has_descriptor, zip64)
+        if name.endswith('/'):
+            for _ in chunks:
+                pass
+            continue
+        yield ArchiveEntry(name, chunks)
+
+
+def iter_archive_entries(stream):
+    """依序產生封存檔中的每個檔案（略過目錄、連結等），格式依內容自動判斷"""
+    reader = _StreamReader(stream)
+    head = reader.read(4)
+    reader.unread(head)
+    if not head:
+        raise ArchiveFormatError('沒有收到封存檔內容')
+
+    entries = _iter_zip(reader) if head == b'PK\x03\x04' else _iter_tar(reader)
+    for entry in entries:
+        if entry.name.startswith(IGNORED_PREFIXES) or not entry.basename:
+            entry.drain()
+            continue
+        yield entry
+        if not entry.finished:
+            entry.drain()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+原子寫入與不衝突的檔名
+上傳內容先寫入暫存檔，完整收到後才以硬連結建立最終檔名（已存在時加上流水號）再刪除暫存檔，
+中斷時只會留下暫存檔，不會出現看似完整卻被截斷的檔案，同一秒上傳的同名檔案也不會互相覆蓋。
+
+fsync策略：
+  none   交給作業系統排程寫回（預設，與不使用暫存檔時相同；斷電時可能遺失最近上傳的檔案）
+  file   每個檔案發布前fsync檔案，發布後fsync資料夾（最安全，最慢）
+  group  由背景執行緒將同一時間完成的檔案合併成一批：逐一fsync整批的檔案後一起發布，
+         每個資料夾只fsync一次；合併的是資料夾的fsync與執行緒切換，檔案本身仍各fsync一次。
+         上傳請求等到所屬的批次寫入後才回應
+"""
+
+import os
+import time
+import uuid
+import threading
+
+FSYNC_POLICIES = ('file', 'group', 'none')
+DEFAULT_FSYNC_POLICY = 'none'
+GROUP_COMMIT_WINDOW = 0.005         # 收集同一批檔案的等待秒數
+MAX_NAME_ATTEMPTS = 1000
+STALE_TEMP_SECONDS = 6 * 3600       # 超過這個時間的暫存檔視為上次中斷留下的
+
+
+def fsync_file(path):
+    """將檔案內容寫入磁碟（Windows需以可寫入模式開啟才能flush）"""
+    fd = os.open(path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_dir(path):
+    """將資料夾項目（新檔名）寫入磁碟；Windows無法開啟資料夾，由檔案系統自行處理"""
+    if os.name == 'nt':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def link_unique_name(source, folder, filename, taken=None):
+    """
+    以硬連結在 folder 中建立不存在的檔名（filename、name_1.ext、name_2.ext…）指向 source，回傳最終路徑
+    os.link 在檔名已存在時失敗（EEXIST）就試下一個，不需要先建立佔位的空檔案，
+    當機時最終檔名不是不存在就是完整的內容；已經是 source 硬連結的檔名（上次中斷時建立的）直接沿用。
+    source 仍然保留，由呼叫端刪除（不支援硬連結的檔案系統改為改名，之後 source 就不存在了）。
+    taken(path) 回傳True的檔名也會略過（例如已搬到其他儲存層的檔案）
+    """
+    base, ext = os.path.splitext(filename)
+    for attempt in range(MAX_NAME_ATTEMPTS):
+        candidate = filename if attempt == 0 else f'{base}_{attempt}{ext}'
+        path = os.path.join(folder, candidate)
+        if taken is not None and taken(path):
+            continue
+        try:
+            _link_or_rename(source, path)
+        except FileExistsError:
+            try:
+                if os.path.samefile(source, path):
+                    return path
+            except OSError:
+                pass
+            continue
+        return path
+    raise FileExistsError(f'找不到可用的檔名: {filename}')
+
+
+def move_to_unique_name(source, folder, filename, taken=None):
+    """將 source 移到 folder 中不存在的檔名（見 link_unique_name），回傳最終路徑"""
+    path = link_unique_name(source, folder, filename, taken)
+    try:
+        os.remove(source)
+    except FileNotFoundError:
+        pass
+    return path
+
+
+def _link_or_rename(source, path):
+    """以 path 為名發布 source，path 已存在時拋出FileExistsError"""
+    try:
+        os.link(source, path)
+    except FileExistsError:
+        raise
+    except OSError:
+        # 不支援硬連結的檔案系統（例如FAT32、exFAT）：Windows的 os.rename 在目的地存在時失敗，
+        # 其他系統的 os.rename 會覆蓋，只能先檢查再改名
+        if os.name != 'nt' and os.path.lexists(path):
+            raise FileExistsError(path)
+        os.rename(source, path)
+
+
+class _PendingCommit:
+    def __init__(self, temp_path, filename):
+        self.temp_path = temp_path
+        self.filename = filename
+        self.final_path = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class FileStore:
+    """上傳資料夾的寫入：暫存檔 → 硬連結到不衝突的檔名"""
+
+    def __init__(self, folder, temp_dir, policy=DEFAULT_FSYNC_POLICY,
+                 group_window=GROUP_COMMIT_WINDOW):
+        if policy not in FSYNC_POLICIES:
+            raise ValueError(f'不支援的fsync策略: {policy}')
+        self.folder = folder
+        self.temp_dir = temp_dir
+        self.policy = policy
+        self.group_window = group_window
+        # name_taken(path)：資料夾外已使用的檔名（見 link_unique_name）
+        self.name_taken = None
+        os.makedirs(temp_dir, exist_ok=True)
+        self._condition = threading.Condition()
+        self._pending = []
+        self._committer = None
+        self.cleanup_stale()
+
+    def cleanup_stale(self):
+        """刪除上次中斷時留下的暫存檔"""
+        cutoff = time.time() - STALE_TEMP_SECONDS
+        try:
+            with os.scandir(self.temp_dir) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file() and entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+
+    def temp_path(self):
+        """新的暫存檔路徑（與上傳資料夾在同一個檔案系統，才能原子改名）"""
+        return os.path.join(self.temp_dir, uuid.uuid4().hex + '.part')
+
+    def publish(self, temp_path, filename):
+        """將寫完的暫存檔發布為 filename（衝突時自動改名），依fsync策略確保寫入，回傳最終路徑"""
+        if self.policy == 'group':
+            return self._publish_group(temp_path, filename)
+        if self.policy == 'file':
+            fsync_file(temp_path)
+        final_path = self._rename(temp_path, filename)
+        if self.policy == 'file':
+            fsync_dir(self.folder)
+        return final_path
+
+    def _rename(self, temp_path, filename):
+        return move_to_unique_name(temp_path, self.folder, filename, self.name_taken)
+
+    # ---- group commit ----
+
+    def _publish_group(self, temp_path, filename):
+        item = _PendingCommit(temp_path, filename)
+        with self._condition:
+            self._pending.append(item)
+            if self._committer is None:
+                self._committer = threading.Thread(target=self._run_committer, name='group-commit',
+                                                   daemon=True)
+                self._committer.start()
+            self._condition.notify()
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.final_path
+
+    def _run_committer(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+            # 稍等一下，讓同時完成的上傳併入同一批
+            time.sleep(self.group_window)
+            with self._condition:
+                batch, self._pending = self._pending, []
+            try:
+                self._commit_batch(batch)
+            except Exception as e:
+                for item in batch:
+                    if item.final_path is None and item.error is None:
+                        item.error = e
+                    item.done.set()
+
+    def _commit_batch(self, batch):
+        synced = []
+        for item in batch:
+            try:
+                fsync_file(item.temp_path)
+                synced.append(item)
+            except OSError as e:
+                item.error = e
+        published = []
+        for item in synced:
+            try:
+                item.final_path = self._rename(item.temp_path, item.filename)
+                published.append(item)
+            except OSError as e:
+                item.error = e
+        if published:
+            try:
+                fsync_dir(self.folder)
+            except OSError as e:
+                print(f"fsync資料夾失敗 {self.folder}: {e}")
+        for item in batch:
+            item.done.set()
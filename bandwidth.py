@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上傳頻寬的公平分配
+每台手機（依 request.remote_addr）一個權杖桶，另有一個整體權杖桶；讀取請求內容後扣除權杖，
+權杖不足（欠額）時等待補足再繼續讀取，TCP自然會放慢該手機的傳送速度。
+各手機的速率每 REBALANCE_INTERVAL 秒依權重做最大最小公平分配：
+用不完配額的手機（例如2.4GHz訊號較弱）只分到它實際用得到的速度，剩下的由其他手機依權重平分；
+同一台手機開再多條連線也共用同一個桶，不會排擠其他手機。
+未設定整體上限時不做公平分配，只套用各手機的上限；完全沒有設定上限時不包裝串流，沒有額外成本
+"""
+
+import threading
+import time
+
+PRIORITY_WEIGHTS = {'high': 4, 'normal': 2, 'low': 1}
+DEFAULT_PRIORITY = 'normal'
+REBALANCE_INTERVAL = 0.5            # 重新分配速率的間隔（秒）
+BURST_SECONDS = 0.25                # 每台手機的權杖桶容量：可以連續傳送多久的量
+TOTAL_BURST_SECONDS = 1.0           # 整體權杖桶的容量（各手機的配額加總已不超過整體上限，
+                                    # 整體桶只在重新分配之前的短暫超量時才需要介入）
+MIN_BURST = 256 * 1024              # 權杖桶容量下限（至少容納一次讀取）
+MIN_RATE = 64 * 1024                # 分配給每台手機的最低速率
+ACTIVE_TIMEOUT = 2.0                # 超過這個時間沒有讀取就不列入分配
+STALE_SECONDS = 600                 # 超過這個時間沒有上傳就不再列出
+DEMAND_HEADROOM = 1.25              # 沒用滿配額的手機保留的成長空間
+RATE_SMOOTHING = 0.5                # 實際速度的指數移動平均權重
+
+
+def parse_priorities(values):
+    """解析 IP=等級 形式的設定（例如 192.168.1.20=high）"""
+    priorities = {}
+    for value in values or []:
+        client, _, priority = value.partition('=')
+        priority = priority.strip().lower()
+        if not client.strip() or priority not in PRIORITY_WEIGHTS:
+            raise ValueError(f'優先等級設定無效: {value}（等級: {", ".join(PRIORITY_WEIGHTS)}）')
+        priorities[client.strip()] = priority
+    return priorities
+
+
+class TokenBucket:
+    """權杖桶：權杖可以扣成負數（欠額），take() 回傳需要等待的秒數"""
+
+    def __init__(self, rate, burst_seconds=BURST_SECONDS):
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def capacity(self):
+        return max(MIN_BURST, self.rate * self.burst_seconds)
+
+    def set_rate(self, rate, now):
+        self._refill(now)
+        self.rate = rate
+        self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, nbytes, now):
+        self._refill(now)
+        self.tokens -= nbytes
+        return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class ClientShare:
+    """一台手機的配額與實際速度"""
+
+    def __init__(self, client, priority):
+        self.client = client
+        self.priority = priority
+        self.limit = None               # 目前分配的速率（None表示不限制）
+        self.bucket = None
+        self.rate = 0.0                 # 實際速度
+        self.received = 0
+        self.last_active = 0.0
+        # 是否受配額限制（曾等待權杖）；新加入的手機在量到速度之前也視為需要更多
+        self.hungry = True
+        self._waited = False
+        self._window_bytes = 0
+
+    @property
+    def weight(self):
+        return PRIORITY_WEIGHTS[self.priority]
+
+    def set_limit(self, limit, now):
+        self.limit = limit
+        if limit is None:
+            self.bucket = None
+        elif self.bucket is None:
+            self.bucket = TokenBucket(limit)
+        else:
+            self.bucket.set_rate(limit, now)
+
+
+class ThrottledStream:
+    """依權杖限制讀取速度的請求串流"""
+
+    def __init__(self, stream, scheduler, share):
+        self._stream = stream
+        self._scheduler = scheduler
+        self._share = share
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        if data:
+            self._scheduler._consume(self._share, len(data))
+        return data
+
+
+class BandwidthScheduler:
+    """依手機分配上傳頻寬（速率單位皆為位元組/秒）"""
+
+    def __init__(self, total_limit=None, client_limit=None, priorities=None):
+        self._lock = threading.Lock()
+        self._shares = {}
+        self._total_bucket = None
+        self._last_rebalance = time.monotonic()
+        self.configure(total_limit, client_limit, priorities)
+
+    def configure(self, total_limit=None, client_limit=None, priorities=None):
+        """設定整體上限、每台手機的上限與優先等級（{IP: 'high'|'normal'|'low'}）"""
+        now = time.monotonic()
+        with self._lock:
+            self.total_limit = total_limit
+            self.client_limit = client_limit
+            self.priorities = dict(priorities or {})
+            self._total_bucket = TokenBucket(total_limit, TOTAL_BURST_SECONDS) if total_limit else None
+            for share in self._shares.values():
+                share.priority = self.priorities.get(share.client, DEFAULT_PRIORITY)
+            self._allocate(now)
+
+    @property
+    def enabled(self):
+        return bool(self.total_limit or self.client_limit)
+
+    def throttle(self, stream, client):
+        """包裝請求串流；沒有設定任何上限時原樣回傳"""
+        if not self.enabled:
+            return stream
+        now = time.monotonic()
+        with self._lock:
+            share = self._shares.get(client)
+            if share is None:
+                share = self._shares[client] = ClientShare(
+                    client, self.priorities.get(client, DEFAULT_PRIORITY))
+                # 新加入的手機立即分到一份，不必等下一次重新分配
+                share.last_active = now
+                self._allocate(now)
+        return ThrottledStream(stream, self, share)
+
+    def _consume(self, share, nbytes):
+        """扣除權杖，欠額時等待（不持有鎖，其他手機照常讀取）"""
+        now = time.monotonic()
+        with self._lock:
+            share.last_active = now
+            share.received += nbytes
+            share._window_bytes += nbytes
+            if now - self._last_rebalance >= REBALANCE_INTERVAL:
+                self._measure(now)
+                self._allocate(now)
+            wait = share.bucket.take(nbytes, now) if share.bucket is not None else 0
+            if self._total_bucket is not None:
+                wait = max(wait, self._total_bucket.take(nbytes, now))
+            if wait > 0:
+                share._waited = True
+                # 等待權杖的期間仍算是進行中的上傳
+                share.last_active = now + wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def _measure(self, now):
+        """更新各手機的實際速度，移除太久沒有上傳的手機（呼叫時須持有鎖）"""
+        elapsed = now - self._last_rebalance
+        self._last_rebalance = now
+        for client, share in list(self._shares.items()):
+            rate = share._window_bytes / elapsed
+            share.rate += RATE_SMOOTHING * (rate - share.rate)
+            share._window_bytes = 0
+            share.hungry, share._waited = share._waited, False
+            if now - share.last_active >= ACTIVE_TIMEOUT:
+                share.rate = 0.0
+                if now - share.last_active > STALE_SECONDS:
+                    del self._shares[client]
+
+    def _allocate(self, now):
+        """依實際速度與權重重新分配各手機的速率（呼叫時須持有鎖）"""
+        active = [share for share in self._shares.values() if now - share.last_active < ACTIVE_TIMEOUT]
+        if not self.total_limit:
+            for share in self._shares.values():
+                share.set_limit(self.client_limit, now)
+            return
+
+        # 加權最大最小公平分配（water-filling）
+        demands = {}
+        for share in active:
+            demand = self.client_limit or float('inf')
+            if not share.hungry and not share._waited:
+                # 沒用滿配額（不曾等待權杖）：只保留實際用量加上成長空間，多的讓給其他手機
+                demand = min(demand, max(share.rate * DEMAND_HEADROOM, MIN_RATE))
+            demands[share.client] = demand
+        allocation = {}
+        remaining = self.total_limit
+        pending = list(active)
+        while pending:
+            unit = remaining / sum(share.weight for share in pending)
+            satisfied = [share for share in pending if demands[share.client] <= unit * share.weight]
+            if not satisfied:
+                for share in pending:
+                    allocation[share.client] = unit * share.weight
+                break
+            for share in satisfied:
+                allocation[share.client] = demands[share.client]
+                remaining -= demands[share.client]
+                pending.remove(share)
+        # 分配後仍有剩餘（所有手機都用不完）時，依權重加給各手機，讓它們有成長的空間
+        leftover = self.total_limit - sum(allocation.values())
+        total_weight = sum(share.weight for share in active)
+        for share in active:
+            bonus = leftover * share.weight / total_weight if leftover > 0 else 0
+            limit = allocation[share.client] + bonus
+            if self.client_limit:
+                limit = min(limit, self.client_limit)
+            share.set_limit(max(limit, MIN_RATE), now)
+        # 閒置的手機恢復上傳時先以一份平均配額開始
+        for share in self._shares.values():
+            if share not in active:
+                limit = self.total_limit * share.weight / (total_weight + share.weight)
+                share.set_limit(min(limit, self.client_limit) if self.client_limit else limit, now)
+
+    def status(self):
+        """各手機目前分配的速率、實際速度與佔整體的比例"""
+        now = time.monotonic()
+        with self._lock:
+            shares = sorted(self._shares.values(), key=lambda s: s.rate, reverse=True)
+            total_rate = sum(share.rate for share in shares)
+            return {
+                'enabled': self.enabled,
+                'total_limit': self.total_limit,
+                'client_limit': self.client_limit,
+                'throughput': round(total_rate),
+                'clients': [{
+                    'client': share.client,
+                    'priority': share.priority,
+                    'weight': share.weight,
+                    'active': now - share.last_active < ACTIVE_TIMEOUT,
+                    'limit': round(share.limit) if share.limit is not None else None,
+                    'rate': round(share.rate),
+                    'share': round(share.rate / total_rate, 3) if total_rate else 0,
+                    'received': share.received,
+                } for share in shares],
+            }
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上傳效能測試
+在本機啟動伺服器（獨立子程序），模擬多個手機同時上傳，
+量測啟動時間、吞吐量、延遲百分位數、伺服器記憶體高峰與磁碟寫入放大，結果存成JSON以便比較
+完全離線，只使用 127.0.0.1
+
+用法:
+    python bench_upload.py --clients 10 --files 5 --size 20MB
+    python bench_upload.py --baseline bench_results/上次結果.json
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import datetime
+
+SEND_BLOCK_SIZE = 256 * 1024
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def parse_size(text):
+    """解析 10MB、512KB、1GB 之類的大小"""
+    text = str(text).strip().upper()
+    units = {'GB': 1024 ** 3, 'MB': 1024 ** 2, 'KB': 1024, 'B': 1}
+    for unit, factor in units.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def percentile(values, pct):
+    """計算百分位數（線性內插）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def find_free_port():
+    """取得一個可用的本機埠號"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def read_process_stats(pid):
+    """讀取伺服器程序的記憶體高峰與I/O統計"""
+    stats = {'peak_rss_bytes': None, 'write_bytes': None, 'wchar': None}
+    status_path = f'/proc/{pid}/status'
+    if os.path.exists(status_path):
+        with open(status_path, 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    stats['peak_rss_bytes'] = int(line.split()[1]) * 1024
+        try:
+            with open(f'/proc/{pid}/io', 'r') as f:
+                for line in f:
+                    key, value = line.split(':')
+                    if key in ('write_bytes', 'wchar'):
+                        stats[key] = int(value)
+        except OSError:
+            pass
+    elif psutil is not None:
+        process = psutil.Process(pid)
+        memory = process.memory_info()
+        stats['peak_rss_bytes'] = getattr(memory, 'peak_wset', memory.rss)
+        try:
+            io = process.io_counters()
+            stats['write_bytes'] = io.write_bytes
+        except (AttributeError, psutil.Error):
+            pass
+    return stats
+
+
+class RssSampler(threading.Thread):
+    """沒有VmHWM可用時，定期取樣伺服器的RSS"""
+
+    def __init__(self, pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            stats = read_process_stats(self.pid)
+            if stats['peak_rss_bytes']:
+                self.peak = max(self.peak, stats['peak_rss_bytes'])
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def iter_multipart_body(boundary, filename, payload):
+    """產生multipart請求內容（以區塊送出，不把整個請求組在記憶體中）"""
+    yield (f'--{boundary}\r\n'
+           f'Content-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+           f'Content-Type: application/octet-stream\r\n\r\n').encode()
+    view = memoryview(payload)
+    for start in range(0, len(view), SEND_BLOCK_SIZE):
+        yield view[start:start + SEND_BLOCK_SIZE]
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
+
+def multipart_length(boundary, filename, payload):
+    return sum(len(part) for part in iter_multipart_body(boundary, filename, b'')) + len(payload)
+
+
+def upload_multipart(conn, filename, payload):
+    """以 POST /upload 上傳一個檔案"""
+    boundary = uuid.uuid4().hex
+    conn.putrequest('POST', '/upload')
+    conn.putheader('Content-Type', f'multipart/form-data; boundary={boundary}')
+    conn.putheader('Content-Length', str(multipart_length(boundary, filename, payload)))
+    conn.endheaders()
+    for block in iter_multipart_body(boundary, filename, payload):
+        conn.send(block)
+    return json.loads(conn.getresponse().read())
+
+
+def upload_chunked(conn, filename, payload, chunk_size):
+    """以分段上傳API上傳一個檔案"""
+    body = json.dumps({'filename': filename, 'size': len(payload)})
+    conn.request('POST', '/upload/sessions', body, {'Content-Type': 'application/json'})
+    session = json.loads(conn.getresponse().read())
+    view = memoryview(payload)
+    for offset in range(0, len(view), chunk_size):
+        conn.request('PUT', f"/upload/sessions/{session['session_id']}?offset={offset}",
+                     view[offset:offset + chunk_size],
+                     {'Content-Type': 'application/octet-stream'})
+        conn.getresponse().read()
+    conn.request('POST', f"/upload/sessions/{session['session_id']}/complete")
+    return json.loads(conn.getresponse().read())
+
+
+def run_client(client_id, args, payload, port, latencies, failures, lock):
+    """單一模擬手機：依序上傳多個檔案"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+    for n in range(args.files):
+        filename = f'bench_{client_id}_{n}.bin'
+        started = time.perf_counter()
+        try:
+            if args.api == 'chunked':
+                result = upload_chunked(conn, filename, payload, args.chunk_size)
+            else:
+                result = upload_multipart(conn, filename, payload)
+            ok = result.get('success', False)
+        except Exception as e:
+            ok = False
+            result = {'message': str(e)}
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+        elapsed = time.perf_counter() - started
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                failures.append(result.get('message'))
+    conn.close()
+
+
+def wait_for_server(port, process, timeout=30):
+    """等待伺服器可以接受連線，回傳等待的秒數"""
+    started = time.perf_counter()
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('伺服器啟動失敗')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/upload/config')
+            conn.getresponse().read()
+            conn.close()
+            return time.perf_counter() - started
+        except OSError:
+            time.sleep(0.01)
+    raise RuntimeError('等待伺服器啟動逾時')
+
+
+def serve(args):
+    """子程序：在指定的工作目錄中以無介面模式啟動伺服器（與實際啟動流程相同）"""
+    os.chdir(args.workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app_improved
+    app_improved.main(['--headless', '--host', '127.0.0.1', '--port', str(args.port),
+                       '--mode', args.server, '--threads', str(args.threads)])
+
+
+def compare_with_baseline(results, baseline_path, max_regression):
+    """與先前的結果比較，回傳退步項目"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    checks = [('throughput_mb_s', False), ('latency_p95_s', True), ('peak_rss_mb', True),
+              ('startup_s', True)]
+    for key, lower_is_better in checks:
+        old, new = baseline.get(key), results.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = change > max_regression if lower_is_better else -change > max_regression
+        print(f"   {key}: {old} → {new} ({change:+.1%}){' ❌' if worse else ''}")
+        if worse:
+            regressions.append(key)
+    return regressions
+
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix='transfer_bench_')
+    port = find_free_port()
+    cmd = [sys.executable, os.path.abspath(__file__), '--serve', '--workdir', workdir,
+           '--port', str(port), '--server', args.server, '--threads', str(args.threads)]
+    server = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # 從啟動程序到第一個請求被處理的時間（包含載入模組）
+        startup = wait_for_server(port, server)
+        payload = os.urandom(args.size)
+        before = read_process_stats(server.pid)
+        sampler = RssSampler(server.pid)
+        sampler.start()
+
+        latencies, failures, lock = [], [], threading.Lock()
+        clients = [threading.Thread(target=run_client,
+                                    args=(i, args, payload, port, latencies, failures, lock))
+                   for i in range(args.clients)]
+        started = time.perf_counter()
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        wall_time = time.perf_counter() - started
+
+        sampler.stop()
+        after = read_process_stats(server.pid)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    received = len(latencies) * args.size
+    peak_rss = max(filter(None, [after['peak_rss_bytes'], sampler.peak]), default=None)
+
+    def amplification(key):
+        if after[key] is None or before[key] is None or not received:
+            return None
+        return round((after[key] - before[key]) / received, 3)
+
+    results = {
+        'startup_s': round(startup, 3),
+        'uploads_ok': len(latencies),
+        'uploads_failed': len(failures),
+        'bytes_received': received,
+        'wall_time_s': round(wall_time, 3),
+        'throughput_mb_s': round(received / wall_time / 1024 / 1024, 2) if wall_time else None,
+        'latency_p50_s': round(percentile(latencies, 50), 4) if latencies else None,
+        'latency_p95_s': round(percentile(latencies, 95), 4) if latencies else None,
+        'latency_p99_s': round(percentile(latencies, 99), 4) if latencies else None,
+        'peak_rss_mb': round(peak_rss / 1024 / 1024, 1) if peak_rss else None,
+        'disk_write_per_byte': amplification('write_bytes'),
+        'write_syscall_per_byte': amplification('wchar'),
+        'errors': sorted(set(failures))[:10],
+    }
+    shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='上傳效能測試')
+    parser.add_argument('--clients', type=int, default=10, help='同時上傳的模擬手機數')
+    parser.add_argument('--files', type=int, default=5, help='每台手機上傳的檔案數')
+    parser.add_argument('--size', type=parse_size, default=parse_size('10MB'), help='每個檔案大小')
+    parser.add_argument('--api', choices=['multipart', 'chunked'], default='multipart',
+                        help='multipart: POST /upload；chunked: 分段上傳API')
+    parser.add_argument('--chunk-size', type=parse_size, default=parse_size('8MB'))
+    parser.add_argument('--server', choices=['production', 'dev'], default='production')
+    parser.add_argument('--threads', type=int, default=32, help='伺服器工作執行緒數')
+    parser.add_argument('--output', help='結果JSON路徑（預設 bench_results/upload_時間.json）')
+    parser.add_argument('--baseline', help='與先前的結果JSON比較')
+    parser.add_argument('--max-regression', type=float, default=0.1,
+                        help='允許的退步比例，超過時結束代碼為1（預設0.1）')
+    # 內部使用：伺服器子程序
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return 0
+
+    print("=" * 60)
+    print("📊 上傳效能測試")
+    print("=" * 60)
+    print(f"   {args.clients} 台模擬手機 × {args.files} 個檔案 × "
+          f"{args.size / 1024 / 1024:.1f}MB（{args.api}，{args.server}）")
+
+    results = run_benchmark(args)
+
+    print(f"\n⏱️  啟動到接受第一個連線: {results['startup_s']} 秒")
+    print(f"✅ 成功 {results['uploads_ok']} 個，失敗 {results['uploads_failed']} 個")
+    print(f"🚀 吞吐量: {results['throughput_mb_s']} MB/s")
+    print(f"⏱️  延遲 p50/p95/p99: {results['latency_p50_s']} / "
+          f"{results['latency_p95_s']} / {results['latency_p99_s']} 秒")
+    print(f"💾 伺服器記憶體高峰: {results['peak_rss_mb']} MB")
+    print(f"📝 每收到1位元組的磁碟寫入: {results['disk_write_per_byte']}"
+          f"（write系統呼叫: {results['write_syscall_per_byte']}）")
+
+    output = args.output or os.path.join(
+        'bench_results', f"upload_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'config': {k: v for k, v in vars(args).items()
+                   if k not in ('serve', 'workdir', 'port', 'output', 'baseline')},
+        'results': results,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📁 結果已儲存: {output}")
+
+    if args.baseline:
+        print(f"\n🔬 與基準比較: {args.baseline}")
+        regressions = compare_with_baseline(results, args.baseline, args.max_regression)
+        if regressions:
+            print(f"❌ 效能退步: {', '.join(regressions)}")
+            return 1
+        print("✅ 沒有超過門檻的退步")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
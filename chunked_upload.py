@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分段續傳上傳
+將大型檔案拆成多個區塊上傳，WiFi中斷後可從伺服器已確認的位元組繼續傳輸。
+區塊是否fsync依照與檔案發布相同的fsync策略（見 atomic_store）：
+file/group 每個區塊寫入後fsync才記錄區間；none 不fsync，重新啟動時只保留暫存檔大小以內的區間
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+
+from atomic_store import fsync_dir, DEFAULT_FSYNC_POLICY
+
+# 建議的區塊大小與單一區塊上限
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024      # 8MB
+MAX_CHUNK_SIZE = 64 * 1024 * 1024         # 64MB
+COPY_BUFFER_SIZE = 1024 * 1024            # 1MB
+SESSION_EXPIRE_SECONDS = 7 * 24 * 3600    # 未完成的上傳保留7天
+
+# 平行上傳：超過門檻的檔案建議拆成多條連線同時傳送
+PARALLEL_UPLOAD_THRESHOLD = 32 * 1024 * 1024   # 32MB
+PARALLEL_UPLOAD_CONNECTIONS = 4
+
+
+class UploadSessionError(Exception):
+    """分段上傳錯誤（附帶HTTP狀態碼）"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class IncompleteChunkError(UploadSessionError):
+    """請求內容比宣告的長度短（連線中斷），已收到的部分仍然記錄下來"""
+
+
+def merge_ranges(ranges):
+    """合併重疊或相鄰的位元組區間 [start, end)"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def clip_ranges(ranges, size):
+    """只保留 size 以內的部分"""
+    return [[start, min(end, size)] for start, end in ranges if start < size]
+
+
+def write_at(f, offset, data):
+    """寫入指定位移（支援時使用pwrite，不影響其他連線的檔案位置）"""
+    view = memoryview(data)
+    total = 0
+    if not hasattr(os, 'pwrite'):
+        f.seek(offset)
+    while total < len(view):
+        if hasattr(os, 'pwrite'):
+            total += os.pwrite(f.fileno(), view[total:], offset + total)
+        else:
+            total += f.write(view[total:])
+    return total
+
+
+class UploadSession:
+    """單一檔案的分段上傳狀態"""
+
+    def __init__(self, folder, session_id, filename, total_size,
+                 upload_key=None, created=None, ranges=None, preallocated=True):
+        self.session_id = session_id
+        self.filename = filename
+        self.total_size = total_size
+        self.upload_key = upload_key
+        self.created = created or time.time()
+        self.updated = self.created
+        self.ranges = merge_ranges(ranges or [])
+        # 暫存檔是否預先配置為完整大小（fsync策略為none時不預先配置，檔案大小即寫到的位置）
+        self.preallocated = preallocated
+        self.part_path = os.path.join(folder, f'{session_id}.part')
+        self.meta_path = os.path.join(folder, f'{session_id}.json')
+        self.lock = threading.Lock()
+
+    @property
+    def received_bytes(self):
+        """已確認收到的位元組數"""
+        return sum(end - start for start, end in self.ranges)
+
+    @property
+    def next_offset(self):
+        """從檔案開頭連續收到的位元組數（續傳起點）"""
+        if self.ranges and self.ranges[0][0] == 0:
+            return self.ranges[0][1]
+        return 0
+
+    @property
+    def is_complete(self):
+        """是否已收到完整檔案"""
+        return self.ranges == [[0, self.total_size]] or self.total_size == 0
+
+    def add_range(self, start, end):
+        """記錄新收到的區間"""
+        if end > start:
+            self.ranges = merge_ranges(self.ranges + [[start, end]])
+        self.updated = time.time()
+
+    @property
+    def recommended_connections(self):
+        """建議的平行連線數"""
+        if self.total_size < PARALLEL_UPLOAD_THRESHOLD:
+            return 1
+        chunks = -(-self.total_size // DEFAULT_CHUNK_SIZE)
+        return max(1, min(PARALLEL_UPLOAD_CONNECTIONS, chunks))
+
+    def to_dict(self):
+        """轉為API回應格式"""
+        return {
+            'session_id': self.session_id,
+            'filename': self.filename,
+            'size': self.total_size,
+            'received': self.ranges,
+            'received_bytes': self.received_bytes,
+            'next_offset': self.next_offset,
+            'complete': self.is_complete,
+            'recommended_connections': self.recommended_connections,
+        }
+
+    def save(self, fsync=True):
+        """將狀態寫入磁碟（先寫暫存檔再取代，避免中途當機造成損毀）"""
+        meta = {
+            'session_id': self.session_id,
+            'filename': self.filename,
+            'total_size': self.total_size,
+            'upload_key': self.upload_key,
+            'created': self.created,
+            'updated': self.updated,
+            'ranges': self.ranges,
+            'preallocated': self.preallocated,
+        }
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.meta_path)
+        if fsync:
+            fsync_dir(os.path.dirname(self.meta_path))
+
+
+class UploadSessionManager:
+    """管理所有進行中的分段上傳"""
+
+    def __init__(self, folder, fsync_policy=DEFAULT_FSYNC_POLICY):
+        self.folder = folder
+        self.fsync_policy = fsync_policy
+        os.makedirs(folder, exist_ok=True)
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._load_sessions()
+
+    def _load_sessions(self):
+        """啟動時載入未完成的上傳，讓重新啟動後仍可續傳"""
+        for name in os.listdir(self.folder):
+            if not name.endswith('.json'):
+                continue
+            meta_path = os.path.join(self.folder, name)
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                session = UploadSession(self.folder, meta['session_id'], meta['filename'],
+                                        meta['total_size'], meta.get('upload_key'),
+                                        meta.get('created'), meta.get('ranges'),
+                                        meta.get('preallocated', True))
+                session.updated = meta.get('updated', session.created)
+                if not os.path.exists(session.part_path):
+                    os.remove(meta_path)
+                    continue
+                size = os.path.getsize(session.part_path)
+                if session.preallocated:
+                    # 記錄的區間都已在寫入後fsync（見 write_chunk），不必再比對內容；
+                    # 暫存檔預先配置為完整大小，大小不符表示暫存檔已被更動，只能從頭上傳
+                    if size != session.total_size:
+                        print(f"分段上傳暫存檔大小不符，從頭上傳: {session.filename}")
+                        session.ranges = []
+                elif session.ranges and size < session.ranges[-1][1]:
+                    # 寫入時沒有fsync，當機後暫存檔可能比記錄的短，超出檔案大小的部分重新上傳
+                    print(f"分段上傳暫存檔比記錄的短，從 {size} 位元組續傳: {session.filename}")
+                    session.ranges = clip_ranges(session.ranges, size)
+                self._sessions[session.session_id] = session
+            except Exception as e:
+                print(f"載入分段上傳狀態失敗 {name}: {e}")
+
+    def create_session(self, filename, total_size, upload_key=None):
+        """建立新的上傳，若 upload_key 相符則回傳既有的上傳以便續傳"""
+        if not isinstance(total_size, int) or isinstance(total_size, bool) or total_size < 0:
+            raise UploadSessionError('檔案大小無效')
+
+        with self._lock:
+            session = self.find_session(filename, total_size, upload_key)
+            if session is not None:
+                return session
+
+            durable = self.fsync_policy != 'none'
+            session = UploadSession(self.folder, uuid.uuid4().hex, filename,
+                                    total_size, upload_key, preallocated=durable)
+            # 各區塊直接寫入自己的位移，不需要事後重組；會fsync時預先配置完整大小，
+            # 不fsync時保留實際大小，重新啟動時用來找出沒寫回磁碟的尾端
+            with open(session.part_path, 'wb') as f:
+                if durable:
+                    f.truncate(total_size)
+            session.save(fsync=durable)
+            self._sessions[session.session_id] = session
+            return session
+
+    def find_session(self, filename, total_size, upload_key):
+        """找出可續傳的既有上傳，沒有時回傳None"""
+        if not upload_key:
+            return None
+        for session in list(self._sessions.values()):
+            if (session.upload_key == upload_key and
+                    session.filename == filename and
+                    session.total_size == total_size):
+                return session
+        return None
+
+    def received_bytes(self):
+        """所有進行中的上傳已收到的位元組數（暫存檔在內部資料夾，不在上傳資料夾的統計中）"""
+        return sum(session.received_bytes for session in list(self._sessions.values()))
+
+    def pending_bytes(self):
+        """所有進行中的上傳尚未收到的位元組數（預先配置的檔案尚未實際佔用的空間）"""
+        return sum(session.total_size - session.received_bytes
+                   for session in list(self._sessions.values()))
+
+    def get_session(self, session_id):
+        """取得上傳狀態"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise UploadSessionError('找不到上傳工作階段', 404)
+        return session
+
+    def write_chunk(self, session_id, offset, stream, length=None, on_write=None):
+        """將一個區塊寫入指定位移，回傳更新後的上傳狀態
+        on_write(位元組數, 秒數) 回報每次寫入花費的時間
+        """
+        session = self.get_session(session_id)
+
+        if offset < 0 or offset > session.total_size:
+            raise UploadSessionError('區塊位移超出檔案範圍', 416)
+        remaining = session.total_size - offset
+        # 未提供長度時（例如壓縮的區塊）讀到串流結束為止
+        exact = length is not None
+        if not exact:
+            length = min(remaining, MAX_CHUNK_SIZE)
+        if length > MAX_CHUNK_SIZE:
+            raise UploadSessionError('區塊過大', 413)
+        if length > remaining:
+            raise UploadSessionError('區塊超出檔案大小', 416)
+
+        written = 0
+        durable = 0
+        fsync = self.fsync_policy != 'none'
+        try:
+            # 每個請求各自開啟檔案，同一檔案的多個區塊可以同時寫入
+            with open(session.part_path, 'r+b', buffering=0) as f:
+                try:
+                    while written < length:
+                        data = stream.read(min(COPY_BUFFER_SIZE, length - written))
+                        if not data:
+                            break
+                        started = time.perf_counter()
+                        written += write_at(f, offset + written, data)
+                        if on_write:
+                            on_write(len(data), time.perf_counter() - started)
+                finally:
+                    # 資料確實寫入磁碟後才記錄區間：預先配置的暫存檔大小無法判斷哪些部分真的寫入了，
+                    # 當機後載入的區間不會包含只填了零的空洞（策略為none時不fsync，見 _load_sessions）
+                    if written and fsync:
+                        os.fsync(f.fileno())
+                    durable = written
+        finally:
+            # 即使連線中斷，已寫入的部分仍然記錄下來，之後從這裡續傳
+            with session.lock:
+                session.add_range(offset, offset + durable)
+                session.save(fsync=fsync)
+
+        if exact and written < length:
+            raise IncompleteChunkError('區塊資料不完整，請從 next_offset 續傳')
+        if not exact and written == length and stream.read(1):
+            raise UploadSessionError('區塊超出檔案大小', 416)
+        return session
+
+    def finalize(self, session_id, store):
+        """確認檔案完整後呼叫 store(session) 將暫存檔移到最終位置，成功才結束上傳"""
+        session = self.get_session(session_id)
+        with session.lock:
+            if not session.is_complete:
+                raise UploadSessionError('檔案尚未上傳完成', 409)
+            result = store(session)
+            with self._lock:
+                self._sessions.pop(session_id, None)
+            try:
+                os.remove(session.meta_path)
+            except OSError:
+                pass
+        return result
+
+    def abort(self, session_id):
+        """取消上傳並刪除暫存檔"""
+        session = self.get_session(session_id)
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        for path in (session.part_path, session.meta_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def cleanup_expired(self, max_age=SESSION_EXPIRE_SECONDS):
+        """清除太久沒有更新的上傳"""
+        now = time.time()
+        expired = [sid for sid, s in list(self._sessions.items())
+                   if now - s.updated > max_age]
+        for session_id in expired:
+            try:
+                self.abort(session_id)
+            except UploadSessionError:
+                pass
+        return len(expired)
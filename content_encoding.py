@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+壓縮的請求內容
+支援 Content-Encoding: gzip、deflate 與 zstd（需安裝zstandard），邊接收邊解壓，
+每次只解出有限的資料量，並限制解壓後的總大小與壓縮比，拒絕壓縮炸彈
+"""
+
+import zlib
+
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+READ_BUFFER_SIZE = 64 * 1024
+MAX_COMPRESSION_RATIO = 1000            # 解壓後/壓縮前的最大比例（deflate上限約1032）
+RATIO_GRACE_BYTES = 1024 * 1024         # 開頭這麼多資料不檢查壓縮比（檔頭、空白檔案等）
+
+
+def supported_encodings():
+    """伺服器可解壓的編碼"""
+    encodings = ['gzip', 'deflate']
+    if zstandard is not None:
+        encodings.append('zstd')
+    return encodings
+
+
+class _ZlibDecoder:
+    """gzip/deflate增量解壓；HTTP的deflate應為zlib格式，但也接受部分用戶端送出的原始deflate"""
+
+    def __init__(self, encoding):
+        self._encoding = encoding
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if encoding == 'gzip' else None
+        self._tail = b''
+        self._head = b''
+
+    def decompress(self, data, max_length):
+        if self._decompressor is None:
+            # 判斷格式需要前兩個位元組，第一次讀取可能不到兩個位元組，先累積起來
+            self._head += data
+            if len(self._head) < 2:
+                return b''
+            data, self._head = self._head, b''
+            # zlib格式的第一個位元組低4位元為8（deflate），且前兩個位元組可被31整除
+            raw = not (data[0] & 0x0F == 8 and (data[0] << 8 | data[1]) % 31 == 0)
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS if raw else zlib.MAX_WBITS)
+        try:
+            output = self._decompressor.decompress(self._tail + data, max_length)
+        except zlib.error as e:
+            raise ValueError(f'{self._encoding}解壓失敗: {e}')
+        self._tail = self._decompressor.unconsumed_tail
+        return output
+
+    @property
+    def has_pending(self):
+        return bool(self._tail)
+
+    @property
+    def eof(self):
+        return self._decompressor is not None and self._decompressor.eof
+
+
+class DecodingStream:
+    """將壓縮的請求串流包裝成解壓後的串流（只需支援 read）"""
+
+    def __init__(self, stream, encoding, max_size, max_ratio=MAX_COMPRESSION_RATIO):
+        if encoding == 'zstd':
+            if zstandard is None:
+                raise UnsupportedMediaType('伺服器未安裝zstandard，無法解壓zstd')
+            # 用戶端可能分成多個frame送出（例如串流壓縮），讀完一個frame後繼續解下一個
+            self._zstd = zstandard.ZstdDecompressor().stream_reader(_CountingReader(stream, self),
+                                                                     read_across_frames=True)
+            self._decoder = None
+        elif encoding in ('gzip', 'x-gzip', 'deflate'):
+            self._zstd = None
+            self._decoder = _ZlibDecoder('gzip' if encoding == 'x-gzip' else encoding)
+        else:
+            raise UnsupportedMediaType(f'不支援的Content-Encoding: {encoding}')
+        self._stream = stream
+        self.max_size = max_size
+        self.max_ratio = max_ratio
+        self.compressed_bytes = 0
+        self.decompressed_bytes = 0
+        self._eof = False
+
+    def _check_limits(self):
+        if self.max_size is not None and self.decompressed_bytes > self.max_size:
+            raise RequestEntityTooLarge('解壓後的內容超過大小上限')
+        if (self.decompressed_bytes > RATIO_GRACE_BYTES and
+                self.decompressed_bytes > self.compressed_bytes * self.max_ratio):
+            raise RequestEntityTooLarge('壓縮比異常，拒絕可能的壓縮炸彈')
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = READ_BUFFER_SIZE
+        if self._zstd is not None:
+            try:
+                data = self._zstd.read(size)
+            except zstandard.ZstdError as e:
+                raise ValueError(f'zstd解壓失敗: {e}')
+        else:
+            data = self._read_zlib(size)
+        self.decompressed_bytes += len(data)
+        self._check_limits()
+        return data
+
+    def _read_zlib(self, size):
+        decoder = self._decoder
+        while not self._eof:
+            if decoder.eof:
+                self._eof = True
+                break
+            if decoder.has_pending:
+                data = b''
+            else:
+                data = self._stream.read(READ_BUFFER_SIZE)
+                if not data:
+                    raise ValueError('壓縮內容不完整')
+                self.compressed_bytes += len(data)
+            output = decoder.decompress(data, size)
+            if output:
+                return output
+        return b''
+
+
+class _CountingReader:
+    """計算zstd讀取的壓縮位元組數（用於壓縮比檢查）"""
+
+    def __init__(self, stream, owner):
+        self._stream = stream
+        self._owner = owner
+
+    def read(self, size=-1):
+        data = self._stream.read(size if size and size > 0 else READ_BUFFER_SIZE)
+        self._owner.compressed_bytes += len(data)
+        return data
+
+
+def is_identity_encoding(content_encoding):
+    """請求內容是否未經壓縮"""
+    return (content_encoding or '').strip().lower() in ('', 'identity')
+
+
+def decode_request_stream(stream, content_encoding, max_size):
+    """依 Content-Encoding 回傳解壓後的串流，未壓縮時原樣回傳"""
+    if is_identity_encoding(content_encoding):
+        return stream
+    return DecodingStream(stream, content_encoding.strip().lower(), max_size)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+檔案下載
+支援HTTP Range（影片拖曳、續傳）與ETag/Last-Modified條件式請求。
+回應本體為 FileRangeBody：正式環境伺服器會辨識它並以 socket.sendfile 由核心直接送出，
+不經過Python緩衝區；其他伺服器則退回分段讀取。
+多個檔案可即時打包成zip串流送出，邊讀邊送，不產生暫存檔
+"""
+
+import os
+import time
+import zipfile
+import mimetypes
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from flask import Response
+from werkzeug.http import http_date, is_resource_modified
+
+READ_BLOCK_SIZE = 1024 * 1024      # 無法零拷貝時每次讀取的大小
+ZIP_READ_SIZE = 256 * 1024         # 打包zip時每次讀取的大小
+
+# 以deflate壓縮的類型（照片、影片等已壓縮的媒體直接儲存）
+DEFLATE_MIME_TYPES = {'application/json', 'application/xml', 'application/javascript',
+                      'application/sql', 'application/x-yaml', 'image/svg+xml'}
+DEFLATE_EXTENSIONS = {'.log', '.txt', '.csv', '.tsv', '.md', '.yaml', '.yml', '.ini', '.json', '.xml'}
+
+
+class FileRangeBody:
+    """
+    檔案的一個位元組區間，可迭代（一般伺服器）也可直接交給sendfile
+    以 direct_passthrough 回應時伺服器只會關閉本體，不會呼叫 Response.close，
+    因此由本體在關閉時執行 call_on_close 登記的函式
+    """
+
+    def __init__(self, path, offset, length, block_size=READ_BLOCK_SIZE):
+        self.file = open(path, 'rb')
+        self.offset = offset
+        self.length = length
+        self.block_size = block_size
+        self._on_close = []
+
+    def __iter__(self):
+        self.file.seek(self.offset)
+        remaining = self.length
+        while remaining > 0:
+            data = self.file.read(min(self.block_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    def call_on_close(self, func):
+        """登記回應送完（伺服器關閉本體）時執行的函式"""
+        self._on_close.append(func)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        for func in self._on_close:
+            func()
+
+
+def make_etag(stat):
+    """由大小與修改時間產生ETag，不需要讀取檔案內容"""
+    return f'{stat.st_size:x}-{stat.st_mtime_ns:x}'
+
+
+def content_disposition(filename, as_attachment=True):
+    """產生Content-Disposition（非ASCII檔名使用RFC 5987編碼）"""
+    kind = 'attachment' if as_attachment else 'inline'
+    try:
+        filename.encode('ascii')
+        return f'{kind}; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"{kind}; filename*=UTF-8''{quote(filename)}"
+
+
+def _if_range_matches(request, etag, last_modified):
+    """If-Range條件成立（或未提供）時才處理Range"""
+    if_range = request.if_range
+    if if_range.etag is None and if_range.date is None:
+        return True
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    # 日期必須與 Last-Modified 完全相同（同為秒精度）；較新的日期不代表手機拿到的是目前的內容
+    return if_range.date == last_modified
+
+
+def send_file_range(request, path, download_name=None, as_attachment=True):
+    """回應檔案下載請求，處理條件式請求與單一Range"""
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = make_etag(stat)
+    # HTTP日期只精確到秒
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': 'no-cache',
+    }
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return Response(status=304, headers=headers)
+
+    status = 200
+    offset, length = 0, size
+    byte_range = request.range
+    # 只支援單一區間，多重區間時回傳完整檔案
+    if (byte_range is not None and len(byte_range.ranges) == 1
+            and _if_range_matches(request, etag, last_modified)):
+        content_range = byte_range.make_content_range(size)
+        if content_range is None:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+        status = 206
+        offset, length = content_range.start, content_range.stop - content_range.start
+        headers['Content-Range'] = f'bytes {content_range.start}-{content_range.stop - 1}/{size}'
+
+    name = download_name or os.path.basename(path)
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    headers['Content-Disposition'] = content_disposition(name, as_attachment)
+
+    body = FileRangeBody(path, offset, length)
+    response = Response(body, status=status, headers=headers, mimetype=mimetype,
+                        direct_passthrough=True)
+    response.content_length = length
+    # 關閉本體時一併關閉回應，after_request以 response.call_on_close 登記的函式才會執行
+    body.call_on_close(response.close)
+    return response
+
+
+def should_deflate(filename):
+    """文字類檔案才值得在zip中壓縮"""
+    if os.path.splitext(filename)[1].lower() in DEFLATE_EXTENSIONS:
+        return True
+    mimetype = mimetypes.guess_type(filename)[0] or ''
+    return mimetype.startswith('text/') or mimetype in DEFLATE_MIME_TYPES
+
+
+def _zip_date_time(mtime):
+    """zip只能表示1980到2107年"""
+    year, month, day, hour, minute, second = time.localtime(mtime)[:6]
+    if year < 1980:
+        return (1980, 1, 1, 0, 0, 0)
+    return (min(year, 2107), month, day, hour, minute, second)
+
+
+class _ZipSink:
+    """zipfile的輸出目標：不可seek，zipfile會改用資料描述區，寫入的內容由產生器取走送出"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip_stream(entries, read_size=ZIP_READ_SIZE):
+    """
+    將 entries（可迭代的 (實際路徑, zip中的名稱)）打包成zip並逐段產生內容
+    每次只讀取 read_size，記憶體用量與檔案大小無關；讀取時已消失的檔案會略過
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+        for path, arcname in entries:
+            try:
+                source = open(path, 'rb')
+            except OSError as e:
+                print(f"略過無法讀取的檔案 {path}: {e}")
+                continue
+            with source:
+                stat = os.fstat(source.fileno())
+                info = zipfile.ZipInfo(arcname, date_time=_zip_date_time(stat.st_mtime))
+                # 預先告知大小，超過4GB的檔案才會使用zip64
+                info.file_size = stat.st_size
+                info.compress_type = zipfile.ZIP_DEFLATED if should_deflate(arcname) else zipfile.ZIP_STORED
+                info.external_attr = 0o644 << 16
+                with archive.open(info, 'w') as dest:
+                    while True:
+                        data = source.read(read_size)
+                        if not data:
+                            break
+                        dest.write(data)
+                        chunk = sink.take()
+                        if chunk:
+                            yield chunk
+            chunk = sink.take()
+            if chunk:
+                yield chunk
+    # 結尾的中央目錄
+    yield sink.take()
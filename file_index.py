@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+檔案目錄索引
+以SQLite記錄上傳資料夾中每個檔案的SHA-256與上傳資訊（原始檔名、類型、上傳時間、來源IP），
+用於秒傳、重複檔案去重以及檔案列表。索引隨上傳逐步建立，啟動時在背景補登資料夾中既有的檔案
+（大小與修改時間與索引相同的直接略過，只計算新增或變動檔案的雜湊）；
+列表使用游標分頁，任何一頁都是一次索引查找，不需要掃描資料夾或跳過前面的資料列
+"""
+
+import os
+import json
+import base64
+import sqlite3
+import hashlib
+import mimetypes
+import threading
+
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# 可排序的欄位（每個都有 (欄位, path) 索引）
+SORT_COLUMNS = {
+    'uploaded': 'uploaded_at',
+    'name': 'original_name',
+    'size': 'size',
+}
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# 檔案所在的儲存層（NULL表示上傳資料夾，也就是落地層）
+_STORAGE_COLUMNS = (
+    ('tier', 'TEXT'),
+)
+
+# 舊版索引缺少的欄位
+_CATALOG_COLUMNS = (
+    ('original_name', 'TEXT'),
+    ('mime_type', 'TEXT'),
+    ('media_type', 'TEXT'),
+    ('uploaded_at', 'REAL'),
+    ('client_ip', 'TEXT'),
+)
+
+
+def hash_file(path):
+    """計算檔案的SHA-256"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(HASH_BUFFER_SIZE)
+            if not data:
+                break
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def is_sha256(value):
+    """檢查是否為SHA-256十六進位字串"""
+    if not isinstance(value, str) or len(value) != 64:
+        return False
+    try:
+        int(value, 16)
+        return True
+    except ValueError:
+        return False
+
+
+def guess_mime_type(filename):
+    """依副檔名判斷MIME類型"""
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def encode_cursor(sort_value, path):
+    """將上一頁最後一筆的排序鍵編碼為游標字串"""
+    raw = json.dumps([sort_value, path], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解碼游標，格式錯誤時拋出ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, path = json.loads(raw.decode('utf-8'))
+    except Exception:
+        raise ValueError('無效的游標')
+    if not isinstance(path, str):
+        raise ValueError('無效的游標')
+    return sort_value, path
+
+
+class FileIndex:
+    """
+    檔案目錄：內容雜湊與上傳資訊的持久化索引（路徑相對於上傳資料夾）
+    檔案搬到其他儲存層後，路徑（邏輯名稱）不變，只記錄所在的儲存層
+    """
+
+    def __init__(self, db_path, root_folder):
+        self.root_folder = root_folder
+        self._tier_roots = {}
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                original_name TEXT,
+                mime_type TEXT,
+                media_type TEXT,
+                uploaded_at REAL,
+                client_ip TEXT,
+                tier TEXT
+            )
+        ''')
+        self._migrate()
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files(sha256)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_files_uploaded ON files(uploaded_at, path)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_files_name ON files(original_name, path)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_files_size ON files(size, path)')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_files_media ON files(media_type, uploaded_at, path)')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_files_client ON files(client_ip, uploaded_at, path)')
+        self._conn.commit()
+
+    def _migrate(self):
+        """為舊版索引補上新欄位，舊紀錄以修改時間作為上傳時間"""
+        existing = {row[1] for row in self._conn.execute('PRAGMA table_info(files)')}
+        for name, kind in _STORAGE_COLUMNS:
+            if name not in existing:
+                self._conn.execute(f'ALTER TABLE files ADD COLUMN {name} {kind}')
+        missing = [(name, kind) for name, kind in _CATALOG_COLUMNS if name not in existing]
+        if not missing:
+            return
+        for name, kind in missing:
+            self._conn.execute(f'ALTER TABLE files ADD COLUMN {name} {kind}')
+        rows = self._conn.execute('SELECT path, mtime FROM files').fetchall()
+        for path, mtime in rows:
+            mime_type = guess_mime_type(path)
+            self._conn.execute(
+                'UPDATE files SET original_name = ?, mime_type = ?, media_type = ?, uploaded_at = ? '
+                'WHERE path = ?',
+                (path.rsplit('/', 1)[-1], mime_type, mime_type.split('/')[0], mtime, path))
+
+    def relative_path(self, filepath):
+        """轉為索引使用的相對路徑"""
+        return os.path.relpath(filepath, self.root_folder).replace(os.sep, '/')
+
+    def register_tier(self, name, root_folder):
+        """登記儲存層的資料夾，tier 為 name 的檔案位於 root_folder 之下的相同相對路徑"""
+        self._tier_roots[name] = root_folder
+
+    def absolute_path(self, path, tier=None):
+        """索引中的相對路徑轉為實際路徑（tier 為檔案所在的儲存層，None表示上傳資料夾）"""
+        root = self._tier_roots.get(tier, self.root_folder) if tier else self.root_folder
+        return os.path.join(root, *path.split('/'))
+
+    def set_tier(self, path, tier):
+        """檔案已複製到另一個儲存層，之後以同一個路徑從該儲存層讀取"""
+        with self._lock:
+            self._conn.execute('UPDATE files SET tier = ? WHERE path = ?', (tier, path))
+            self._conn.commit()
+
+    def add(self, filepath, sha256, size=None, mtime=None, original_name=None, client_ip=None,
+            uploaded_at=None):
+        """加入或更新一個檔案"""
+        if size is None or mtime is None:
+            stat = os.stat(filepath)
+            size, mtime = stat.st_size, stat.st_mtime
+        original_name = original_name or os.path.basename(filepath)
+        mime_type = guess_mime_type(original_name)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files (path, sha256, size, mtime, original_name, mime_type, '
+                'media_type, uploaded_at, client_ip) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.relative_path(filepath), sha256, size, mtime, original_name, mime_type,
+                 mime_type.split('/')[0], mtime if uploaded_at is None else uploaded_at, client_ip))
+            self._conn.commit()
+
+    def remove(self, path):
+        """移除索引中的檔案"""
+        with self._lock:
+            self._conn.execute('DELETE FROM files WHERE path = ?', (path,))
+            self._conn.commit()
+
+    def rename(self, old_filepath, new_filepath):
+        """檔案移動後更新路徑，保留上傳資訊"""
+        with self._lock:
+            self._conn.execute('UPDATE OR REPLACE files SET path = ? WHERE path = ?',
+                               (self.relative_path(new_filepath), self.relative_path(old_filepath)))
+            self._conn.commit()
+
+    def lookup(self, sha256):
+        """
+        依雜湊找出上傳資料夾（落地層）中仍存在的檔案實際路徑，找不到回傳None（順便清除失效的紀錄）
+        已搬到其他儲存層的檔案不列入：在請求中檢查或複製NAS上的檔案可能很慢，內容需要重新上傳
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT path, size FROM files WHERE sha256 = ? AND tier IS NULL', (sha256,)).fetchall()
+        for path, size in rows:
+            filepath = self.absolute_path(path)
+            try:
+                if os.path.getsize(filepath) == size:
+                    return filepath
+            except OSError:
+                pass
+            self.remove(path)
+        return None
+
+    def get(self, path):
+        """取得單一檔案的紀錄，不存在時回傳None"""
+        with self._lock:
+            cursor = self._conn.execute('SELECT * FROM files WHERE path = ?', (path,))
+            row = cursor.fetchone()
+            return self._row_to_dict(cursor, row) if row else None
+
+    @staticmethod
+    def _row_to_dict(cursor, row):
+        return {column[0]: value for column, value in zip(cursor.description, row)}
+
+    def list_files(self, sort='uploaded', descending=True, cursor=None, limit=DEFAULT_PAGE_SIZE,
+                   since=None, until=None, file_type=None, client_ip=None):
+        """
+        游標分頁列出檔案，回傳 (紀錄清單, 下一頁游標或None)
+        since/until 為上傳時間（epoch秒）；file_type 可為 'image' 或完整的 'image/jpeg'
+        """
+        column = SORT_COLUMNS.get(sort)
+        if column is None:
+            raise ValueError(f'不支援的排序欄位: {sort}')
+        limit = max(1, min(MAX_PAGE_SIZE, int(limit)))
+
+        conditions, params = [], []
+        if since is not None:
+            conditions.append('uploaded_at >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('uploaded_at < ?')
+            params.append(until)
+        if file_type:
+            conditions.append('media_type = ?')
+            params.append(file_type.split('/')[0])
+            if '/' in file_type:
+                conditions.append('mime_type = ?')
+                params.append(file_type)
+        if client_ip:
+            conditions.append('client_ip = ?')
+            params.append(client_ip)
+        if cursor:
+            # 以列值比較接續上一頁最後一筆，SQLite可直接在索引中定位
+            conditions.append(f'({column}, path) {"<" if descending else ">"} (?, ?)')
+            params.extend(decode_cursor(cursor))
+
+        direction = 'DESC' if descending else 'ASC'
+        sql = 'SELECT * FROM files'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += f' ORDER BY {column} {direction}, path {direction} LIMIT ?'
+        params.append(limit + 1)
+
+        with self._lock:
+            result = self._conn.execute(sql, params)
+            rows = [self._row_to_dict(result, row) for row in result.fetchall()]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(last[column], last['path'])
+        return rows, next_cursor
+
+    def iter_files(self, sort='uploaded', descending=True, **filters):
+        """依序產生所有符合條件的紀錄（每次只查詢一頁，參數同 list_files）"""
+        cursor = None
+        while True:
+            rows, cursor = self.list_files(sort, descending, cursor, MAX_PAGE_SIZE, **filters)
+            yield from rows
+            if cursor is None:
+                return
+
+    def backfill(self, exclude=()):
+        """
+        計算上傳資料夾中未登記或已變動檔案的雜湊並加入索引，回傳登記的檔案數
+        exclude 為上傳資料夾第一層要略過的資料夾名稱（例如內部資料資料夾）
+        """
+        with self._lock:
+            known = {path: (size, mtime) for path, size, mtime in self._conn.execute(
+                'SELECT path, size, mtime FROM files WHERE tier IS NULL')}
+        exclude = set(exclude)
+        added = 0
+        for dirpath, dirnames, filenames in os.walk(self.root_folder):
+            if os.path.abspath(dirpath) == os.path.abspath(self.root_folder):
+                dirnames[:] = [name for name in dirnames if name not in exclude]
+            for name in filenames:
+                filepath = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    continue
+                path = self.relative_path(filepath)
+                previous = known.get(path)
+                if previous == (stat.st_size, stat.st_mtime):
+                    continue
+                try:
+                    sha256 = hash_file(filepath)
+                except OSError as e:
+                    print(f"無法計算雜湊 {filepath}: {e}")
+                    continue
+                if self._add_if_unchanged(filepath, path, sha256, stat, previous):
+                    added += 1
+        return added
+
+    def _add_if_unchanged(self, filepath, path, sha256, stat, previous):
+        """計算雜湊期間若上傳已登記這個檔案（紀錄已不同），保留上傳的資訊"""
+        mime_type = guess_mime_type(path)
+        with self._lock:
+            row = self._conn.execute('SELECT size, mtime FROM files WHERE path = ?', (path,)).fetchone()
+            if (tuple(row) if row else None) != previous:
+                return False
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files (path, sha256, size, mtime, original_name, mime_type, '
+                'media_type, uploaded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, sha256, stat.st_size, stat.st_mtime, os.path.basename(filepath), mime_type,
+                 mime_type.split('/')[0], stat.st_mtime))
+            self._conn.commit()
+        return True
+
+    def start_backfill(self, exclude=()):
+        """在背景執行 backfill，不延遲伺服器啟動"""
+        def run():
+            try:
+                added = self.backfill(exclude)
+            except Exception as e:
+                print(f"補登既有檔案失敗: {e}")
+                return
+            if added:
+                print(f"🗂️ 已為 {added} 個既有檔案建立索引")
+
+        thread = threading.Thread(target=run, name='index-backfill', daemon=True)
+        thread.start()
+        return thread
+
+    def existing_hashes(self, hashes):
+        """回傳清單中已經存在的雜湊"""
+        return [h for h in hashes if self.lookup(h)]
+
+    def close(self):
+        """關閉資料庫"""
+        with self._lock:
+            self._conn.close()
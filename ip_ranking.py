@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+候選IP排名
+依實際量測排序，而不是猜測網段：
+  - 路由：哪個位址是預設路由的來源，哪些介面是虛擬網卡（Docker、VirtualBox、VPN等）
+  - 連線：手機實際是透過哪個本機IP連進來（請求的Host）
+  - 速度：連進來之後上傳的實際吞吐量，以及手機執行測速的結果
+量測結果合併存入設定檔，表現最好的IP自動記為偏好IP，下次啟動時QR Code視窗直接顯示它
+"""
+
+import os
+import json
+import socket
+import threading
+import time
+
+from network_discovery import read_netlink_addresses, netlink_available
+
+MIN_SAMPLE_BYTES = 512 * 1024       # 小於這個大小的請求不足以估計速度
+THROUGHPUT_SMOOTHING = 0.3          # 指數移動平均的權重
+STATS_MAX_AGE = 30 * 24 * 3600      # 超過這個時間沒有連線的紀錄不列入排名
+SAVE_INTERVAL = 30                  # 量測結果最短的存檔間隔（秒）
+PROBE_TTL = 30                      # 路由與介面資訊的快取時間
+
+# 通常無法與手機連線的虛擬介面名稱
+VIRTUAL_INTERFACE_PREFIXES = ('docker', 'br-', 'veth', 'virbr', 'vboxnet', 'vmnet', 'tun', 'tap',
+                              'wg', 'tailscale', 'zt', 'utun', 'lo')
+
+_config_lock = threading.Lock()
+
+
+def load_config(path):
+    """讀取設定檔，不存在或格式錯誤時回傳空設定"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        return config if isinstance(config, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"載入設定檔失敗: {e}")
+        return {}
+
+
+def update_config(path, values):
+    """將 values 合併寫入設定檔（保留其他設定，先寫暫存檔再取代）"""
+    with _config_lock:
+        config = load_config(path)
+        config.update(values)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return config
+
+
+def default_route_ip():
+    """預設路由使用的本機IP（UDP connect不會實際送出封包）"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(('8.8.8.8', 80))
+            return s.getsockname()[0]
+    except OSError:
+        return None
+
+
+def interface_labels():
+    """IP → 介面名稱（Linux透過netlink取得，其他平台回傳空字典）"""
+    if not netlink_available():
+        return {}
+    try:
+        return {ip: label for label, ip, _prefixlen in read_netlink_addresses()}
+    except OSError:
+        return {}
+
+
+def is_virtual_interface(label):
+    return bool(label) and label.lower().startswith(VIRTUAL_INTERFACE_PREFIXES)
+
+
+class ReceiveMeter:
+    """
+    計算從網路讀取請求內容的位元組數與時間，用來估計傳輸速度
+    放在頻寬限制之下，只計算實際讀取socket的時間，不含頻寬分配的等待與處理的時間
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def read(self, size=-1):
+        started = time.perf_counter()
+        data = self._stream.read(size)
+        self.seconds += time.perf_counter() - started
+        self.bytes += len(data)
+        return data
+
+
+class IPRanker:
+    """收集各本機IP的連線與速度量測，並據此排序候選IP"""
+
+    def __init__(self, config_path, on_best_changed=None):
+        """on_best_changed(ip)：量測結果最好的IP改變時呼叫（例如更新偏好IP）"""
+        self.config_path = config_path
+        self.on_best_changed = on_best_changed
+        self._lock = threading.Lock()
+        self._stats = load_config(config_path).get('ip_stats', {})
+        self._best = None
+        self._dirty = False
+        self._last_save = 0
+        self._probe = None
+        self._probe_time = 0
+
+    # ---- 量測 ----
+
+    def record_connection(self, local_ip, client_ip):
+        """手機透過 local_ip 送來一個請求"""
+        now = time.time()
+        with self._lock:
+            stats = self._stats.setdefault(local_ip, {})
+            stats['requests'] = stats.get('requests', 0) + 1
+            clients = stats.setdefault('clients', [])
+            if client_ip and client_ip not in clients:
+                clients.append(client_ip)
+                # 只保留最近的幾個用戶端
+                del clients[:-10]
+            stats['last_seen'] = now
+            self._dirty = True
+        self._maybe_save()
+
+    def record_transfer(self, local_ip, size, seconds):
+        """記錄一次透過 local_ip 的傳輸速度"""
+        if size < MIN_SAMPLE_BYTES or seconds <= 0:
+            return
+        rate = size / seconds
+        with self._lock:
+            stats = self._stats.setdefault(local_ip, {})
+            previous = stats.get('throughput')
+            stats['throughput'] = rate if previous is None else (
+                previous + THROUGHPUT_SMOOTHING * (rate - previous))
+            stats['samples'] = stats.get('samples', 0) + 1
+            stats['last_seen'] = time.time()
+            self._dirty = True
+        self._update_best()
+        self._maybe_save()
+
+    def record_speedtest(self, local_ip, direction, rate):
+        """記錄透過 local_ip 的測速結果（direction 為 'download' 或 'upload'，單位位元組/秒）"""
+        now = time.time()
+        with self._lock:
+            stats = self._stats.setdefault(local_ip, {})
+            result = stats.setdefault('speedtest', {})
+            result[direction] = rate
+            result['measured_at'] = now
+            stats['last_seen'] = now
+            self._dirty = True
+        self._maybe_save(force=True)
+
+    def _update_best(self):
+        with self._lock:
+            measured = {ip: s['throughput'] for ip, s in self._stats.items()
+                        if s.get('throughput') and self._is_fresh(s)}
+            best = max(measured, key=measured.get) if measured else None
+            changed = best is not None and best != self._best
+            self._best = best
+        if changed and self.on_best_changed:
+            self.on_best_changed(best)
+
+    @staticmethod
+    def _is_fresh(stats):
+        return time.time() - stats.get('last_seen', 0) < STATS_MAX_AGE
+
+    def _maybe_save(self, force=False):
+        if not self._dirty or (not force and time.time() - self._last_save < SAVE_INTERVAL):
+            return
+        with self._lock:
+            self._dirty = False
+            self._last_save = time.time()
+            stats = json.loads(json.dumps(self._stats))
+        try:
+            update_config(self.config_path, {'ip_stats': stats})
+        except OSError as e:
+            print(f"儲存IP量測結果失敗: {e}")
+
+    def save(self):
+        """立即儲存尚未寫入的量測結果"""
+        self._maybe_save(force=True)
+
+    # ---- 排名 ----
+
+    def probe(self):
+        """路由與介面資訊（快取 PROBE_TTL 秒）"""
+        now = time.monotonic()
+        if self._probe is None or now - self._probe_time > PROBE_TTL:
+            self._probe = {'default_route': default_route_ip(), 'labels': interface_labels()}
+            self._probe_time = now
+        return self._probe
+
+    def describe(self, ip):
+        """單一IP的量測結果"""
+        probe = self.probe()
+        label = probe['labels'].get(ip)
+        with self._lock:
+            stats = dict(self._stats.get(ip, {}))
+        fresh = self._is_fresh(stats) if stats else False
+        return {
+            'ip': ip,
+            'interface': label,
+            'virtual': is_virtual_interface(label),
+            'default_route': ip == probe['default_route'],
+            'requests': stats.get('requests', 0) if fresh else 0,
+            'clients': len(stats.get('clients', [])) if fresh else 0,
+            'throughput': stats.get('throughput') if fresh else None,
+            'speedtest': dict(stats['speedtest']) if fresh and stats.get('speedtest') else None,
+        }
+
+    def rank(self, ips, preferred_ip=None):
+        """依量測結果排序：量到的速度 > 偏好IP > 有手機連線過 > 預設路由 > 非虛擬介面"""
+        def score(info):
+            return (
+                info['throughput'] is not None,
+                info['throughput'] or 0,
+                info['ip'] == preferred_ip,
+                info['requests'] > 0,
+                info['default_route'],
+                not info['virtual'],
+            )
+        infos = [self.describe(ip) for ip in ips]
+        # sorted是穩定排序，分數相同時保留原本的順序
+        return [info['ip'] for info in sorted(infos, key=score, reverse=True)]
+
+    def report(self, ips):
+        """所有候選IP的排名與量測結果（/status 使用）"""
+        return [self.describe(ip) for ip in self.rank(ips)]
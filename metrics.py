@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prometheus格式的效能指標
+每個執行緒寫入自己的分片，更新時不需要取得鎖，只有 /metrics 讀取時才合併，
+避免拖慢上傳的熱路徑
+"""
+
+import bisect
+import threading
+
+# 預設直方圖分界
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+THROUGHPUT_BUCKETS = tuple(mb * 1024 * 1024 for mb in (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500))
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+# 已結束執行緒的分片超過這個數量時合併
+RETIRE_THRESHOLD = 64
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+class _Metric:
+    """指標基底類別"""
+
+    kind = 'untyped'
+
+    def __init__(self, registry, name, help_text, labels=()):
+        self._registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+
+    def _key(self, labels):
+        return (self.name, tuple(str(labels.get(n, '')) for n in self.label_names))
+
+
+class Counter(_Metric):
+    """只增不減的計數器"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self._registry._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def render(self, series):
+        lines = []
+        for values, total in sorted(series.items()):
+            lines.append(f'{self.name}{_format_labels(self.label_names, values)} {_format_value(total)}')
+        return lines
+
+
+class Gauge(Counter):
+    """可增可減的數值（各分片加總）"""
+
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """直方圖"""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(registry, name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        shard = self._registry._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            state = shard[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def render(self, series):
+        lines = []
+        for values, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = _format_labels(self.label_names, values, ('le', _format_value(float(bound))))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, values, ('le', '+Inf'))
+            lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _format_labels(self.label_names, values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+def _merge_into(target, shard):
+    """將一個分片的數值加到合併結果"""
+    for key, value in list(shard.items()):
+        if isinstance(value, list):
+            state = target.get(key)
+            if state is None:
+                target[key] = [list(value[0]), value[1], value[2]]
+            else:
+                state[0] = [a + b for a, b in zip(state[0], value[0])]
+                state[1] += value[1]
+                state[2] += value[2]
+        else:
+            target[key] = target.get(key, 0) + value
+
+
+class MetricsRegistry:
+    """指標登錄表"""
+
+    def __init__(self):
+        self._metrics = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []          # (執行緒, 分片)
+        self._retired = {}         # 已結束執行緒的合併結果
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) > RETIRE_THRESHOLD:
+                    self._retire_dead_shards()
+        return shard
+
+    def _retire_dead_shards(self):
+        """合併已結束執行緒的分片（它們不會再被寫入）"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                _merge_into(self._retired, shard)
+        self._shards = alive
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(self, name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, labels=()):
+        metric = Gauge(self, name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        metric = Histogram(self, name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collect(self):
+        """合併所有分片"""
+        with self._lock:
+            self._retire_dead_shards()
+            merged = {}
+            _merge_into(merged, self._retired)
+            for _thread, shard in self._shards:
+                _merge_into(merged, shard)
+        return merged
+
+    def render(self):
+        """輸出Prometheus文字格式"""
+        series = {}
+        for (name, values), value in self.collect().items():
+            series.setdefault(name, {})[values] = value
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render(series.get(metric.name, {})))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+串流解析multipart上傳
+邊接收邊解析請求內容，每個檔案直接寫入最終位置，不經過Werkzeug的暫存檔
+"""
+
+import time
+
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+
+READ_BUFFER_SIZE = 256 * 1024          # 每次從網路讀取的大小
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024    # 寫入磁碟的緩衝大小
+MAX_FORM_MEMORY_SIZE = 1024 * 1024     # 一般表單欄位的大小上限
+
+
+def save_chunks(path, chunks, buffer_size=WRITE_BUFFER_SIZE, on_data=None, on_write=None):
+    """將資料區塊依序寫入指定路徑，回傳寫入的位元組數
+    資料累積到 buffer_size 才寫入一次；on_data 會收到每個資料區塊，
+    on_write(位元組數, 秒數) 回報每次實際寫入（系統呼叫）的位元組數與花費的時間
+    """
+    written = 0
+    pending = 0
+    # 重複使用同一塊緩衝區，不為每次寫入配置記憶體
+    buffer = memoryview(bytearray(buffer_size))
+    with open(path, 'wb', buffering=0) as f:
+        for data in chunks:
+            if pending and pending + len(data) > buffer_size:
+                _write_all(f, buffer[:pending], on_write)
+                pending = 0
+            if len(data) >= buffer_size:
+                _write_all(f, data, on_write)
+            else:
+                buffer[pending:pending + len(data)] = data
+                pending += len(data)
+            written += len(data)
+            if on_data:
+                on_data(data)
+        if pending:
+            _write_all(f, buffer[:pending], on_write)
+    return written
+
+
+def _write_all(f, data, on_write):
+    """以未緩衝的檔案寫入全部資料（可能分成多次系統呼叫）"""
+    view = memoryview(data)
+    started = time.perf_counter()
+    total = 0
+    while total < len(view):
+        total += f.write(view[total:])
+    if on_write:
+        on_write(total, time.perf_counter() - started)
+
+
+class StreamedPart:
+    """multipart中的一個欄位或檔案，資料必須在讀取下一個欄位前讀完"""
+
+    def __init__(self, reader, event):
+        self._reader = reader
+        self.name = event.name
+        self.headers = event.headers
+        self.filename = event.filename if isinstance(event, File) else None
+        self.finished = False
+
+    def iter_chunks(self):
+        """依序產生這個欄位的資料區塊"""
+        while not self.finished:
+            event = self._reader._next_event()
+            if not isinstance(event, Data):
+                raise ValueError('multipart格式錯誤')
+            if not event.more_data:
+                self.finished = True
+            if event.data:
+                yield event.data
+
+    def drain(self):
+        """略過剩餘的資料"""
+        for _ in self.iter_chunks():
+            pass
+
+    def read_text(self, encoding='utf-8'):
+        """讀取一般表單欄位的文字內容"""
+        return b''.join(self.iter_chunks()).decode(encoding, 'replace')
+
+    def save(self, path, buffer_size=WRITE_BUFFER_SIZE, on_data=None, on_write=None):
+        """將檔案內容直接寫入指定路徑，回傳寫入的位元組數（參數同 save_chunks）"""
+        try:
+            return save_chunks(path, self.iter_chunks(), buffer_size, on_data, on_write)
+        except OSError:
+            # 磁碟寫入失敗時仍要讀完這個欄位，後面的檔案才能繼續解析
+            self.drain()
+            raise
+
+
+class MultipartStreamReader:
+    """從請求串流逐一取出multipart欄位，記憶體用量與檔案數量無關"""
+
+    def __init__(self, stream, boundary, buffer_size=READ_BUFFER_SIZE):
+        self._stream = stream
+        self._buffer_size = buffer_size
+        self._decoder = MultipartDecoder(boundary, max_form_memory_size=MAX_FORM_MEMORY_SIZE)
+        self._eof = False
+
+    def _next_event(self):
+        """取得下一個解析事件，資料不足時從串流讀取"""
+        while True:
+            event = self._decoder.next_event()
+            if not isinstance(event, NeedData):
+                return event
+            if self._eof:
+                raise ValueError('multipart內容不完整')
+            data = self._stream.read(self._buffer_size)
+            if not data:
+                self._eof = True
+                self._decoder.receive_data(None)
+            else:
+                self._decoder.receive_data(data)
+
+    def parts(self):
+        """依序產生每個欄位，未讀取的資料會自動略過"""
+        while True:
+            event = self._next_event()
+            if isinstance(event, Epilogue):
+                return
+            if isinstance(event, (Field, File)):
+                part = StreamedPart(self, event)
+                yield part
+                if not part.finished:
+                    part.drain()
+
+
+def get_multipart_boundary(request):
+    """取得multipart請求的boundary，不是multipart時回傳None"""
+    if request.mimetype != 'multipart/form-data':
+        return None
+    boundary = request.mimetype_params.get('boundary')
+    return boundary.encode('latin-1') if boundary else None
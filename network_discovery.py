@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+網路介面偵測服務
+快取本機IP清單並在背景更新；Linux直接透過netlink向核心讀取介面位址，不需要啟動子程序，
+並監聽核心的位址變更通知，介面有變動時以事件通知訂閱者
+"""
+
+import os
+import socket
+import struct
+import threading
+
+DEFAULT_TTL = 30  # 秒
+
+# netlink常數（linux/rtnetlink.h）
+NETLINK_ROUTE = 0
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+RTMGRP_IPV4_IFADDR = 0x10
+
+NLMSG_HEADER = struct.Struct('=IHHII')
+IFADDRMSG = struct.Struct('=BBBBI')
+RTATTR = struct.Struct('=HH')
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _parse_ifaddr(payload):
+    """解析RTM_NEWADDR訊息，回傳 (介面名稱, IP, 前綴長度)"""
+    family, prefixlen, _flags, _scope, _index = IFADDRMSG.unpack_from(payload)
+    if family != socket.AF_INET:
+        return None
+    attrs = {}
+    offset = IFADDRMSG.size
+    while offset + RTATTR.size <= len(payload):
+        attr_len, attr_type = RTATTR.unpack_from(payload, offset)
+        if attr_len < RTATTR.size:
+            break
+        attrs[attr_type] = payload[offset + RTATTR.size:offset + attr_len]
+        offset += _align(attr_len)
+    address = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+    if not address:
+        return None
+    label = attrs.get(IFA_LABEL, b'').split(b'\0', 1)[0].decode('utf-8', 'replace')
+    return label, socket.inet_ntoa(address[:4]), prefixlen
+
+
+def read_netlink_addresses():
+    """透過netlink讀取所有IPv4介面位址（僅限Linux）"""
+    results = []
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE) as sock:
+        sock.settimeout(2)
+        sock.bind((0, 0))
+        request = NLMSG_HEADER.pack(NLMSG_HEADER.size + IFADDRMSG.size, RTM_GETADDR,
+                                    NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+        request += IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0)
+        sock.send(request)
+
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(data):
+                msg_len, msg_type, _flags, _seq, _pid = NLMSG_HEADER.unpack_from(data, offset)
+                if msg_len < NLMSG_HEADER.size:
+                    return results
+                if msg_type == NLMSG_DONE:
+                    return results
+                if msg_type == NLMSG_ERROR:
+                    raise OSError('netlink回傳錯誤')
+                if msg_type == RTM_NEWADDR:
+                    parsed = _parse_ifaddr(data[offset + NLMSG_HEADER.size:offset + msg_len])
+                    if parsed:
+                        results.append(parsed)
+                offset += _align(msg_len)
+
+
+def netlink_available():
+    """是否可以使用netlink"""
+    return hasattr(socket, 'AF_NETLINK') and os.name == 'posix'
+
+
+class InterfaceDiscovery:
+    """快取的網路介面清單，背景更新並以事件通知變動"""
+
+    def __init__(self, probe, ttl=DEFAULT_TTL):
+        self._probe = probe
+        self.ttl = ttl
+        self._ips = None
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._stop = threading.Event()
+
+    def get_ips(self):
+        """取得快取的IP清單（尚未偵測過時會同步偵測一次）"""
+        if self._ips is None:
+            self.refresh()
+        return list(self._ips)
+
+    def subscribe(self, callback):
+        """訂閱介面變動事件：callback(ips, added, removed)，在背景執行緒中呼叫"""
+        self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        """取消訂閱"""
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def refresh(self):
+        """重新偵測，有變動時通知訂閱者"""
+        try:
+            ips = self._probe()
+        except Exception as e:
+            print(f"偵測網路介面失敗: {e}")
+            return
+        with self._lock:
+            previous = self._ips
+            self._ips = ips
+        if previous is None or set(previous) == set(ips):
+            return
+        added = [ip for ip in ips if ip not in previous]
+        removed = [ip for ip in previous if ip not in ips]
+        print(f"🔄 網路介面變動: 新增 {added or '無'}，移除 {removed or '無'}")
+        for callback in list(self._listeners):
+            try:
+                callback(list(ips), added, removed)
+            except Exception as e:
+                print(f"網路介面事件處理失敗: {e}")
+
+    def _watch_netlink(self):
+        """監聽核心的位址變更通知，沒有通知時每隔TTL重新確認一次"""
+        with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE) as sock:
+            sock.bind((0, RTMGRP_IPV4_IFADDR))
+            sock.settimeout(self.ttl)
+            while not self._stop.is_set():
+                try:
+                    sock.recv(65536)
+                    # 一次變動常有多則通知，稍等後合併處理
+                    sock.settimeout(0.5)
+                    try:
+                        while True:
+                            sock.recv(65536)
+                    except socket.timeout:
+                        pass
+                    sock.settimeout(self.ttl)
+                except socket.timeout:
+                    pass
+                self.refresh()
+
+    def _run(self):
+        if self._ips is None:
+            self.refresh()
+        if netlink_available():
+            try:
+                self._watch_netlink()
+                return
+            except OSError as e:
+                print(f"無法監聽netlink，改為定時偵測: {e}")
+        while not self._stop.wait(self.ttl):
+            self.refresh()
+
+    def start(self):
+        """啟動背景更新執行緒"""
+        thread = threading.Thread(target=self._run, name='interface-discovery', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """停止背景更新"""
+        self._stop.set()
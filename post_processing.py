@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上傳後處理工作佇列
+上傳請求只把工作寫入磁碟上的日誌就立即回應，背景工作執行緒依序執行各處理步驟
+（檢查雜湊、依拍攝日期整理到 YYYY/MM 等），失敗時延遲重試。
+日誌記錄每個工作完成到哪一步，伺服器重新啟動後未完成的工作會從中斷的步驟繼續
+"""
+
+import os
+import json
+import heapq
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from file_index import hash_file
+from atomic_store import link_unique_name
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_DELAY = 5                 # 第一次重試前等待的秒數，之後每次加倍
+MAX_RETRY_DELAY = 300
+COMPACT_THRESHOLD = 1000        # 日誌累積這麼多筆已結束的紀錄後重寫
+MAX_FAILED_JOBS = 100           # 保留供查看的失敗工作數
+
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+EXIF_DATETIME = 0x0132
+
+
+class JobError(Exception):
+    """無法靠重試解決的錯誤，工作直接標記為失敗"""
+
+
+class Job:
+    """一個上傳檔案的後處理工作"""
+
+    def __init__(self, job_id, path, sha256, steps, step=0, attempts=0, created_at=None,
+                 error=None, data=None):
+        self.id = job_id
+        self.path = path
+        self.sha256 = sha256
+        self.steps = list(steps)
+        self.step = step
+        self.attempts = attempts
+        self.created_at = created_at or time.time()
+        self.error = error
+        self.data = data or {}
+        self._queue = None
+
+    def checkpoint(self):
+        """將 data 寫入日誌（步驟在執行無法復原的動作前呼叫，中斷後重新執行時可據此接續）"""
+        if self._queue is not None:
+            self._queue._record_data(self)
+
+    @property
+    def current_step(self):
+        return self.steps[self.step] if self.step < len(self.steps) else None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'path': self.path,
+            'sha256': self.sha256,
+            'steps': self.steps,
+            'step': self.step,
+            'attempts': self.attempts,
+            'created_at': self.created_at,
+            'error': self.error,
+            'data': self.data,
+        }
+
+    @classmethod
+    def from_dict(cls, record):
+        return cls(record['id'], record['path'], record['sha256'], record['steps'],
+                   step=record.get('step', 0), attempts=record.get('attempts', 0),
+                   created_at=record.get('created_at'), error=record.get('error'),
+                   data=record.get('data'))
+
+
+class JobQueue:
+    """
+    持久化的後處理佇列
+    步驟以名稱註冊：step(job) 可回傳檔案的新路徑（例如移動到其他資料夾），回傳None表示路徑不變。
+    步驟可能在中斷後重新執行，必須可重複執行。
+    on_event(job, state) 在工作狀態改變時呼叫：queued、step（完成一個步驟）、retry、done、failed
+    """
+
+    def __init__(self, journal_path, workers=DEFAULT_WORKERS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 retry_delay=RETRY_DELAY, on_event=None, name='post-processing'):
+        self.journal_path = journal_path
+        self.name = name
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.on_event = on_event
+        os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+        self._steps = {}
+        self._jobs = {}
+        self._failed = {}
+        self._ready = []            # (可執行時間, 序號, 工作ID)
+        self._sequence = 0
+        self._running = 0
+        self._completed = 0
+        self._finished_records = 0
+        self._condition = threading.Condition()
+        self._journal = None
+        self._threads = []
+        self._started = False
+        self._stopping = False
+
+    def register_step(self, name, func):
+        """註冊處理步驟"""
+        self._steps[name] = func
+
+    # ---- 日誌 ----
+
+    def _append(self, record):
+        """寫入一筆日誌（呼叫時須持有鎖）"""
+        self._journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._journal.flush()
+
+    def _load_journal(self):
+        """重播日誌，還原未完成與失敗的工作"""
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 寫到一半就中斷的最後一行
+                        continue
+                    op = record.get('op')
+                    if op == 'queued':
+                        job = Job.from_dict(record['job'])
+                        job._queue = self
+                        self._jobs[job.id] = job
+                        continue
+                    job = self._jobs.get(record.get('id'))
+                    if job is None:
+                        continue
+                    if op == 'progress':
+                        job.step = record['step']
+                        job.path = record['path']
+                        job.attempts = 0
+                    elif op == 'data':
+                        job.data = record['data']
+                    elif op == 'retry':
+                        job.attempts = record['attempts']
+                        job.error = record.get('error')
+                    elif op == 'done':
+                        del self._jobs[job.id]
+                    elif op == 'failed':
+                        job.error = record.get('error')
+                        self._failed[job.id] = self._jobs.pop(job.id)
+        except FileNotFoundError:
+            pass
+        self._trim_failed()
+
+    def _trim_failed(self):
+        while len(self._failed) > MAX_FAILED_JOBS:
+            del self._failed[next(iter(self._failed))]
+
+    def _compact(self):
+        """只保留未完成與失敗的工作，重寫日誌（呼叫時須持有鎖）"""
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for job in list(self._jobs.values()) + list(self._failed.values()):
+                f.write(json.dumps({'op': 'queued', 'job': job.to_dict()}, ensure_ascii=False) + '\n')
+            for job in self._failed.values():
+                f.write(json.dumps({'op': 'failed', 'id': job.id, 'error': job.error},
+                                   ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if self._journal is not None:
+            self._journal.close()
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._finished_records = 0
+
+    # ---- 佇列 ----
+
+    def start(self):
+        """載入日誌並啟動工作執行緒（可重複呼叫）"""
+        with self._condition:
+            if self._started:
+                return
+            self._started = True
+            self._load_journal()
+            self._compact()
+            for job in self._jobs.values():
+                self._push(job, 0)
+            if self._jobs:
+                print(f"🔁 繼續 {len(self._jobs)} 個未完成的後處理工作")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'{self.name}-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """停止工作執行緒（未完成的工作留在日誌中，下次啟動繼續）"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        with self._condition:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def _push(self, job, delay):
+        """排入待執行（呼叫時須持有鎖）"""
+        self._sequence += 1
+        heapq.heappush(self._ready, (time.monotonic() + delay, self._sequence, job.id))
+        self._condition.notify()
+
+    def enqueue(self, path, sha256, steps, delay=0, **data):
+        """
+        加入工作並立即返回；寫入日誌後即使伺服器重新啟動也會執行
+        delay 秒後才開始執行（伺服器重新啟動後未完成的工作立即執行）
+        """
+        self.start()
+        unknown = [name for name in steps if name not in self._steps]
+        if unknown:
+            raise ValueError(f'未註冊的處理步驟: {", ".join(unknown)}')
+        job = Job(uuid.uuid4().hex, path, sha256, steps, data=data)
+        job._queue = self
+        with self._condition:
+            self._append({'op': 'queued', 'job': job.to_dict()})
+            self._jobs[job.id] = job
+            self._push(job, delay)
+        self._notify(job, 'queued')
+        return job
+
+    def _notify(self, job, state):
+        """通知工作狀態改變（不持有鎖，回呼不會拖慢其他工作執行緒）"""
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(job, state)
+        except Exception as e:
+            print(f"後處理事件回呼失敗: {e}")
+
+    def _next_job(self):
+        """取出下一個可執行的工作，停止時回傳None"""
+        with self._condition:
+            while not self._stopping:
+                if self._ready:
+                    ready_at, _, job_id = self._ready[0]
+                    wait = ready_at - time.monotonic()
+                    if wait <= 0:
+                        heapq.heappop(self._ready)
+                        job = self._jobs.get(job_id)
+                        if job is not None:
+                            self._running += 1
+                            return job
+                        continue
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+            return None
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                self._process(job)
+            finally:
+                with self._condition:
+                    self._running -= 1
+
+    def _process(self, job):
+        """依序執行剩下的步驟，每完成一步就記錄到日誌"""
+        while job.current_step is not None:
+            name = job.current_step
+            try:
+                new_path = self._steps[name](job)
+            except Exception as e:
+                self._handle_failure(job, name, e)
+                return
+            with self._condition:
+                job.step += 1
+                job.attempts = 0
+                job.path = new_path or job.path
+                self._append({'op': 'progress', 'id': job.id, 'step': job.step, 'path': job.path})
+            self._notify(job, 'step')
+
+        with self._condition:
+            self._append({'op': 'done', 'id': job.id})
+            del self._jobs[job.id]
+            self._completed += 1
+            self._record_finished()
+        self._notify(job, 'done')
+
+    def _record_data(self, job):
+        with self._condition:
+            self._append({'op': 'data', 'id': job.id, 'data': job.data})
+
+    def _handle_failure(self, job, name, error):
+        message = f'{name}: {error}'
+        with self._condition:
+            job.attempts += 1
+            job.error = message
+            failed = isinstance(error, JobError) or job.attempts >= self.max_attempts
+            if failed:
+                print(f"❌ 後處理失敗 {os.path.basename(job.path)}: {message}")
+                self._append({'op': 'failed', 'id': job.id, 'error': message})
+                self._failed[job.id] = self._jobs.pop(job.id)
+                self._trim_failed()
+                self._record_finished()
+            else:
+                delay = min(MAX_RETRY_DELAY, self.retry_delay * 2 ** (job.attempts - 1))
+                self._append({'op': 'retry', 'id': job.id, 'attempts': job.attempts, 'error': message})
+                self._push(job, delay)
+        self._notify(job, 'failed' if failed else 'retry')
+
+    def _record_finished(self):
+        """呼叫時須持有鎖"""
+        self._finished_records += 1
+        if self._finished_records >= COMPACT_THRESHOLD:
+            try:
+                self._compact()
+            except OSError as e:
+                print(f"重寫後處理日誌失敗: {e}")
+
+    def status(self):
+        """佇列狀態與最近失敗的工作"""
+        with self._condition:
+            return {
+                'pending': len(self._jobs) - self._running,
+                'running': self._running,
+                'completed': self._completed,
+                'failed': [{'path': job.path, 'error': job.error} for job in self._failed.values()],
+            }
+
+
+# ---- 內建處理步驟 ----
+
+def verify_checksum(job):
+    """重新讀取磁碟上的檔案，確認內容與上傳時計算的SHA-256相同"""
+    if not os.path.exists(job.path):
+        raise JobError('檔案不存在')
+    if hash_file(job.path) != job.sha256:
+        raise JobError('SHA-256不符，寫入磁碟的內容已損壞')
+
+
+def capture_date(path):
+    """照片的拍攝日期（EXIF），沒有EXIF時使用檔案修改時間"""
+    try:
+        from PIL import Image
+
+        with Image.open(path) as image:
+            exif = image.getexif()
+            value = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+        if value:
+            return datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except Exception:
+        pass
+    return datetime.fromtimestamp(os.path.getmtime(path))
+
+
+def make_organize_step(root_folder, on_moved=None, name_taken=None):
+    """
+    建立「依拍攝日期整理」步驟：移動到 root_folder/YYYY/MM/
+    on_moved(舊路徑, 新路徑) 在移動後呼叫（更新檔案目錄等），當機後重新執行時可能再呼叫一次，必須可重複執行；
+    name_taken 同 link_unique_name 的 taken
+    """
+    def organize_by_date(job):
+        path = job.path
+        name = os.path.basename(path)
+        if not os.path.exists(path):
+            # 上次已移動但尚未記錄到日誌
+            moved = job.data.get('organized_path')
+            if moved and os.path.exists(moved):
+                # 移動後、通知之前就中斷時，檔案目錄仍是舊路徑
+                if on_moved:
+                    on_moved(path, moved)
+                return moved
+            raise JobError('檔案不存在')
+
+        taken = capture_date(path)
+        target_dir = os.path.join(root_folder, f'{taken:%Y}', f'{taken:%m}')
+        if os.path.abspath(os.path.dirname(path)) == os.path.abspath(target_dir):
+            return None
+        os.makedirs(target_dir, exist_ok=True)
+        # 先建立硬連結並記錄目的地，才刪除原檔；中斷後重新執行會沿用已建立的連結
+        target = link_unique_name(path, target_dir, name, name_taken)
+        job.data['organized_path'] = target
+        job.checkpoint()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        if on_moved:
+            on_moved(path, target)
+        return target
+
+    return organize_by_date
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+正式環境伺服器
+以cheroot（選擇器事件迴圈管理閒置連線 + 工作執行緒池處理請求）取代Flask開發伺服器，
+支援keep-alive、可調整的並行上限，並加大socket緩衝區以利接收大型上傳；
+下載檔案時以 socket.sendfile 零拷貝送出
+"""
+
+import socket
+
+try:
+    from cheroot.wsgi import Server as CherootServer, Gateway_10
+except ImportError:
+    CherootServer = None
+
+DEFAULT_THREADS = 32                      # 同時處理的請求數
+DEFAULT_BACKLOG = 128                     # 等待accept的連線佇列
+DEFAULT_TIMEOUT = 60                      # 連線閒置逾時（秒）
+DEFAULT_KEEPALIVE_CONNECTIONS = 64        # 保留的keep-alive閒置連線數
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024      # 4MB
+
+
+def production_server_available():
+    """是否已安裝cheroot"""
+    return CherootServer is not None
+
+
+if CherootServer is not None:
+    class TunedWSGIServer(CherootServer):
+        """在listen之前設定socket緩衝區，接受的連線會沿用較大的TCP視窗"""
+
+        socket_buffer_size = SOCKET_BUFFER_SIZE
+
+        def bind(self, family, type, proto=0):
+            sock = super().bind(family, type, proto)
+            if self.socket_buffer_size:
+                for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+                    try:
+                        sock.setsockopt(socket.SOL_SOCKET, option, self.socket_buffer_size)
+                    except OSError:
+                        pass
+            return sock
+
+    class SendfileGateway(Gateway_10):
+        """
+        回應本體提供 file/offset/length 時直接以sendfile送出，其餘照一般WSGI處理；
+        應用程式回應 Connection: close 時（例如拒絕尚未讀取的上傳）確實關閉連線
+        """
+
+        def start_response(self, status, headers, exc_info=None):
+            for name, value in headers:
+                if name.lower() == 'connection' and value.lower() == 'close':
+                    self.req.close_connection = True
+            return super().start_response(status, headers, exc_info)
+
+        def respond(self):
+            response = self.req.server.wsgi_app(self.env, self.start_response)
+            try:
+                if not self._sendfile(response):
+                    for chunk in filter(None, response):
+                        if not isinstance(chunk, bytes):
+                            raise ValueError('WSGI Applications must yield bytes')
+                        self.write(chunk)
+            finally:
+                self.req.ensure_headers_sent()
+                if hasattr(response, 'close'):
+                    response.close()
+
+        def _sendfile(self, response):
+            fileobj = getattr(response, 'file', None)
+            sock = getattr(self.req.conn, 'socket', None)
+            if (fileobj is None or not isinstance(sock, socket.socket) or self.req.chunked_write
+                    or self.remaining_bytes_out != response.length):
+                return False
+
+            self.req.ensure_headers_sent()
+            self.req.conn.wfile.flush()
+            sent = sock.sendfile(fileobj, response.offset, response.length) if response.length else 0
+            self.remaining_bytes_out -= sent
+            if sent != response.length:
+                raise IOError(f'檔案在傳送中變短（{sent}/{response.length} 位元組）')
+            return True
+
+
+def create_production_server(app, host, port, threads=DEFAULT_THREADS, backlog=DEFAULT_BACKLOG,
+                             timeout=DEFAULT_TIMEOUT,
+                             keepalive_connections=DEFAULT_KEEPALIVE_CONNECTIONS,
+                             socket_buffer_size=SOCKET_BUFFER_SIZE):
+    """建立正式環境伺服器（尚未開始服務）"""
+    if CherootServer is None:
+        raise RuntimeError('未安裝cheroot，請執行 pip install cheroot')
+
+    server = TunedWSGIServer((host, port), app, numthreads=threads, max=threads,
+                             request_queue_size=backlog, timeout=timeout,
+                             server_name='mobile-file-transfer')
+    server.gateway = SendfileGateway
+    server.keep_alive_conn_limit = keepalive_connections
+    server.socket_buffer_size = socket_buffer_size
+    return server
+
+
+def run_production_server(app, host, port, on_ready=None, **options):
+    """啟動正式環境伺服器並阻塞直到停止，on_ready 在開始監聽後、處理連線前呼叫"""
+    server = create_production_server(app, host, port, **options)
+    try:
+        server.prepare()
+        if on_ready is not None:
+            on_ready()
+        server.serve()
+    finally:
+        server.stop()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+請求效能剖析（預設關閉）
+啟用後每個請求記錄各階段花費的時間，超過門檻的慢請求寫成JSON報告存到剖析資料夾
+（只保留最新的 max_profiles 份），可離線查看時間花在哪裡：
+  admission  排隊等待上傳名額
+  receive    從網路讀取請求內容（含頻寬限制的等待）
+  parse      解析multipart、解壓、計算雜湊等處理（處理時間扣除其他階段）
+  write      寫入磁碟
+  fsync      發布檔案（改名與fsync）
+  index      登記到檔案目錄、排入縮圖與後處理
+  respond    處理完成到回應內容送完（after_request與串流的回應內容，例如下載）
+另可依 sample_rate 抽樣以cProfile記錄函式層級的呼叫，慢請求同時存下 .prof 檔（可用 snakeviz 開啟）；
+同一時間只剖析一個請求（Python 3.12起同時啟用多個cProfile會失敗），其他抽中的請求只記錄階段時間。
+關閉時每個請求只多一次屬性檢查，可以直接保留在正式版的執行檔中
+"""
+
+import os
+import io
+import json
+import queue
+import random
+import threading
+import time
+import cProfile
+import pstats
+from datetime import datetime
+
+DEFAULT_THRESHOLD = 1.0             # 超過這個秒數的請求寫出報告
+DEFAULT_MAX_PROFILES = 100          # 剖析資料夾保留的報告數
+TOP_FUNCTIONS = 25                  # 報告中列出的函式數（依累計時間）
+PHASES = ('admission', 'receive', 'parse', 'write', 'fsync', 'index', 'respond')
+
+
+class RequestTrace:
+    """一個請求的各階段時間"""
+
+    def __init__(self, method, path, endpoint, client, content_length, profile=False):
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+        self.method = method
+        self.path = path
+        self.endpoint = endpoint
+        self.client = client
+        self.content_length = content_length
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(PHASES, 0)
+        self.bytes_received = 0
+        self.handler_started = None
+        self.handler_finished = None
+        self.profile = None
+        if profile:
+            # cProfile只記錄目前的執行緒，也就是處理這個請求的執行緒
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def add(self, phase, seconds):
+        self.phases[phase] += seconds
+        self.counts[phase] += 1
+
+    def finish(self):
+        """請求結束，補上由時間點推算的階段，回傳總秒數"""
+        ended = time.perf_counter()
+        if self.profile is not None:
+            self.profile.disable()
+        handler_started = self.handler_started or self.started
+        handler_finished = self.handler_finished or ended
+        self.phases['admission'] = handler_started - self.started
+        self.phases['respond'] = ended - handler_finished
+        # 處理時間中沒有歸到其他階段的部分
+        measured = sum(self.phases[p] for p in ('receive', 'write', 'fsync', 'index'))
+        self.phases['parse'] = max(0.0, handler_finished - handler_started - measured)
+        self.total = ended - self.started
+        return self.total
+
+    def to_dict(self, status_code):
+        return {
+            'time': datetime.fromtimestamp(self.timestamp).isoformat(timespec='milliseconds'),
+            'method': self.method,
+            'path': self.path,
+            'endpoint': self.endpoint,
+            'client': self.client,
+            'status': status_code,
+            'content_length': self.content_length,
+            'bytes_received': self.bytes_received,
+            'total_seconds': round(self.total, 6),
+            'phases': {p: round(self.phases[p], 6) for p in PHASES},
+            'calls': {p: self.counts[p] for p in PHASES if self.counts[p]},
+        }
+
+
+class TimedStream:
+    """計算讀取請求內容花費的時間（receive 階段）"""
+
+    def __init__(self, stream, trace):
+        self._stream = stream
+        self._trace = trace
+
+    def read(self, size=-1):
+        started = time.perf_counter()
+        data = self._stream.read(size)
+        self._trace.add('receive', time.perf_counter() - started)
+        self._trace.bytes_received += len(data)
+        return data
+
+
+class RequestProfiler:
+    """決定哪些請求要追蹤，並將慢請求的報告寫到剖析資料夾"""
+
+    def __init__(self, directory, enabled=False, threshold=DEFAULT_THRESHOLD, sample_rate=0.0,
+                 max_profiles=DEFAULT_MAX_PROFILES):
+        self.directory = directory
+        self.enabled = enabled
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.max_profiles = max_profiles
+        self._queue = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+        # 正在以cProfile剖析的請求（同一時間只有一個）
+        self._profile_lock = threading.Lock()
+        self.slow_requests = 0
+
+    def configure(self, enabled, threshold=None, sample_rate=None, directory=None):
+        self.enabled = enabled
+        if threshold is not None:
+            self.threshold = threshold
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if directory is not None:
+            self.directory = directory
+
+    def start_trace(self, method, path, endpoint, client, content_length):
+        """開始追蹤一個請求；未啟用時回傳None"""
+        if not self.enabled:
+            return None
+        profile = (self.sample_rate > 0 and random.random() < self.sample_rate
+                   and self._profile_lock.acquire(blocking=False))
+        return RequestTrace(method, path, endpoint, client, content_length, profile)
+
+    def finish_trace(self, trace, status_code):
+        """請求結束；超過門檻時交給背景執行緒寫出報告，不延遲回應"""
+        total = trace.finish()
+        if trace.profile is not None:
+            self._profile_lock.release()
+        if total < self.threshold:
+            return
+        with self._lock:
+            self.slow_requests += 1
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run_writer, name='profile-writer',
+                                                daemon=True)
+                self._writer.start()
+        self._queue.put((trace, status_code))
+
+    def _run_writer(self):
+        while True:
+            trace, status_code = self._queue.get()
+            try:
+                self._write(trace, status_code)
+            except Exception as e:
+                print(f"寫入效能剖析報告失敗: {e}")
+
+    def _write(self, trace, status_code):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.fromtimestamp(trace.timestamp).strftime('%Y%m%d_%H%M%S_%f')
+        name = f"{stamp}_{trace.endpoint or 'unknown'}_{int(trace.total * 1000)}ms"
+        report = trace.to_dict(status_code)
+        if trace.profile is not None:
+            prof_path = os.path.join(self.directory, name + '.prof')
+            trace.profile.dump_stats(prof_path)
+            report['profile'] = os.path.basename(prof_path)
+            report['top_functions'] = top_functions(trace.profile)
+        tmp_path = os.path.join(self.directory, name + '.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, os.path.join(self.directory, name + '.json'))
+        self._rotate()
+
+    def _rotate(self):
+        """只保留最新的 max_profiles 份報告（連同對應的 .prof 檔）"""
+        reports = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        for name in reports[:-self.max_profiles]:
+            base = name[:-len('.json')]
+            for path in (name, base + '.prof'):
+                try:
+                    os.remove(os.path.join(self.directory, path))
+                except FileNotFoundError:
+                    pass
+
+    def status(self):
+        return {
+            'enabled': self.enabled,
+            'threshold_seconds': self.threshold,
+            'sample_rate': self.sample_rate,
+            'directory': self.directory,
+            'slow_requests': self.slow_requests,
+        }
+
+
+def top_functions(profile, limit=TOP_FUNCTIONS):
+    """依累計時間列出最花時間的函式"""
+    stats = pstats.Stats(profile, stream=io.StringIO())
+    rows = []
+    for (filename, line, func), (_cc, calls, total, cumulative, _callers) in stats.stats.items():
+        rows.append({
+            'function': f'{os.path.basename(filename)}:{line}({func})',
+            'calls': calls,
+            'total_seconds': round(total, 6),
+            'cumulative_seconds': round(cumulative, 6),
+        })
+    rows.sort(key=lambda row: row['cumulative_seconds'], reverse=True)
+    return rows[:limit]
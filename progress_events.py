@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上傳進度事件（Server-Sent Events）
+上傳時每次寫入磁碟只累加計數器；背景執行緒每 EVENT_INTERVAL 秒最多發布一次合併後的事件：
+  progress  進行中的上傳（每個檔案已收到的位元組與速度）以及整體吞吐量
+  files     這段時間內完成或失敗的檔案
+  jobs      後處理工作的狀態（同一個工作只保留最新狀態）
+每個事件只編碼一次並放入共用的環狀緩衝區，所有觀看者（瀏覽器的 /events 與電腦端視窗）
+各自記住讀到的序號，觀看者再多也不會增加編碼或掃描資料夾的工作。
+但每條 /events 連線在串流期間佔用伺服器的一個工作執行緒（大多時間在等待新事件），
+因此同時觀看的連線數限制為工作執行緒的一半（見 subscriber_limit），其餘留給上傳與下載；
+電腦端視窗在同一個程序內讀取，不佔用工作執行緒，不計入上限
+"""
+
+import json
+import threading
+import time
+import uuid
+from collections import deque
+
+EVENT_INTERVAL = 0.25               # 兩次發布之間的最短間隔（秒）
+HISTORY_SIZE = 256                  # 保留供重新連線（Last-Event-ID）補送的事件數
+HEARTBEAT_INTERVAL = 5              # 沒有事件時送出註解，保持連線並及早發現已離開的觀看者
+IDLE_TRANSFER_TIMEOUT = 120         # 分段上傳超過這個時間沒有進度就不再列出
+MAX_SUBSCRIBERS = 16                # 同時觀看的連線數（預設32個工作執行緒的一半）
+SUBSCRIBER_THREAD_SHARE = 2         # 觀看的連線最多佔用 1/2 的工作執行緒
+MAX_EVENT_ITEMS = 50                # files/jobs 事件最多列出的項目數
+RATE_SMOOTHING = 0.5                # 速度的指數移動平均權重
+RETRY_MILLISECONDS = 3000           # 瀏覽器斷線後重新連線的等待時間
+
+
+class EventStreamFull(Exception):
+    """觀看者已達上限"""
+
+
+def subscriber_limit(threads):
+    """依伺服器的工作執行緒數決定同時觀看的連線上限"""
+    return max(1, threads // SUBSCRIBER_THREAD_SHARE)
+
+
+class Event:
+    """已發布的事件（data為原始內容，encoded為SSE格式）"""
+
+    __slots__ = ('id', 'type', 'data', 'encoded')
+
+    def __init__(self, event_id, event_type, data):
+        self.id = event_id
+        self.type = event_type
+        self.data = data
+        self.encoded = encode_event(event_type, data, event_id)
+
+
+def encode_event(event_type, data, event_id=None):
+    """編碼為 text/event-stream 格式"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event_type}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+class Transfer:
+    """一個正在接收的檔案"""
+
+    def __init__(self, hub, transfer_id, name, api, client=None, total=None, received=0):
+        self._hub = hub
+        self.id = transfer_id
+        self.name = name
+        self.api = api
+        self.client = client
+        self.total = total
+        self.received = received
+        self.rate = 0.0
+        self.updated = time.monotonic()
+        self._reported = received
+
+    def add(self, nbytes):
+        """收到 nbytes 位元組（每次寫入磁碟時呼叫，只累加計數器）"""
+        hub = self._hub
+        with hub._lock:
+            self.received += nbytes
+            self.updated = time.monotonic()
+            hub._received += nbytes
+            hub._mark_dirty()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'api': self.api,
+            'client': self.client,
+            'received': self.received,
+            'total': self.total,
+            'rate': round(self.rate),
+        }
+
+
+class Subscription:
+    """一個觀看者在共用緩衝區中的讀取位置"""
+
+    def __init__(self, hub, cursor, counted=True):
+        self._hub = hub
+        self.cursor = cursor
+        self.counted = counted
+        self.closed = False
+
+    def poll(self, timeout=0):
+        """取得尚未讀取的事件，沒有新事件時最多等待 timeout 秒"""
+        return self._hub._read(self, timeout)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._hub._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EventHub:
+    """收集上傳進度並以固定的最高頻率發布給所有觀看者"""
+
+    def __init__(self, interval=EVENT_INTERVAL, history_size=HISTORY_SIZE,
+                 max_subscribers=MAX_SUBSCRIBERS):
+        self.interval = interval
+        self.max_subscribers = max_subscribers
+        # _lock 保護上傳狀態；_published 通知觀看者有新事件
+        self._lock = threading.Condition()
+        self._published = threading.Condition()
+        self._transfers = {}
+        self._finished_files = []
+        self._completed_count = 0
+        self._failed_count = 0
+        self._jobs = {}
+        self._received = 0
+        self._reported = 0
+        self._throughput = 0.0
+        self._dirty = False
+        self._last_publish = 0.0
+        self._thread = None
+        self._history = deque(maxlen=history_size)
+        self._sequence = 0
+        self._latest_progress = None
+        self._subscribers = 0
+        self._closed = False
+
+    # ---- 記錄（上傳與後處理執行緒呼叫） ----
+
+    def _mark_dirty(self):
+        """呼叫時須持有 _lock"""
+        if not self._dirty:
+            self._dirty = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='progress-events', daemon=True)
+                self._thread.start()
+            self._lock.notify()
+
+    def begin(self, name, api, client=None, total=None, key=None, received=0):
+        """開始接收一個檔案；指定 key 時（例如分段上傳的工作階段）同一個 key 共用同一筆進度"""
+        with self._lock:
+            transfer = self._transfers.get(key) if key is not None else None
+            if transfer is None:
+                transfer_id = key if key is not None else uuid.uuid4().hex[:12]
+                transfer = Transfer(self, transfer_id, name, api, client, total, received)
+                self._transfers[transfer_id] = transfer
+            transfer.updated = time.monotonic()
+            self._mark_dirty()
+            return transfer
+
+    def finish(self, transfer, filename=None, size=None, error=None):
+        """檔案接收完成（filename為儲存的檔名）或失敗（error）"""
+        with self._lock:
+            self._transfers.pop(transfer.id, None)
+            self._add_file({
+                'id': transfer.id,
+                'name': filename or transfer.name,
+                'original': transfer.name,
+                'api': transfer.api,
+                'client': transfer.client,
+                'size': transfer.received if size is None else size,
+                'error': error,
+            })
+
+    def file_completed(self, filename, original=None, size=None, api=None, client=None):
+        """不經過傳輸就完成的檔案（例如秒傳）"""
+        with self._lock:
+            self._add_file({'id': None, 'name': filename, 'original': original, 'api': api,
+                            'client': client, 'size': size, 'error': None})
+
+    def _add_file(self, info):
+        """呼叫時須持有 _lock"""
+        if info['error']:
+            self._failed_count += 1
+        else:
+            self._completed_count += 1
+        self._finished_files.append(info)
+        del self._finished_files[:-MAX_EVENT_ITEMS]
+        self._mark_dirty()
+
+    def job_changed(self, job_id, path, state, step=None, error=None):
+        """後處理工作狀態改變（同一次發布內只保留最新的狀態）"""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._jobs[job_id] = {'id': job_id, 'path': path, 'state': state, 'step': step,
+                                  'error': error}
+            while len(self._jobs) > MAX_EVENT_ITEMS:
+                del self._jobs[next(iter(self._jobs))]
+            self._mark_dirty()
+
+    # ---- 發布 ----
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._dirty and not self._closed:
+                    self._lock.wait()
+                if self._closed:
+                    return
+            # 限制發布頻率：期間內的所有變動合併成一次
+            delay = self._last_publish + self.interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._publish()
+
+    def _publish(self):
+        now = time.monotonic()
+        with self._lock:
+            self._dirty = False
+            elapsed = now - self._last_publish
+            # 閒置一段時間後的第一次發布不計算速度（分母會是整段閒置時間）
+            if elapsed > 4 * self.interval:
+                elapsed = None
+            self._last_publish = now
+            for key, transfer in list(self._transfers.items()):
+                if now - transfer.updated > IDLE_TRANSFER_TIMEOUT:
+                    del self._transfers[key]
+                    continue
+                if elapsed is not None:
+                    rate = (transfer.received - transfer._reported) / elapsed
+                    transfer.rate += RATE_SMOOTHING * (rate - transfer.rate)
+                transfer._reported = transfer.received
+            if elapsed is not None:
+                rate = (self._received - self._reported) / elapsed
+                self._throughput += RATE_SMOOTHING * (rate - self._throughput)
+            self._reported = self._received
+            if not self._transfers:
+                self._throughput = 0.0
+            else:
+                # 上傳進行中時持續發布，速度停滯時才會顯示下降
+                self._dirty = True
+            progress = {
+                'active': len(self._transfers),
+                'throughput': round(self._throughput),
+                'received_total': self._received,
+                'transfers': [t.to_dict() for t in self._transfers.values()],
+            }
+            files, self._finished_files = self._finished_files, []
+            counts = {'completed': self._completed_count, 'failed': self._failed_count}
+            jobs, self._jobs = list(self._jobs.values()), {}
+
+        events = [('progress', progress)]
+        if files:
+            # completed/failed 為伺服器啟動後的累計數量，files 只列出這段時間內的檔案
+            events.append(('files', {'files': files, **counts}))
+        if jobs:
+            events.append(('jobs', {'jobs': jobs}))
+        with self._published:
+            for event_type, data in events:
+                self._sequence += 1
+                event = Event(self._sequence, event_type, data)
+                self._history.append(event)
+                if event_type == 'progress':
+                    self._latest_progress = event
+            self._published.notify_all()
+
+    # ---- 觀看 ----
+
+    def subscribe(self, last_event_id=None, local=False):
+        """
+        新增觀看者；last_event_id 為重新連線前收到的最後一個事件，會補送之後的事件
+        local=True 表示同一個程序內的觀看者（電腦端視窗），不佔用工作執行緒，不計入上限
+        """
+        with self._published:
+            if not local:
+                if self._subscribers >= self.max_subscribers:
+                    raise EventStreamFull('觀看進度的連線數已達上限')
+                self._subscribers += 1
+            if last_event_id is not None and self._history and last_event_id >= self._history[0].id - 1:
+                return Subscription(self, min(last_event_id, self._sequence), not local)
+            # 新的觀看者先收到目前的進度
+            latest = self._latest_progress
+            cursor = latest.id - 1 if latest is not None else self._sequence
+            return Subscription(self, cursor, not local)
+
+    def _unsubscribe(self, subscription):
+        if not subscription.counted:
+            return
+        with self._published:
+            self._subscribers -= 1
+
+    def _read(self, subscription, timeout):
+        with self._published:
+            if self._sequence <= subscription.cursor and timeout and not self._closed:
+                self._published.wait(timeout)
+            if self._closed:
+                subscription.closed = True
+            events = [event for event in self._history if event.id > subscription.cursor]
+            if events:
+                subscription.cursor = events[-1].id
+            return events
+
+    def stream(self, subscription, heartbeat=HEARTBEAT_INTERVAL):
+        """產生SSE回應內容，連線中斷（產生器被關閉）時釋放觀看者"""
+        try:
+            yield f'retry: {RETRY_MILLISECONDS}\n\n'.encode('ascii')
+            while not subscription.closed:
+                events = subscription.poll(heartbeat)
+                if not events:
+                    yield b': keep-alive\n\n'
+                for event in events:
+                    yield event.encoded
+        finally:
+            subscription.close()
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    def close(self):
+        """伺服器停止：結束所有觀看者的串流與發布執行緒"""
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        with self._published:
+            self._closed = True
+            self._published.notify_all()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QR Code產生與快取
+qrcode與PIL只在第一次產生時才載入，無介面模式完全不會用到；
+每個網址的QR Code只產生一次，視窗開啟時在背景先把所有候選IP的QR Code準備好
+"""
+
+import threading
+
+QR_DISPLAY_SIZE = 300       # 視窗中顯示的像素大小
+
+
+def generate_qr_code(url):
+    """生成QR code"""
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+
+    qr_image = qr.make_image(fill_color="black", back_color="white")
+    return qr_image
+
+
+def render_qr_image(url, size=QR_DISPLAY_SIZE):
+    """產生指定大小的QR Code圖片（QR Code由方塊組成，以最近鄰縮放即可保持清晰）"""
+    from PIL import Image
+
+    image = generate_qr_code(url).get_image().convert('L')
+    return image.resize((size, size), Image.NEAREST)
+
+
+class QRCodeCache:
+    """網址 → QR Code圖片的快取"""
+
+    def __init__(self, size=QR_DISPLAY_SIZE):
+        self.size = size
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """取得QR Code，尚未產生時立即產生"""
+        with self._lock:
+            image = self._images.get(url)
+        if image is None:
+            image = render_qr_image(url, self.size)
+            with self._lock:
+                image = self._images.setdefault(url, image)
+        return image
+
+    def prefetch(self, urls):
+        """在背景產生尚未快取的QR Code"""
+        with self._lock:
+            missing = [url for url in urls if url not in self._images]
+        if not missing:
+            return
+
+        def render_all():
+            for url in missing:
+                try:
+                    self.get(url)
+                except Exception as e:
+                    print(f"產生QR Code失敗 {url}: {e}")
+
+        threading.Thread(target=render_all, name='qr-prefetch', daemon=True).start()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+區域網路測速
+下載重複送出同一塊預先產生的隨機資料，上傳讀取後直接丟棄（伺服器支援時讀入每個執行緒重複使用的緩衝區）；
+不讀寫磁碟，量到的是WiFi與網路介面本身的速度
+"""
+
+import os
+import threading
+
+BLOCK_SIZE = 1024 * 1024
+DEFAULT_DOWNLOAD_MB = 32
+MAX_DOWNLOAD_MB = 1024
+MAX_UPLOAD_SIZE = 1024 * 1024 * 1024
+
+# 隨機資料避免中間設備壓縮而高估速度；第一次測速時才產生
+_payload = None
+_payload_lock = threading.Lock()
+_buffers = threading.local()
+
+
+def payload_block():
+    """所有下載共用的1MB資料"""
+    global _payload
+    if _payload is None:
+        with _payload_lock:
+            if _payload is None:
+                _payload = os.urandom(BLOCK_SIZE)
+    return _payload
+
+
+def iter_download(blocks):
+    """產生 blocks 個資料區塊（每次都是同一個bytes物件）"""
+    block = payload_block()
+    for _ in range(blocks):
+        yield block
+
+
+def _receive_buffer():
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None:
+        buffer = _buffers.buffer = bytearray(BLOCK_SIZE)
+    return buffer
+
+
+def discard_request_body(environ, length):
+    """讀取並丟棄請求內容，回傳實際收到的位元組數"""
+    source = environ['wsgi.input']
+    # 只使用WSGI公開的介面：伺服器的 wsgi.input 提供 readinto 時讀入重複使用的緩衝區，
+    # 否則（例如cheroot）以 read() 讀取，由伺服器自行計算剩餘長度
+    readinto = getattr(source, 'readinto', None)
+    buffer = _receive_buffer() if readinto is not None else None
+    received = 0
+    while received < length:
+        remaining = length - received
+        if buffer is not None and remaining >= BLOCK_SIZE:
+            count = readinto(buffer)
+        else:
+            # 保留上一塊直到讀到下一塊：每次讀完立即釋放1MB的bytes時，配置器會把記憶體還給作業系統，
+            # 下一次讀取又要重新配置並觸發缺頁，本機測試的吞吐量只有約三分之一
+            chunk = source.read(min(BLOCK_SIZE, remaining))
+            count = len(chunk)
+        if not count:
+            break
+        received += count
+    return received
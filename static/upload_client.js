@@ -0,0 +1,548 @@
+// 手機端上傳用戶端
+// 小檔案直接以 multipart POST /upload 上傳，數量很多時打包成tar一次上傳；
+// 大型檔案使用分段上傳，並依伺服器建議的連線數平行傳送各區段，中斷後可續傳
+// speedTest() 量測手機與電腦之間的下載/上傳速度，結果同時記錄在伺服器上對應的網路介面
+// watchProgress() 訂閱伺服器的進度事件（/events），取得實際寫入的位元組數與後處理狀態
+(function (global) {
+    'use strict';
+
+    var MAX_RETRIES = 5;
+    var INSTANT_HASH_LIMIT = 64 * 1024 * 1024;   // 只對64MB以下的檔案計算雜湊
+    var ARCHIVE_MIN_FILES = 20;                   // 小檔案達到這個數量時打包成tar上傳
+    // 值得壓縮的檔案（文字、原始影像與音訊）；JPEG、MP4等已壓縮的格式直接傳送
+    var COMPRESSIBLE_TYPES = /^(text\/|application\/(json|xml|javascript|sql|x-yaml|x-ndjson)|image\/(bmp|tiff|svg\+xml|x-adobe-dng)|audio\/(wav|x-wav))/;
+    var COMPRESSIBLE_EXTENSIONS = /\.(txt|log|csv|tsv|json|xml|html?|md|svg|ya?ml|ini|sql|bmp|tiff?|wav|dng|cr2|nef|arw|raw|psd)$/i;
+    var SPEEDTEST_MB = 16;                        // 每個方向傳送的資料量
+    var configPromise = null;
+
+    // 取得伺服器建議的上傳參數
+    function getUploadConfig() {
+        if (!configPromise) {
+            configPromise = fetch('/upload/config').then(function (res) {
+                return res.json();
+            }).catch(function () {
+                configPromise = null;
+                return { chunk_size: 8 * 1024 * 1024, parallel_threshold: Infinity, recommended_connections: 1 };
+            });
+        }
+        return configPromise;
+    }
+
+    // 以XMLHttpRequest送出請求，才能取得上傳進度
+    function sendRequest(method, url, body, headers, onProgress) {
+        return new Promise(function (resolve, reject) {
+            var xhr = new XMLHttpRequest();
+            xhr.open(method, url);
+            Object.keys(headers || {}).forEach(function (name) {
+                xhr.setRequestHeader(name, headers[name]);
+            });
+            if (onProgress) {
+                xhr.upload.onprogress = function (e) { onProgress(e.loaded); };
+            }
+            xhr.onload = function () {
+                var data = {};
+                try { data = JSON.parse(xhr.responseText); } catch (e) { /* 非JSON回應 */ }
+                if (xhr.status >= 200 && xhr.status < 300) {
+                    resolve(data);
+                } else {
+                    var err = new Error(data.message || ('HTTP ' + xhr.status));
+                    err.status = xhr.status;
+                    err.data = data;
+                    err.retryAfter = parseInt(xhr.getResponseHeader('Retry-After'), 10) || 0;
+                    reject(err);
+                }
+            };
+            xhr.onerror = function () { reject(new Error('網路連線中斷')); };
+            xhr.send(body);
+        });
+    }
+
+    function sleep(ms) {
+        return new Promise(function (resolve) { setTimeout(resolve, ms); });
+    }
+
+    // 重試前等待：伺服器有提供 Retry-After 時依其建議
+    function retryDelay(err, attempt) {
+        return Math.max(1000 * attempt, 1000 * (err.retryAfter || 0));
+    }
+
+    // 伺服器忙碌回應429時稍後重送
+    function retryWhenBusy(send, attempt) {
+        attempt = attempt || 1;
+        return send().catch(function (err) {
+            if (err.status !== 429 || attempt >= MAX_RETRIES) { throw err; }
+            return sleep(retryDelay(err, attempt)).then(function () {
+                return retryWhenBusy(send, attempt + 1);
+            });
+        });
+    }
+
+    // 瀏覽器支援gzip壓縮、伺服器可解壓，且檔案類型值得壓縮
+    function shouldCompress(file, config) {
+        return typeof CompressionStream !== 'undefined' &&
+            (config.content_encodings || []).indexOf('gzip') >= 0 &&
+            (COMPRESSIBLE_TYPES.test(file.type) || COMPRESSIBLE_EXTENSIONS.test(file.name));
+    }
+
+    function gzipBlob(blob) {
+        return new Response(blob.stream().pipeThrough(new CompressionStream('gzip'))).blob();
+    }
+
+    // 一次上傳多個小檔案
+    function uploadSimple(files, onProgress) {
+        return retryWhenBusy(function () {
+            var form = new FormData();
+            files.forEach(function (file) { form.append('files', file); });
+            return sendRequest('POST', '/upload', form, {}, onProgress);
+        });
+    }
+
+    var encoder = new TextEncoder();
+
+    function octal(value, length) {
+        var text = value.toString(8);
+        while (text.length < length - 1) { text = '0' + text; }
+        return text + '\0';
+    }
+
+    // 產生一個512位元組的tar檔頭
+    function tarHeader(name, size, mtime, type) {
+        var header = new Uint8Array(512);
+        function put(text, offset) { header.set(encoder.encode(text), offset); }
+        put(name, 0);
+        put(octal(420, 8), 100);            // 權限 0644
+        put(octal(0, 8), 108);
+        put(octal(0, 8), 116);
+        put(octal(size, 12), 124);
+        put(octal(mtime, 12), 136);
+        put('        ', 148);               // 計算檢查碼時以空白代替
+        put(type, 156);
+        put('ustar\u000000', 257);
+        var sum = 0;
+        for (var i = 0; i < 512; i++) { sum += header[i]; }
+        put(octal(sum, 7) + ' ', 148);
+        return header;
+    }
+
+    // PAX延伸紀錄（長度欄位包含自己的位數）
+    function paxRecord(key, value) {
+        var body = ' ' + key + '=' + value + '\n';
+        var bodyLength = encoder.encode(body).length;
+        var length = bodyLength + String(bodyLength).length;
+        if (String(length).length > String(bodyLength).length) { length += 1; }
+        return encoder.encode(length + body);
+    }
+
+    function tarPadding(size) {
+        return new Uint8Array((512 - size % 512) % 512);
+    }
+
+    // 將多個檔案組成tar（Blob只參照原始檔案，不會複製到記憶體）
+    function buildTar(files) {
+        var parts = [];
+        files.forEach(function (file, index) {
+            var mtime = Math.floor((file.lastModified || Date.now()) / 1000);
+            var name = file.name;
+            if (!/^[\x20-\x7e]{1,99}$/.test(name)) {
+                // 非ASCII或過長的檔名以PAX記錄保存
+                var pax = paxRecord('path', name);
+                parts.push(tarHeader('PaxHeader/' + index, pax.length, mtime, 'x'), pax,
+                           tarPadding(pax.length));
+                name = 'file' + index;
+            }
+            parts.push(tarHeader(name, file.size, mtime, '0'), file, tarPadding(file.size));
+        });
+        parts.push(new Uint8Array(1024));
+        return new Blob(parts, { type: 'application/x-tar' });
+    }
+
+    // 大量小檔案：打包成tar，伺服器邊接收邊解開（compress 時以gzip壓縮後傳送）
+    function uploadArchive(files, onProgress, compress) {
+        var payloadBytes = files.reduce(function (sum, f) { return sum + f.size; }, 0);
+        var archive = buildTar(files);
+        var headers = { 'Content-Type': 'application/x-tar' };
+        if (compress) { headers['Content-Encoding'] = 'gzip'; }
+        return (compress ? gzipBlob(archive) : Promise.resolve(archive)).then(function (body) {
+            return retryWhenBusy(function () {
+                return sendRequest('POST', '/upload/archive', body, headers,
+                    onProgress && function (loaded) {
+                        onProgress(Math.round(loaded * payloadBytes / body.size));
+                    });
+            });
+        });
+    }
+
+    var SHA256_K = new Uint32Array([
+        0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+        0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+        0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+        0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+        0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+        0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+        0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+        0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+    ]);
+    var SHA256_SLICE_SIZE = 4 * 1024 * 1024;     // 純JS計算雜湊時每次讀取的大小
+    var FALLBACK_HASH_LIMIT = 16 * 1024 * 1024;  // 純JS較慢，只對16MB以下的檔案計算，較大的檔案直接上傳比較快
+
+    // 純JS的SHA-256：手機以 http://電腦IP 連線時瀏覽器不提供 crypto.subtle，改用這個計算
+    function Sha256() {
+        this.state = new Uint32Array([0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a,
+                                      0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19]);
+        this.words = new Uint32Array(64);
+        this.pending = new Uint8Array(64);
+        this.pendingLength = 0;
+        this.length = 0;
+    }
+
+    Sha256.prototype.update = function (data) {
+        var offset = 0;
+        this.length += data.length;
+        if (this.pendingLength) {
+            offset = Math.min(64 - this.pendingLength, data.length);
+            this.pending.set(data.subarray(0, offset), this.pendingLength);
+            this.pendingLength += offset;
+            if (this.pendingLength < 64) { return; }
+            this.block(this.pending, 0);
+            this.pendingLength = 0;
+        }
+        for (; offset + 64 <= data.length; offset += 64) {
+            this.block(data, offset);
+        }
+        this.pending.set(data.subarray(offset));
+        this.pendingLength = data.length - offset;
+    };
+
+    // 處理一個64位元組的區塊（Uint32Array的寫入自動取 mod 2^32）
+    Sha256.prototype.block = function (data, offset) {
+        var w = this.words, h = this.state, i, x, y, t1, t2;
+        for (i = 0; i < 16; i++, offset += 4) {
+            w[i] = (data[offset] << 24) | (data[offset + 1] << 16) | (data[offset + 2] << 8) | data[offset + 3];
+        }
+        for (i = 16; i < 64; i++) {
+            x = w[i - 15];
+            y = w[i - 2];
+            w[i] = w[i - 16] + w[i - 7] +
+                (((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3)) +
+                (((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10));
+        }
+        var a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], k = h[7];
+        for (i = 0; i < 64; i++) {
+            t1 = (k + (((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7))) +
+                ((e & f) ^ (~e & g)) + SHA256_K[i] + w[i]) | 0;
+            t2 = ((((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10))) +
+                ((a & b) ^ (a & c) ^ (b & c))) | 0;
+            k = g; g = f; f = e; e = (d + t1) | 0;
+            d = c; c = b; b = a; a = (t1 + t2) | 0;
+        }
+        h[0] += a; h[1] += b; h[2] += c; h[3] += d;
+        h[4] += e; h[5] += f; h[6] += g; h[7] += k;
+    };
+
+    Sha256.prototype.hex = function () {
+        var bits = this.length * 8;
+        var padding = new Uint8Array((this.pendingLength < 56 ? 64 : 128) - this.pendingLength);
+        var end = padding.length;
+        padding[0] = 0x80;
+        for (var i = 1; i <= 8; i++) {
+            padding[end - i] = bits % 256;
+            bits = Math.floor(bits / 256);
+        }
+        this.update(padding);
+        return Array.prototype.map.call(this.state, function (word) {
+            return ('0000000' + word.toString(16)).slice(-8);
+        }).join('');
+    };
+
+    // 分段讀取檔案計算雜湊，每段之間讓出主執行緒，頁面不會卡住
+    function sha256Fallback(file) {
+        var hash = new Sha256();
+        function next(position) {
+            if (position >= file.size) { return Promise.resolve(hash.hex()); }
+            var end = Math.min(position + SHA256_SLICE_SIZE, file.size);
+            return file.slice(position, end).arrayBuffer().then(function (buffer) {
+                hash.update(new Uint8Array(buffer));
+                return next(end);
+            });
+        }
+        return next(0);
+    }
+
+    // 計算SHA-256（瀏覽器只在HTTPS或localhost提供crypto.subtle，其他情況改用純JS計算），失敗時回傳null
+    function sha256Hex(file) {
+        if (file.size > INSTANT_HASH_LIMIT) {
+            return Promise.resolve(null);
+        }
+        var subtle = global.crypto && global.crypto.subtle;
+        if (!subtle) {
+            if (file.size > FALLBACK_HASH_LIMIT) { return Promise.resolve(null); }
+            return sha256Fallback(file).catch(function () { return null; });
+        }
+        return file.arrayBuffer().then(function (buffer) {
+            return subtle.digest('SHA-256', buffer);
+        }).then(function (digest) {
+            return Array.prototype.map.call(new Uint8Array(digest), function (b) {
+                return ('0' + b.toString(16)).slice(-2);
+            }).join('');
+        }).catch(function () { return null; });
+    }
+
+    // 秒傳：伺服器已有相同內容時直接建立檔案，回傳null表示仍需上傳
+    function tryInstantUpload(file) {
+        return sha256Hex(file).then(function (hash) {
+            if (!hash) { return null; }
+            return sendRequest('POST', '/upload/instant',
+                JSON.stringify({ filename: file.name, sha256: hash }),
+                { 'Content-Type': 'application/json' }
+            ).catch(function () { return null; });
+        });
+    }
+
+    // 列出尚未收到的區段，每段不超過 chunkSize
+    function missingChunks(size, received, chunkSize) {
+        var chunks = [];
+        var position = 0;
+        received.concat([[size, size]]).forEach(function (range) {
+            for (var start = position; start < range[0]; start += chunkSize) {
+                chunks.push([start, Math.min(start + chunkSize, range[0])]);
+            }
+            position = Math.max(position, range[1]);
+        });
+        return chunks;
+    }
+
+    // 大型檔案：建立分段上傳後以多條連線平行傳送
+    function uploadParallel(file, config, onProgress) {
+        var uploadKey = [file.name, file.size, file.lastModified].join(':');
+        return sendRequest('POST', '/upload/sessions',
+            JSON.stringify({ filename: file.name, size: file.size, upload_key: uploadKey }),
+            { 'Content-Type': 'application/json' }
+        ).then(function (session) {
+            var chunkSize = session.chunk_size || config.chunk_size;
+            var queue = missingChunks(file.size, session.received, chunkSize);
+            var confirmed = session.received_bytes;
+            var inFlight = {};
+
+            function report() {
+                if (!onProgress) { return; }
+                var total = confirmed;
+                Object.keys(inFlight).forEach(function (key) { total += inFlight[key]; });
+                onProgress(Math.min(total, file.size));
+            }
+
+            var compress = shouldCompress(file, config);
+
+            function uploadChunk(chunk, attempt) {
+                var key = chunk[0];
+                var url = '/upload/sessions/' + session.session_id + '?offset=' + chunk[0];
+                var headers = { 'Content-Type': 'application/octet-stream' };
+                var body = file.slice(chunk[0], chunk[1]);
+                if (compress) { headers['Content-Encoding'] = 'gzip'; }
+                return (compress ? gzipBlob(body) : Promise.resolve(body)).then(function (data) {
+                    // 進度以原始大小計算
+                    var scale = (chunk[1] - chunk[0]) / (data.size || 1);
+                    return sendRequest('PUT', url, data, headers, function (loaded) {
+                        inFlight[key] = Math.round(loaded * scale);
+                        report();
+                    });
+                }).then(function () {
+                    delete inFlight[key];
+                    confirmed += chunk[1] - chunk[0];
+                    report();
+                }, function (err) {
+                    delete inFlight[key];
+                    if (attempt >= MAX_RETRIES || (err.status && err.status < 500 && err.status !== 429)) {
+                        throw err;
+                    }
+                    // 同一位移重送會覆寫相同內容，直接重試這一段即可
+                    return sleep(retryDelay(err, attempt)).then(function () {
+                        return uploadChunk(chunk, attempt + 1);
+                    });
+                });
+            }
+
+            function worker() {
+                var chunk = queue.shift();
+                if (!chunk) { return Promise.resolve(); }
+                return uploadChunk(chunk, 1).then(worker);
+            }
+
+            var workers = [];
+            var connections = Math.max(1, session.recommended_connections || 1);
+            for (var i = 0; i < connections; i++) { workers.push(worker()); }
+
+            return Promise.all(workers).then(function () {
+                return sendRequest('POST', '/upload/sessions/' + session.session_id + '/complete');
+            });
+        });
+    }
+
+    // 上傳一批檔案，大檔案自動使用平行分段上傳
+    function uploadFiles(fileList, onProgress) {
+        var files = Array.prototype.slice.call(fileList);
+        var instantFiles = [];
+        var remaining = [];
+        // 逐一計算雜湊，避免同時把所有檔案讀進記憶體
+        var check = files.reduce(function (p, file) {
+            return p.then(function () { return tryInstantUpload(file); }).then(function (data) {
+                if (data) {
+                    instantFiles = instantFiles.concat(data.files || []);
+                } else {
+                    remaining.push(file);
+                }
+            });
+        }, Promise.resolve());
+        return Promise.all([getUploadConfig(), check]).then(function (values) {
+            var config = values[0];
+            files = remaining;
+            var large = files.filter(function (f) { return f.size >= config.parallel_threshold; });
+            var small = files.filter(function (f) {
+                return f.size < config.parallel_threshold && !shouldCompress(f, config);
+            });
+            var compressible = files.filter(function (f) {
+                return f.size < config.parallel_threshold && shouldCompress(f, config);
+            });
+            var totalBytes = files.reduce(function (sum, f) { return sum + f.size; }, 0);
+            var doneBytes = 0;
+            var results = { success: true, files: instantFiles, errors: [] };
+
+            function collect(data) {
+                results.files = results.files.concat(data.files || []);
+                results.errors = results.errors.concat(data.errors || []);
+            }
+            function progress(loaded) {
+                if (onProgress) { onProgress(doneBytes + loaded, totalBytes); }
+            }
+
+            var chain = Promise.resolve();
+            if (small.length) {
+                var smallBytes = small.reduce(function (sum, f) { return sum + f.size; }, 0);
+                chain = chain.then(function () {
+                    return small.length >= ARCHIVE_MIN_FILES
+                        ? uploadArchive(small, progress)
+                        : uploadSimple(small, progress);
+                }).then(function (data) {
+                    collect(data);
+                    doneBytes += smallBytes;
+                });
+            }
+            if (compressible.length) {
+                var compressibleBytes = compressible.reduce(function (sum, f) { return sum + f.size; }, 0);
+                chain = chain.then(function () {
+                    return uploadArchive(compressible, progress, true);
+                }).then(function (data) {
+                    collect(data);
+                    doneBytes += compressibleBytes;
+                });
+            }
+            large.forEach(function (file) {
+                chain = chain.then(function () {
+                    return uploadParallel(file, config, progress);
+                }).then(function (data) {
+                    collect(data);
+                }, function (err) {
+                    results.errors.push(file.name + ': ' + err.message);
+                }).then(function () {
+                    doneBytes += file.size;
+                });
+            });
+
+            return chain.then(function () {
+                results.success = results.files.length > 0;
+                results.message = results.success
+                    ? '成功上傳 ' + results.files.length + ' 個檔案'
+                    : '沒有檔案上傳成功';
+                if (results.success && results.errors.length) {
+                    results.message += '，但有 ' + results.errors.length + ' 個檔案上傳失敗';
+                }
+                return results;
+            });
+        });
+    }
+
+    function toMbps(bytes, ms) {
+        return Math.round(bytes * 8 / 1000 / ms * 10) / 10;
+    }
+
+    // 測速：下載與上傳各 sizeMB，回傳 { download_mbps, upload_mbps, server_ip }
+    function speedTest(sizeMB, onStatus) {
+        sizeMB = sizeMB || SPEEDTEST_MB;
+        var result = {};
+        var started = Date.now();
+        if (onStatus) { onStatus('下載測速中…'); }
+        return fetch('/speedtest/download?size=' + sizeMB, { cache: 'no-store' }).then(function (res) {
+            if (!res.ok) { throw new Error('HTTP ' + res.status); }
+            var reader = res.body.getReader();
+            var received = 0;
+            function pump() {
+                return reader.read().then(function (chunk) {
+                    if (chunk.done) { return received; }
+                    received += chunk.value.length;
+                    return pump();
+                });
+            }
+            return pump();
+        }).then(function (received) {
+            result.download_mbps = toMbps(received, Date.now() - started);
+            if (onStatus) { onStatus('上傳測速中…'); }
+            var block = new Uint8Array(1024 * 1024);
+            var parts = [];
+            for (var i = 0; i < sizeMB; i++) { parts.push(block); }
+            var body = new Blob(parts);
+            started = Date.now();
+            return sendRequest('POST', '/speedtest/upload', body,
+                { 'Content-Type': 'application/octet-stream' }).then(function (data) {
+                result.upload_mbps = toMbps(body.size, Date.now() - started);
+                result.server_ip = data.server_ip;
+                return result;
+            });
+        });
+    }
+
+    // 在 container 中加入測速按鈕與結果
+    function mountSpeedTestButton(container) {
+        var button = document.createElement('button');
+        var output = document.createElement('div');
+        button.type = 'button';
+        button.className = 'speedtest-button';
+        button.textContent = '🚀 網路測速';
+        output.className = 'speedtest-result';
+        button.addEventListener('click', function () {
+            button.disabled = true;
+            speedTest(SPEEDTEST_MB, function (text) { output.textContent = text; }).then(function (r) {
+                output.textContent = '下載 ' + r.download_mbps + ' Mbps，上傳 ' + r.upload_mbps + ' Mbps';
+            }, function (err) {
+                output.textContent = '測速失敗: ' + err.message;
+            }).then(function () {
+                button.disabled = false;
+            });
+        });
+        container.appendChild(button);
+        container.appendChild(output);
+        return button;
+    }
+
+    // 訂閱伺服器推送的進度事件；handlers 可包含 progress、files、jobs，回傳關閉用的函式
+    // 瀏覽器斷線後會自動重新連線，並從最後收到的事件繼續
+    function watchProgress(handlers) {
+        if (!global.EventSource) { return function () {}; }
+        var source = new EventSource('/events');
+        ['progress', 'files', 'jobs'].forEach(function (type) {
+            if (!handlers[type]) { return; }
+            source.addEventListener(type, function (e) {
+                handlers[type](JSON.parse(e.data));
+            });
+        });
+        return function () { source.close(); };
+    }
+
+    global.TransferClient = {
+        getUploadConfig: getUploadConfig,
+        uploadFiles: uploadFiles,
+        uploadArchive: uploadArchive,
+        uploadParallel: uploadParallel,
+        speedTest: speedTest,
+        mountSpeedTestButton: mountSpeedTestButton,
+        watchProgress: watchProgress
+    };
+})(window);
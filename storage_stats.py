@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上傳資料夾統計
+在記憶體中維護檔案數與總大小，上傳時即時更新；
+背景執行緒依資料夾修改時間只重新掃描有變動的資料夾，並將結果存成快照供下次啟動使用
+"""
+
+import os
+import json
+import threading
+
+RECONCILE_INTERVAL = 60  # 秒
+
+
+class StorageStats:
+    """上傳資料夾的檔案數與總大小（/status 以常數時間讀取）"""
+
+    def __init__(self, root_folder, snapshot_path, exclude=()):
+        self.root_folder = root_folder
+        self.snapshot_path = snapshot_path
+        self.exclude = set(exclude)
+        self._lock = threading.Lock()
+        # 相對路徑 → {'mtime_ns', 'files', 'bytes', 'subdirs'}
+        self._dirs = {}
+        self._total_files = 0
+        self._total_bytes = 0
+        self._stop = threading.Event()
+        self._load_snapshot()
+
+    def _load_snapshot(self):
+        """載入上次的快照，啟動後立即有數字可用"""
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                self._dirs = json.load(f).get('dirs', {})
+            self._recompute_totals()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"載入資料夾統計快照失敗: {e}")
+            self._dirs = {}
+
+    def _save_snapshot(self):
+        """儲存快照（先寫暫存檔再取代）"""
+        try:
+            with self._lock:
+                data = json.dumps({'dirs': self._dirs}, ensure_ascii=False)
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            print(f"儲存資料夾統計快照失敗: {e}")
+
+    def _recompute_totals(self):
+        self._total_files = sum(d['files'] for d in self._dirs.values())
+        self._total_bytes = sum(d['bytes'] for d in self._dirs.values())
+
+    def _dir_key(self, dirpath):
+        rel = os.path.relpath(dirpath, self.root_folder)
+        return '' if rel == '.' else rel.replace(os.sep, '/')
+
+    def add_file(self, filepath, size):
+        """上傳完成時呼叫，立即更新統計"""
+        key = self._dir_key(os.path.dirname(os.path.abspath(filepath)))
+        with self._lock:
+            entry = self._dirs.setdefault(key, {'mtime_ns': 0, 'files': 0, 'bytes': 0, 'subdirs': []})
+            entry['files'] += 1
+            entry['bytes'] += size
+            # 下次同步時重新掃描這個資料夾，修正與背景掃描同時發生時的重複計算
+            entry['mtime_ns'] = 0
+            self._total_files += 1
+            self._total_bytes += size
+
+    def remove_file(self, filepath, size):
+        """檔案移出資料夾時呼叫（例如搬到封存層），立即更新統計"""
+        key = self._dir_key(os.path.dirname(os.path.abspath(filepath)))
+        with self._lock:
+            entry = self._dirs.get(key)
+            if entry is not None:
+                entry['files'] = max(0, entry['files'] - 1)
+                entry['bytes'] = max(0, entry['bytes'] - size)
+                entry['mtime_ns'] = 0
+            self._total_files = max(0, self._total_files - 1)
+            self._total_bytes = max(0, self._total_bytes - size)
+
+    def snapshot(self):
+        """回傳 (檔案數, 總位元組數)"""
+        with self._lock:
+            return self._total_files, self._total_bytes
+
+    def _scan_dir(self, key, dirpath):
+        """掃描單一資料夾（不遞迴）"""
+        files = 0
+        total = 0
+        subdirs = []
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not (key == '' and entry.name in self.exclude):
+                            subdirs.append(entry.name)
+                    elif entry.is_file():
+                        files += 1
+                        total += entry.stat().st_size
+                except OSError:
+                    pass
+        return files, total, subdirs
+
+    def _reconcile_dir(self, key, seen):
+        dirpath = os.path.join(self.root_folder, *key.split('/')) if key else self.root_folder
+        try:
+            mtime_ns = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            return
+        seen.add(key)
+
+        with self._lock:
+            cached = self._dirs.get(key)
+        if cached and cached['mtime_ns'] == mtime_ns:
+            subdirs = cached['subdirs']
+        else:
+            files, total, subdirs = self._scan_dir(key, dirpath)
+            with self._lock:
+                self._dirs[key] = {'mtime_ns': mtime_ns, 'files': files,
+                                   'bytes': total, 'subdirs': subdirs}
+
+        for name in subdirs:
+            self._reconcile_dir(f'{key}/{name}' if key else name, seen)
+
+    def reconcile(self):
+        """與磁碟同步：只重新掃描修改時間改變的資料夾"""
+        if not os.path.isdir(self.root_folder):
+            # 資料夾暫時無法存取（例如NAS未掛載）時保留上次的統計
+            return
+        seen = set()
+        self._reconcile_dir('', seen)
+        with self._lock:
+            for key in list(self._dirs):
+                if key not in seen:
+                    del self._dirs[key]
+            self._recompute_totals()
+        self._save_snapshot()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.reconcile()
+            except Exception as e:
+                print(f"同步資料夾統計失敗: {e}")
+            self._stop.wait(RECONCILE_INTERVAL)
+
+    def start(self):
+        """啟動背景同步執行緒"""
+        thread = threading.Thread(target=self._run, name='storage-stats', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """停止背景同步"""
+        self._stop.set()
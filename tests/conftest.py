@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""測試共用設定：模組都在專案根目錄，伺服器以 Flask 測試用戶端在暫存資料夾中執行"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    """app_improved 在匯入時於目前目錄建立 uploads/，因此先切換到暫存資料夾再匯入"""
+    workdir = tmp_path_factory.mktemp('server')
+    previous = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import app_improved
+        app_improved.app.config['TESTING'] = True
+        yield app_improved
+    finally:
+        os.chdir(previous)
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""上傳准入：預留空間隨寫入釋放，超出宣告大小的部分在寫入時檢查，配額包含分段上傳已收到的部分"""
+
+import collections
+
+import pytest
+
+import admission
+from admission import AdmissionController, AdmissionError
+
+MB = 1024 * 1024
+Usage = collections.namedtuple('Usage', 'total used free')
+
+
+class FakeDisk:
+    def __init__(self, free):
+        self.free = free
+
+    def usage(self, path):
+        return Usage(0, 0, self.free)
+
+
+@pytest.fixture
+def disk(monkeypatch):
+    fake = FakeDisk(100 * MB)
+    monkeypatch.setattr(admission.shutil, 'disk_usage', fake.usage)
+    return fake
+
+
+def test_written_bytes_are_not_counted_twice(disk):
+    controller = AdmissionController('.', min_free_bytes=0)
+    ticket = controller.admit('phone', 60 * MB, metered=True)
+    # 寫入後剩餘空間減少，預留空間同步釋放
+    disk.free -= 50 * MB
+    ticket.wrote(50 * MB)
+    assert ticket.reserved == 10 * MB
+    controller.check_space(40 * MB)
+    with pytest.raises(AdmissionError):
+        controller.check_space(41 * MB)
+
+
+def test_unannounced_body_is_checked_while_writing(disk):
+    controller = AdmissionController('.', min_free_bytes=0)
+    ticket = controller.admit('phone', 0, metered=True)
+    disk.free -= 100 * MB
+    ticket.wrote(100 * MB)
+    disk.free -= 1 * MB
+    with pytest.raises(AdmissionError) as e:
+        ticket.wrote(1 * MB)
+    assert e.value.status_code == 507
+
+
+def test_quota_counts_bytes_until_recorded(disk):
+    used = {'bytes': 0}
+    controller = AdmissionController('.', min_free_bytes=0, quota_bytes=10 * MB,
+                                     used_bytes=lambda: used['bytes'])
+    ticket = controller.admit('phone', 1 * MB, metered=True)
+    ticket.wrote(8 * MB)
+    with pytest.raises(AdmissionError):
+        controller.check_space(3 * MB)
+    # 檔案登記後計入 used_bytes，不再重複計算
+    used['bytes'] = 8 * MB
+    ticket.recorded(8 * MB)
+    controller.check_space(2 * MB)
+    ticket.release()
+    assert controller.status()['reserved_bytes'] == 0
+
+
+def test_small_writes_are_metered_in_steps(disk, monkeypatch):
+    controller = AdmissionController('.', min_free_bytes=0)
+    ticket = controller.admit('phone', 0, metered=True)
+    calls = []
+    original = controller._wrote
+    monkeypatch.setattr(controller, '_wrote', lambda t, n: calls.append(n) or original(t, n))
+
+    for _ in range(5):
+        ticket.wrote(300 * 1024)
+    # 累積超過 METER_STEP 才交給控制器（不佔用共用的鎖）
+    assert calls == [4 * 300 * 1024]
+
+    # 登記檔案前先交出剩下的部分
+    ticket.recorded(0)
+    assert calls == [4 * 300 * 1024, 300 * 1024]
+    assert ticket.unrecorded == 5 * 300 * 1024
+
+
+def test_quota_counts_chunked_bytes_received(client, server, monkeypatch):
+    admission = server.admission
+    monkeypatch.setattr(admission, 'quota_bytes',
+                        admission._used_bytes() + server.upload_sessions.pending_bytes() + 3000)
+    session_id = client.post('/upload/sessions', json={'filename': 'q.bin', 'size': 2000}) \
+        .get_json()['session_id']
+    client.put(f'/upload/sessions/{session_id}?offset=0', data=b'x' * 1000)
+
+    # 已收到1000位元組、尚未收到1000位元組，配額只剩1000位元組
+    response = client.post('/upload/sessions', json={'filename': 'r.bin', 'size': 1001})
+    assert response.status_code == 507
+    response = client.post('/upload/sessions', json={'filename': 'r.bin', 'size': 1000})
+    assert response.status_code == 200
+    client.delete(f'/upload/sessions/{session_id}')
+    client.delete(f"/upload/sessions/{response.get_json()['session_id']}")
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""封存檔上傳：項目名稱中的路徑不會寫到上傳資料夾之外"""
+
+import io
+import os
+import tarfile
+import zipfile
+
+
+def upload_archive(client, data):
+    response = client.post('/upload/archive', data=data,
+                           headers={'Content-Type': 'application/octet-stream'})
+    return response.status_code, response.get_json()
+
+
+def assert_inside_uploads(server, names):
+    upload_folder = os.path.abspath(server.UPLOAD_FOLDER)
+    for name in names:
+        assert os.sep not in name and '/' not in name and not name.startswith('.')
+        assert os.path.isfile(os.path.join(upload_folder, name))
+
+
+def test_zip_entry_paths_are_flattened(server, client):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('../../escape.txt', b'escape')
+        archive.writestr('/etc/absolute.txt', b'absolute')
+        archive.writestr('photos/2024/nested.txt', b'nested')
+        archive.writestr('__MACOSX/photos/._nested.txt', b'resource fork')
+        archive.writestr('folder/', b'')
+
+    status, result = upload_archive(client, buffer.getvalue())
+
+    assert status == 200, result
+    names = result['files']
+    assert len(names) == 3
+    assert sorted(name.split('_', 3)[-1] for name in names) == [
+        'absolute.txt', 'escape.txt', 'nested.txt']
+    assert_inside_uploads(server, names)
+    assert not os.path.exists(os.path.join(server.UPLOAD_FOLDER, '..', '..', 'escape.txt'))
+    assert not os.path.exists('/etc/absolute.txt')
+
+
+def test_tar_links_are_skipped(server, client):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        info = tarfile.TarInfo('../link')
+        info.type = tarfile.SYMTYPE
+        info.linkname = '/etc/passwd'
+        archive.addfile(info)
+        info = tarfile.TarInfo('hard')
+        info.type = tarfile.LNKTYPE
+        info.linkname = 'data.txt'
+        archive.addfile(info)
+        data = b'regular file'
+        info = tarfile.TarInfo('dir/../../data.txt')
+        info.size = len(data)
+        archive.addfile(info, io.BytesIO(data))
+
+    status, result = upload_archive(client, buffer.getvalue())
+
+    assert status == 200, result
+    [name] = result['files']
+    assert name.endswith('_data.txt')
+    assert_inside_uploads(server, [name])
+    with open(os.path.join(server.UPLOAD_FOLDER, name), 'rb') as f:
+        assert f.read() == data
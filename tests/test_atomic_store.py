@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""原子發布：同名檔案不互相覆蓋，中斷時不留下佔位的空檔案"""
+
+import os
+import threading
+
+import pytest
+
+from atomic_store import FSYNC_POLICIES, FileStore, link_unique_name, move_to_unique_name
+
+
+def write_temp(store, content):
+    path = store.temp_path()
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+@pytest.fixture
+def folder(tmp_path):
+    path = tmp_path / 'uploads'
+    path.mkdir()
+    return path
+
+
+@pytest.mark.parametrize('policy', FSYNC_POLICIES)
+def test_concurrent_publish_keeps_every_file(folder, policy):
+    store = FileStore(str(folder), str(folder / '.incoming'), policy=policy)
+    results = []
+
+    def publish(i):
+        temp = write_temp(store, f'content {i}'.encode())
+        results.append(store.publish(temp, 'photo.jpg'))
+
+    threads = [threading.Thread(target=publish, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(set(results)) == 8
+    contents = {open(path, 'rb').read() for path in results}
+    assert contents == {f'content {i}'.encode() for i in range(8)}
+    assert os.listdir(folder / '.incoming') == []
+
+
+def test_collision_does_not_leave_placeholder(folder, tmp_path):
+    (folder / 'a.txt').write_bytes(b'old')
+    source = tmp_path / 'new.part'
+    source.write_bytes(b'new')
+
+    path = move_to_unique_name(str(source), str(folder), 'a.txt')
+
+    assert os.path.basename(path) == 'a_1.txt'
+    assert (folder / 'a.txt').read_bytes() == b'old'
+    assert (folder / 'a_1.txt').read_bytes() == b'new'
+    assert not source.exists()
+    assert sorted(os.listdir(folder)) == ['a.txt', 'a_1.txt']
+
+
+def test_taken_names_are_skipped(folder, tmp_path):
+    source = tmp_path / 'new.part'
+    source.write_bytes(b'new')
+    taken = {str(folder / 'a.txt')}
+
+    path = move_to_unique_name(str(source), str(folder), 'a.txt', taken.__contains__)
+
+    assert os.path.basename(path) == 'a_1.txt'
+    assert not (folder / 'a.txt').exists()
+
+
+def test_rerun_reuses_existing_link(folder, tmp_path):
+    (folder / 'a.txt').write_bytes(b'other')
+    source = tmp_path / 'new.part'
+    source.write_bytes(b'new')
+    first = link_unique_name(str(source), str(folder), 'a.txt')
+
+    # 上次建立連結後中斷，原檔仍在
+    again = move_to_unique_name(str(source), str(folder), 'a.txt')
+
+    assert again == first
+    assert sorted(os.listdir(folder)) == ['a.txt', 'a_1.txt']
+    assert not source.exists()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""上傳頻寬：加權最大最小公平分配與權杖桶"""
+
+import io
+import time
+
+import pytest
+
+from bandwidth import MIN_RATE, BandwidthScheduler, TokenBucket, parse_priorities
+
+MB = 1024 * 1024
+
+
+def limits(scheduler):
+    return {client['client']: client['limit'] for client in scheduler.status()['clients']}
+
+
+def join(scheduler, *clients):
+    for client in clients:
+        scheduler.throttle(io.BytesIO(), client)
+
+
+def test_equal_weights_split_evenly():
+    scheduler = BandwidthScheduler(total_limit=10 * MB)
+    join(scheduler, 'a', 'b')
+    assert limits(scheduler) == {'a': 5 * MB, 'b': 5 * MB}
+
+
+def test_priority_weights():
+    scheduler = BandwidthScheduler(total_limit=9 * MB, priorities={'a': 'high', 'b': 'low'})
+    join(scheduler, 'a', 'b')
+    # high:low = 4:1
+    assert limits(scheduler) == {'a': pytest.approx(7.2 * MB, abs=1),
+                                 'b': pytest.approx(1.8 * MB, abs=1)}
+
+
+def test_unused_share_goes_to_other_clients():
+    scheduler = BandwidthScheduler(total_limit=10 * MB)
+    join(scheduler, 'slow', 'fast')
+    # 訊號較弱的手機只用到1MB/s且不曾等待權杖：保留25%的成長空間，其餘給另一台
+    slow = scheduler._shares['slow']
+    slow.hungry = False
+    slow.rate = 1 * MB
+    scheduler._allocate(time.monotonic())
+
+    assert limits(scheduler) == {'slow': pytest.approx(1.25 * MB, abs=1),
+                                 'fast': pytest.approx(8.75 * MB, abs=1)}
+
+
+def test_client_limit_caps_allocation():
+    scheduler = BandwidthScheduler(total_limit=10 * MB, client_limit=2 * MB)
+    join(scheduler, 'a', 'b')
+    assert limits(scheduler) == {'a': 2 * MB, 'b': 2 * MB}
+
+
+def test_without_total_limit_only_client_limit_applies():
+    scheduler = BandwidthScheduler(client_limit=3 * MB)
+    join(scheduler, 'a', 'b', 'c')
+    assert set(limits(scheduler).values()) == {3 * MB}
+
+
+def test_no_limits_returns_stream_unchanged():
+    scheduler = BandwidthScheduler()
+    stream = io.BytesIO(b'data')
+    assert scheduler.throttle(stream, 'a') is stream
+
+
+def test_allocation_never_below_minimum():
+    scheduler = BandwidthScheduler(total_limit=MIN_RATE)
+    join(scheduler, *[f'phone{i}' for i in range(8)])
+    assert min(limits(scheduler).values()) >= MIN_RATE
+
+
+def test_token_bucket_reports_wait_for_debt():
+    bucket = TokenBucket(MB, burst_seconds=1)
+    now = bucket.updated
+    assert bucket.take(MB, now) == 0
+    assert bucket.take(MB // 2, now) == pytest.approx(0.5)
+    # 等待補足後欠額歸零
+    assert bucket.take(0, now + 0.5) == 0
+
+
+def test_parse_priorities():
+    assert parse_priorities(['192.168.1.20=high', ' 10.0.0.2 = LOW']) == {
+        '192.168.1.20': 'high', '10.0.0.2': 'low'}
+    with pytest.raises(ValueError):
+        parse_priorities(['192.168.1.20=urgent'])
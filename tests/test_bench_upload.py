@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""效能測試工具：大小解析、百分位數、multipart請求內容與基準比較"""
+
+import io
+import json
+
+import pytest
+from werkzeug.formparser import parse_form_data
+
+from bench_upload import (compare_with_baseline, iter_multipart_body, multipart_length,
+                          parse_size, percentile)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('10MB', 10 * 1024 ** 2),
+    ('512kb', 512 * 1024),
+    ('1.5GB', int(1.5 * 1024 ** 3)),
+    ('100B', 100),
+    ('4096', 4096),
+])
+def test_parse_size(text, expected):
+    assert parse_size(text) == expected
+
+
+def test_percentile_interpolates():
+    assert percentile([], 95) is None
+    assert percentile([5], 95) == 5
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([4, 1, 3, 2], 100) == 4
+
+
+def test_multipart_body_is_parsable():
+    payload = bytes(range(256)) * 1000
+    body = b''.join(bytes(part) for part in iter_multipart_body('b0undary', 'photo.jpg', payload))
+    assert len(body) == multipart_length('b0undary', 'photo.jpg', payload)
+
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'CONTENT_TYPE': 'multipart/form-data; boundary=b0undary',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+    }
+    _stream, _form, files = parse_form_data(environ)
+    upload = files['files']
+    assert upload.filename == 'photo.jpg'
+    assert upload.read() == payload
+
+
+def test_compare_with_baseline(tmp_path):
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps({'results': {
+        'throughput_mb_s': 100, 'latency_p95_s': 1.0, 'peak_rss_mb': 50, 'startup_s': None}}))
+    results = {'throughput_mb_s': 85, 'latency_p95_s': 1.05, 'peak_rss_mb': 70, 'startup_s': 0.5}
+
+    assert compare_with_baseline(results, str(baseline), 0.1) == ['throughput_mb_s', 'peak_rss_mb']
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""分段續傳：伺服器重新啟動後從已寫入磁碟的位置繼續；連線中斷與磁碟錯誤分開計算"""
+
+import io
+import os
+import re
+
+import pytest
+
+from chunked_upload import UploadSessionManager, UploadSessionError
+
+
+class BrokenStream:
+    """送出部分資料後連線中斷"""
+
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        data = self._data.read(size)
+        if not data:
+            raise ConnectionResetError('connection lost')
+        return data
+
+
+def read_part(session):
+    with open(session.part_path, 'rb') as f:
+        return f.read()
+
+
+def test_resume_after_restart(tmp_path):
+    content = os.urandom(300000)
+    manager = UploadSessionManager(str(tmp_path))
+    session = manager.create_session('video.mp4', len(content), upload_key='k1')
+    manager.write_chunk(session.session_id, 0, io.BytesIO(content[:100000]), 100000)
+
+    # 重新啟動：以同一個 upload_key 取回上傳，從 next_offset 繼續
+    restarted = UploadSessionManager(str(tmp_path))
+    resumed = restarted.create_session('video.mp4', len(content), upload_key='k1')
+    assert resumed.session_id == session.session_id
+    assert resumed.next_offset == 100000
+    restarted.write_chunk(resumed.session_id, 100000, io.BytesIO(content[100000:]),
+                          len(content) - 100000)
+
+    stored = restarted.finalize(resumed.session_id, read_part)
+    assert stored == content
+    assert not os.path.exists(resumed.meta_path)
+
+
+def test_interrupted_chunk_keeps_written_part(tmp_path):
+    content = os.urandom(50000)
+    manager = UploadSessionManager(str(tmp_path))
+    session = manager.create_session('a.bin', len(content))
+    with pytest.raises(ConnectionResetError):
+        manager.write_chunk(session.session_id, 0, BrokenStream(content[:20000]), len(content))
+
+    restarted = UploadSessionManager(str(tmp_path))
+    assert restarted.get_session(session.session_id).ranges == [[0, 20000]]
+
+
+def test_incomplete_upload_cannot_finalize(tmp_path):
+    manager = UploadSessionManager(str(tmp_path))
+    session = manager.create_session('a.bin', 1000)
+    manager.write_chunk(session.session_id, 500, io.BytesIO(b'x' * 500), 500)
+    with pytest.raises(UploadSessionError) as e:
+        manager.finalize(session.session_id, read_part)
+    assert e.value.status_code == 409
+
+
+def test_tampered_part_file_restarts_upload(tmp_path):
+    manager = UploadSessionManager(str(tmp_path), fsync_policy='file')
+    session = manager.create_session('a.bin', 1000)
+    manager.write_chunk(session.session_id, 0, io.BytesIO(b'x' * 1000), 1000)
+    with open(session.part_path, 'r+b') as f:
+        f.truncate(10)
+
+    restarted = UploadSessionManager(str(tmp_path))
+    assert restarted.get_session(session.session_id).ranges == []
+
+
+@pytest.mark.parametrize('policy, expected', [('file', 3), ('group', 3), ('none', 0)])
+def test_chunk_fsync_follows_policy(tmp_path, monkeypatch, policy, expected):
+    manager = UploadSessionManager(str(tmp_path), fsync_policy=policy)
+    session = manager.create_session('a.bin', 1000)
+    synced = []
+    monkeypatch.setattr(os, 'fsync', synced.append)
+
+    manager.write_chunk(session.session_id, 0, io.BytesIO(b'x' * 1000), 1000)
+
+    # 區塊內容、工作階段狀態與資料夾各一次
+    assert len(synced) == expected
+
+
+def test_unsynced_tail_is_uploaded_again(tmp_path):
+    manager = UploadSessionManager(str(tmp_path), fsync_policy='none')
+    session = manager.create_session('a.bin', 1000)
+    manager.write_chunk(session.session_id, 0, io.BytesIO(b'x' * 400), 400)
+    manager.write_chunk(session.session_id, 600, io.BytesIO(b'y' * 400), 400)
+    assert os.path.getsize(session.part_path) == 1000
+
+    # 當機時最後寫入的部分還沒寫回磁碟
+    with open(session.part_path, 'r+b') as f:
+        f.truncate(700)
+
+    restarted = UploadSessionManager(str(tmp_path), fsync_policy='none')
+    assert restarted.get_session(session.session_id).ranges == [[0, 400], [600, 700]]
+
+
+def error_count(client, kind):
+    text = client.get('/metrics').get_data(as_text=True)
+    match = re.search(rf'^transfer_upload_errors_total{{type="{kind}"}} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else 0
+
+
+def create_session(client, size):
+    response = client.post('/upload/sessions', json={'filename': 'chunk.bin', 'size': size})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['session_id']
+
+
+def test_disconnected_chunk_is_receive_error(client):
+    session_id = create_session(client, 1000)
+    before = error_count(client, 'receive_error')
+
+    # 宣告1000位元組，只送出300位元組後連線結束
+    response = client.put(f'/upload/sessions/{session_id}?offset=0', data=b'x' * 300,
+                          environ_overrides={'CONTENT_LENGTH': '1000'})
+
+    assert response.status_code == 400
+    assert error_count(client, 'receive_error') == before + 1
+    assert client.get(f'/upload/sessions/{session_id}').get_json()['next_offset'] == 300
+
+
+def test_disk_failure_is_disk_error(client, monkeypatch):
+    session_id = create_session(client, 1000)
+    before = error_count(client, 'disk_error')
+
+    def fail(f, offset, data):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr('chunked_upload.write_at', fail)
+    response = client.put(f'/upload/sessions/{session_id}?offset=0', data=b'x' * 1000)
+
+    assert response.status_code == 500
+    assert error_count(client, 'disk_error') == before + 1
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""壓縮的請求內容"""
+
+import gzip
+import io
+import zlib
+
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from content_encoding import decode_request_stream, zstandard
+
+
+class TrickleStream(io.BytesIO):
+    """每次只回傳一個位元組的請求串流"""
+
+    def read(self, size=-1):
+        return super().read(1)
+
+
+def read_all(stream):
+    chunks = []
+    while True:
+        data = stream.read(65536)
+        if not data:
+            return b''.join(chunks)
+        chunks.append(data)
+
+
+@pytest.mark.parametrize('compress', [
+    zlib.compress,
+    lambda data: zlib.compress(data)[2:-4],         # 原始deflate
+])
+def test_deflate_detects_format_from_short_reads(compress):
+    content = b'hello deflate ' * 1000
+    stream = decode_request_stream(TrickleStream(compress(content)), 'deflate', None)
+    assert read_all(stream) == content
+
+
+def test_gzip_rejects_bomb():
+    bomb = gzip.compress(b'\0' * (20 * 1024 * 1024))
+    stream = decode_request_stream(io.BytesIO(bomb), 'gzip', None)
+    with pytest.raises(RequestEntityTooLarge):
+        read_all(stream)
+
+
+@pytest.mark.skipif(zstandard is None, reason='zstandard未安裝')
+def test_zstd_reads_every_frame():
+    compressor = zstandard.ZstdCompressor()
+    body = compressor.compress(b'first frame ') + compressor.compress(b'second frame')
+    stream = decode_request_stream(io.BytesIO(body), 'zstd', None)
+    assert read_all(stream) == b'first frame second frame'
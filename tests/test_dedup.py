@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""秒傳與重複內容去重"""
+
+import hashlib
+import io
+import os
+
+
+def upload(client, name, content):
+    response = client.post('/upload', data={'files': (io.BytesIO(content), name)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['files'][0]
+
+
+def upload_files(server):
+    return sorted(name for name in os.listdir(server.UPLOAD_FOLDER)
+                  if not name.startswith('.'))
+
+
+def test_instant_upload_links_existing_content(server, client):
+    content = os.urandom(4096)
+    original = upload(client, 'photo.bin', content)
+
+    response = client.post('/upload/instant', json={
+        'filename': 'photo_copy.bin', 'sha256': hashlib.sha256(content).hexdigest()})
+    assert response.status_code == 200, response.get_json()
+    copy = response.get_json()['files'][0]
+
+    original_path = os.path.join(server.UPLOAD_FOLDER, original)
+    copy_path = os.path.join(server.UPLOAD_FOLDER, copy)
+    assert os.path.samefile(original_path, copy_path)
+    assert not [name for name in upload_files(server) if name.endswith('.link')]
+    assert client.get(f'/download/{copy}').data == content
+
+
+def test_instant_upload_unknown_hash(client):
+    response = client.post('/upload/instant', json={'filename': 'a.bin', 'sha256': '0' * 64})
+    assert response.status_code == 404
+
+
+def test_duplicate_upload_becomes_hardlink(server, client):
+    content = os.urandom(8192)
+    first = upload(client, 'doc.pdf', content)
+    second = upload(client, 'doc_again.pdf', content)
+
+    assert os.path.samefile(os.path.join(server.UPLOAD_FOLDER, first),
+                            os.path.join(server.UPLOAD_FOLDER, second))
+    assert not [name for name in upload_files(server) if name.endswith('.link')]
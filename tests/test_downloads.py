@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""下載：Range、If-Range與ETag條件式請求"""
+
+import io
+import os
+from datetime import timedelta
+
+import pytest
+from werkzeug.http import http_date, parse_date
+
+CONTENT = bytes(range(256)) * 16
+
+
+@pytest.fixture
+def stored(client):
+    response = client.post('/upload', data={'files': (io.BytesIO(CONTENT), 'range.bin')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['files'][0]
+
+
+def test_full_download_has_validators(client, stored):
+    response = client.get(f'/download/{stored}')
+    assert response.status_code == 200
+    assert response.data == CONTENT
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['ETag']
+    assert response.headers['Last-Modified']
+
+
+def test_single_range(client, stored):
+    response = client.get(f'/download/{stored}', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == CONTENT[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(CONTENT)}'
+    assert response.content_length == 100
+
+
+def test_suffix_range(client, stored):
+    response = client.get(f'/download/{stored}', headers={'Range': 'bytes=-10'})
+    assert response.status_code == 206
+    assert response.data == CONTENT[-10:]
+
+
+def test_unsatisfiable_range(client, stored):
+    response = client.get(f'/download/{stored}', headers={'Range': f'bytes={len(CONTENT)}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(CONTENT)}'
+
+
+def test_if_none_match_returns_not_modified(client, stored):
+    etag = client.get(f'/download/{stored}').headers['ETag']
+    response = client.get(f'/download/{stored}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_if_range_with_stale_etag_sends_whole_file(client, server, stored):
+    etag = client.get(f'/download/{stored}').headers['ETag']
+    response = client.get(f'/download/{stored}', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert response.status_code == 206
+
+    # 檔案內容改變後，續傳必須從頭開始
+    path = os.path.join(server.UPLOAD_FOLDER, stored)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    response = client.get(f'/download/{stored}', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert response.status_code == 200
+    assert response.data == CONTENT
+
+
+def test_if_range_date_must_match_exactly(client, stored):
+    last_modified = parse_date(client.get(f'/download/{stored}').headers['Last-Modified'])
+
+    def fetch(date):
+        return client.get(f'/download/{stored}',
+                          headers={'Range': 'bytes=0-9', 'If-Range': http_date(date)})
+
+    assert fetch(last_modified).status_code == 206
+    # 比 Last-Modified 新或舊的日期都不能證明手機手上的是目前的內容
+    for offset in (1, 3600, -1):
+        response = fetch(last_modified + timedelta(seconds=offset))
+        assert response.status_code == 200
+        assert response.data == CONTENT
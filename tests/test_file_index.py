@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""檔案目錄：游標分頁以 (排序欄位, path) 列值接續，相同排序值也不會重複或遺漏；啟動時遞增補登既有檔案"""
+
+import hashlib
+import os
+
+import pytest
+
+import file_index
+from file_index import FileIndex, decode_cursor, encode_cursor
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = FileIndex(str(tmp_path / 'index.db'), str(tmp_path))
+    yield index
+    index.close()
+
+
+def add(index, tmp_path, name, uploaded_at, size=1):
+    index.add(str(tmp_path / name), '0' * 64, size=size, mtime=uploaded_at,
+              original_name=name, uploaded_at=uploaded_at)
+
+
+def all_pages(index, limit, **options):
+    paths, cursor, pages = [], None, 0
+    while True:
+        rows, cursor = index.list_files(cursor=cursor, limit=limit, **options)
+        paths.extend(row['path'] for row in rows)
+        pages += 1
+        if cursor is None:
+            return paths, pages
+
+
+@pytest.mark.parametrize('descending', [True, False])
+def test_equal_upload_times_page_by_path(index, tmp_path, descending):
+    names = [f'{i:02d}.jpg' for i in range(7)]
+    for name in names:
+        add(index, tmp_path, name, 1000.0)
+
+    paths, pages = all_pages(index, 2, descending=descending)
+
+    assert paths == sorted(names, reverse=descending)
+    assert pages == 4
+
+
+def test_ties_across_page_boundary(index, tmp_path):
+    add(index, tmp_path, 'a.jpg', 100.0)
+    add(index, tmp_path, 'b.jpg', 200.0)
+    # 第一頁在 c 結束，同一時間的 d、e 必須出現在下一頁
+    for name in ('c.jpg', 'd.jpg', 'e.jpg'):
+        add(index, tmp_path, name, 300.0)
+    add(index, tmp_path, 'f.jpg', 400.0)
+
+    first, cursor = index.list_files(descending=False, limit=3)
+    assert [row['path'] for row in first] == ['a.jpg', 'b.jpg', 'c.jpg']
+    second, cursor = index.list_files(descending=False, limit=3, cursor=cursor)
+    assert [row['path'] for row in second] == ['d.jpg', 'e.jpg', 'f.jpg']
+    assert cursor is None
+
+
+def test_new_upload_does_not_shift_pages(index, tmp_path):
+    for i in range(4):
+        add(index, tmp_path, f'{i}.jpg', 100.0 + i)
+    first, cursor = index.list_files(limit=2)
+    # 翻頁之間新增的檔案排在最前面，不會讓下一頁重複出現已看過的項目
+    add(index, tmp_path, 'new.jpg', 999.0)
+    second, _ = index.list_files(limit=2, cursor=cursor)
+
+    assert [row['path'] for row in first] == ['3.jpg', '2.jpg']
+    assert [row['path'] for row in second] == ['1.jpg', '0.jpg']
+
+
+def test_sort_by_size_with_equal_sizes(index, tmp_path):
+    for name, size in (('x', 5), ('y', 5), ('z', 1), ('w', 5)):
+        add(index, tmp_path, name, 1.0, size=size)
+
+    paths, _ = all_pages(index, 1, sort='size', descending=False)
+
+    assert paths == ['z', 'w', 'x', 'y']
+
+
+def test_cursor_round_trip_and_rejects_garbage(index):
+    assert decode_cursor(encode_cursor(12.5, '相簿/a.jpg')) == (12.5, '相簿/a.jpg')
+    with pytest.raises(ValueError):
+        decode_cursor('not-a-cursor')
+    with pytest.raises(ValueError):
+        index.list_files(sort='sha256')
+
+
+def write(root, relpath, content):
+    path = root.joinpath(*relpath.split('/'))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return path
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    root = tmp_path / 'uploads'
+    root.mkdir()
+    index = FileIndex(str(tmp_path / 'index.db'), str(root))
+    yield index, root
+    index.close()
+
+
+def test_backfill_indexes_existing_files(uploads):
+    index, root = uploads
+    write(root, 'a.jpg', b'a')
+    write(root, '2024/05/b.txt', b'bb')
+    write(root, '.transfer/partial/c.part', b'ccc')
+
+    assert index.backfill(exclude=['.transfer']) == 2
+
+    assert index.get('2024/05/b.txt')['size'] == 2
+    assert index.get('.transfer/partial/c.part') is None
+    assert index.lookup(hashlib.sha256(b'a').hexdigest()) == str(root / 'a.jpg')
+
+
+def test_backfill_skips_unchanged_files(uploads, monkeypatch):
+    index, root = uploads
+    write(root, 'a.jpg', b'a')
+    changed = write(root, 'b.jpg', b'b')
+    index.backfill()
+
+    hashed = []
+    original = file_index.hash_file
+    monkeypatch.setattr(file_index, 'hash_file', lambda path: hashed.append(path) or original(path))
+    changed.write_bytes(b'changed')
+    os.utime(changed, (1000, 1000))
+
+    assert index.backfill() == 1
+    assert hashed == [str(changed)]
+    assert index.get('b.jpg')['sha256'] == hashlib.sha256(b'changed').hexdigest()
+
+
+def test_backfill_keeps_upload_registered_meanwhile(uploads, monkeypatch):
+    index, root = uploads
+    write(root, 'a.jpg', b'a')
+    original = file_index.hash_file
+
+    def upload_during_hash(filepath):
+        index.add(filepath, '1' * 64, original_name='IMG_0001.jpg', client_ip='10.0.0.2')
+        return original(filepath)
+
+    monkeypatch.setattr(file_index, 'hash_file', upload_during_hash)
+
+    assert index.backfill() == 0
+    entry = index.get('a.jpg')
+    assert entry['original_name'] == 'IMG_0001.jpg'
+    assert entry['client_ip'] == '10.0.0.2'
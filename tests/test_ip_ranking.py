@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""IP排名：上傳速度只以讀取請求內容的時間計算，不含頻寬限制的等待"""
+
+import io
+import time
+
+from ip_ranking import ReceiveMeter
+
+MB = 1024 * 1024
+
+
+def test_receive_meter_counts_reads():
+    meter = ReceiveMeter(io.BytesIO(b'x' * 1000))
+    assert meter.read(600) == b'x' * 600
+    assert meter.read() == b'x' * 400
+    assert meter.bytes == 1000
+    assert meter.seconds > 0
+
+
+def test_throttled_upload_is_ranked_by_receive_time(client, server, monkeypatch):
+    samples = []
+    monkeypatch.setattr(server, 'request_local_ip', lambda: '192.168.1.5')
+    monkeypatch.setattr(server.ip_ranker, 'record_connection', lambda local_ip, client: None)
+    monkeypatch.setattr(server.ip_ranker, 'record_transfer',
+                        lambda local_ip, size, seconds: samples.append((local_ip, size, seconds)))
+    server.bandwidth.configure(client_limit=4 * MB)
+    try:
+        started = time.perf_counter()
+        response = client.post('/upload', data={'files': (io.BytesIO(b'x' * 8 * MB), 'ranked.bin')},
+                               content_type='multipart/form-data')
+        elapsed = time.perf_counter() - started
+    finally:
+        server.bandwidth.configure()
+
+    assert response.status_code == 200
+    [(local_ip, size, seconds)] = samples
+    assert local_ip == '192.168.1.5'
+    assert size > 8 * MB
+    # 頻寬限制讓請求花了超過一秒，但讀取本身很快
+    assert elapsed > 1
+    assert seconds < elapsed / 4
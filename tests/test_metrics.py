@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""效能指標：Prometheus文字格式與各執行緒分片的合併"""
+
+import threading
+
+from metrics import MetricsRegistry
+
+
+def sample_lines(text):
+    return [line for line in text.splitlines() if not line.startswith('#')]
+
+
+def test_counter_and_gauge_text_format():
+    registry = MetricsRegistry()
+    files = registry.counter('transfer_files_total', '完成的檔案數', ['api'])
+    active = registry.gauge('transfer_active', '進行中的上傳')
+    files.inc(api='multipart')
+    files.inc(2, api='chunked')
+    active.inc()
+    active.inc()
+    active.dec()
+
+    text = registry.render()
+
+    assert text.endswith('\n')
+    assert '# HELP transfer_files_total 完成的檔案數\n# TYPE transfer_files_total counter\n' in text
+    assert '# TYPE transfer_active gauge\n' in text
+    assert sample_lines(text) == [
+        'transfer_files_total{api="chunked"} 2',
+        'transfer_files_total{api="multipart"} 1',
+        'transfer_active 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram('transfer_seconds', '時間', buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value)
+
+    assert sample_lines(registry.render()) == [
+        'transfer_seconds_bucket{le="0.1"} 2',
+        'transfer_seconds_bucket{le="1"} 3',
+        'transfer_seconds_bucket{le="+Inf"} 4',
+        'transfer_seconds_sum 3.65',
+        'transfer_seconds_count 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    errors = registry.counter('transfer_errors_total', '錯誤', ['type'])
+    errors.inc(type='a"b\\c\nd')
+
+    assert sample_lines(registry.render()) == ['transfer_errors_total{type="a\\"b\\\\c\\nd"} 1']
+
+
+def test_shards_from_finished_threads_are_merged():
+    registry = MetricsRegistry()
+    counter = registry.counter('transfer_bytes_total', '位元組')
+    threads = [threading.Thread(target=lambda: [counter.inc(10) for _ in range(100)])
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc(5)
+
+    assert sample_lines(registry.render()) == ['transfer_bytes_total 8005']
+    # 合併後再讀一次不會重複計算
+    assert sample_lines(registry.render()) == ['transfer_bytes_total 8005']
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""寫入磁碟：on_write 回報的是實際寫入的系統呼叫，而不是複製到緩衝區"""
+
+from multipart_stream import save_chunks
+
+
+def test_on_write_reports_flushed_blocks(tmp_path):
+    path = tmp_path / 'out.bin'
+    chunks = [b'a' * 3, b'b' * 3, b'c' * 3, b'd' * 25, b'e' * 2]
+    writes = []
+
+    written = save_chunks(str(path), iter(chunks), buffer_size=8,
+                          on_write=lambda nbytes, seconds: writes.append(nbytes))
+
+    assert written == 36
+    assert path.read_bytes() == b''.join(chunks)
+    # 緩衝區滿了才寫入；大於緩衝區的區塊直接寫入
+    assert writes == [6, 3, 25, 2]
+
+
+def test_on_data_sees_every_chunk(tmp_path):
+    seen = []
+    save_chunks(str(tmp_path / 'out.bin'), iter([b'x', b'yz']), on_data=seen.append)
+    assert seen == [b'x', b'yz']
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""網路介面偵測：快取IP清單，變動時通知訂閱者"""
+
+import socket
+
+from network_discovery import (IFA_LABEL, IFA_LOCAL, IFADDRMSG, RTATTR, InterfaceDiscovery,
+                               _align, _parse_ifaddr)
+
+
+class FakeProbe:
+    def __init__(self, ips):
+        self.ips = ips
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if isinstance(self.ips, Exception):
+            raise self.ips
+        return list(self.ips)
+
+
+def test_ips_are_probed_once_and_cached():
+    probe = FakeProbe(['192.168.1.5'])
+    discovery = InterfaceDiscovery(probe)
+    assert discovery.get_ips() == ['192.168.1.5']
+    assert discovery.get_ips() == ['192.168.1.5']
+    assert probe.calls == 1
+
+
+def test_changes_are_reported_to_subscribers():
+    probe = FakeProbe(['192.168.1.5', '10.0.0.2'])
+    discovery = InterfaceDiscovery(probe)
+    discovery.get_ips()
+    events = []
+    discovery.subscribe(lambda *event: events.append(event))
+
+    discovery.refresh()
+    assert events == []
+
+    probe.ips = ['192.168.1.5', '172.20.10.3']
+    discovery.refresh()
+    assert events == [(['192.168.1.5', '172.20.10.3'], ['172.20.10.3'], ['10.0.0.2'])]
+
+
+def test_failed_probe_keeps_previous_list(capsys):
+    probe = FakeProbe(['192.168.1.5'])
+    discovery = InterfaceDiscovery(probe)
+    discovery.get_ips()
+
+    probe.ips = OSError('network down')
+    discovery.refresh()
+
+    assert discovery.get_ips() == ['192.168.1.5']
+    assert 'network down' in capsys.readouterr().out
+
+
+def rtattr(attr_type, value):
+    data = RTATTR.pack(RTATTR.size + len(value), attr_type) + value
+    return data + b'\0' * (_align(len(data)) - len(data))
+
+
+def test_parse_netlink_address_message():
+    payload = (IFADDRMSG.pack(socket.AF_INET, 24, 0, 0, 3)
+               + rtattr(IFA_LOCAL, socket.inet_aton('192.168.1.5'))
+               + rtattr(IFA_LABEL, b'wlan0\0'))
+    assert _parse_ifaddr(payload) == ('wlan0', '192.168.1.5', 24)
+
+
+def test_parse_ignores_ipv6():
+    payload = IFADDRMSG.pack(socket.AF_INET6, 64, 0, 0, 3)
+    assert _parse_ifaddr(payload) is None
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""後處理佇列：日誌重播與中斷後重新執行的步驟"""
+
+import hashlib
+import json
+import os
+import threading
+
+from file_index import FileIndex
+from post_processing import Job, JobQueue, make_organize_step
+
+
+def test_unfinished_job_resumes_from_journal(tmp_path):
+    journal = tmp_path / 'jobs.jsonl'
+    path = str(tmp_path / 'a.txt')
+    job = Job('job1', path, 'x' * 64, ['first', 'second'])
+    with open(journal, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'op': 'queued', 'job': job.to_dict()}) + '\n')
+        f.write(json.dumps({'op': 'progress', 'id': 'job1', 'step': 1, 'path': path}) + '\n')
+        f.write('{"op": "retry", "id": "job1"')        # 寫到一半就中斷的最後一行
+
+    calls = []
+    queue = JobQueue(str(journal), workers=1)
+    queue.register_step('first', lambda job: calls.append('first'))
+    queue.register_step('second', lambda job: calls.append('second'))
+    finished = threading.Event()
+    queue.on_event = lambda job, state: state == 'done' and finished.set()
+    queue.start()
+    try:
+        assert finished.wait(5)
+    finally:
+        queue.stop()
+    assert calls == ['second']
+    assert queue.status()['completed'] == 1
+
+
+def test_organize_rerun_after_crash_updates_index(tmp_path):
+    root = tmp_path / 'uploads'
+    root.mkdir()
+    content = b'photo'
+    path = root / 'IMG_1.jpg'
+    path.write_bytes(content)
+    index = FileIndex(str(root / '.transfer' / 'index.db'), str(root))
+    index.add(str(path), hashlib.sha256(content).hexdigest())
+
+    # 模擬：已移動檔案並記下目的地，但在更新檔案目錄與寫入日誌之前當機
+    target = root / '2024' / '05' / 'IMG_1.jpg'
+    target.parent.mkdir(parents=True)
+    job = Job('job1', str(path), hashlib.sha256(content).hexdigest(), ['organize'],
+              data={'organized_path': str(target)})
+    os.replace(path, target)
+
+    step = make_organize_step(str(root), on_moved=index.rename)
+    assert step(job) == str(target)
+    assert index.get('2024/05/IMG_1.jpg') is not None
+    assert index.get('IMG_1.jpg') is None
+    index.close()
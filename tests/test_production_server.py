@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""正式環境伺服器：keep-alive連線重複使用，監聽socket套用較大的緩衝區"""
+
+import http.client
+import socket
+import threading
+
+import pytest
+
+from production_server import create_production_server, production_server_available
+
+pytestmark = pytest.mark.skipif(not production_server_available(), reason='未安裝cheroot')
+
+
+def echo_app(environ, start_response):
+    body = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+    start_response('200 OK', [('Content-Type', 'application/octet-stream'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+@pytest.fixture
+def server():
+    server = create_production_server(echo_app, '127.0.0.1', 0, threads=2,
+                                      socket_buffer_size=1024 * 1024)
+    server.prepare()
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+    yield server
+    server.stop()
+    thread.join(5)
+
+
+def test_keepalive_connection_is_reused(server):
+    conn = http.client.HTTPConnection('127.0.0.1', server.bind_addr[1], timeout=10)
+    sockets = []
+    try:
+        for body in (b'first', b'second' * 1000):
+            conn.request('POST', '/', body)
+            response = conn.getresponse()
+            assert response.status == 200
+            assert response.read() == body
+            sockets.append(conn.sock.getsockname())
+    finally:
+        conn.close()
+    # 兩個請求使用同一條連線
+    assert sockets[0] == sockets[1]
+
+
+def test_listening_socket_buffer_is_enlarged(server):
+    size = server.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    # 核心可能依上限調整，但一定比預設值（約128KB）大
+    assert size >= 256 * 1024
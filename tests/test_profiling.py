@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""效能剖析：respond 階段涵蓋串流的回應內容，同一時間只以cProfile剖析一個請求"""
+
+import io
+
+import pytest
+
+from profiling import RequestProfiler
+
+
+@pytest.fixture
+def finished(server, monkeypatch):
+    profiler = server.profiler
+    monkeypatch.setattr(profiler, 'enabled', True)
+    traces = []
+    original = profiler.finish_trace
+
+    def record(trace, status_code):
+        original(trace, status_code)
+        traces.append((trace, status_code))
+
+    monkeypatch.setattr(profiler, 'finish_trace', record)
+    monkeypatch.setattr(profiler, 'threshold', float('inf'))
+    return traces
+
+
+def test_trace_finishes_after_streamed_body(client, finished):
+    response = client.get('/speedtest/download?size=2', buffered=False)
+    assert finished == []
+
+    body = b''.join(response.response)
+    response.close()
+
+    assert len(body) == 2 * 1024 * 1024
+    [(trace, status_code)] = finished
+    assert status_code == 200
+    assert trace.phases['respond'] > 0
+
+
+def test_download_trace_releases_profile_lock(client, server, finished, monkeypatch):
+    upload = client.post('/upload', data={'files': (io.BytesIO(b'x' * 4096), 'profiled.bin')},
+                         content_type='multipart/form-data')
+    name = upload.get_json()['files'][0]
+    finished.clear()
+    monkeypatch.setattr(server.profiler, 'sample_rate', 1.0)
+
+    response = client.get(f'/download/{name}')
+    assert response.data == b'x' * 4096
+    response.close()
+
+    [(trace, status_code)] = finished
+    assert status_code == 200
+    assert trace.profile is not None
+    assert not server.profiler._profile_lock.locked()
+
+
+def test_only_one_request_profiled_at_a_time(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), enabled=True, threshold=float('inf'), sample_rate=1.0)
+    first = profiler.start_trace('GET', '/a', 'a', None, None)
+    second = profiler.start_trace('GET', '/b', 'b', None, None)
+    assert first.profile is not None
+    assert second.profile is None
+
+    profiler.finish_trace(second, 200)
+    profiler.finish_trace(first, 200)
+    third = profiler.start_trace('GET', '/c', 'c', None, None)
+    assert third.profile is not None
+    profiler.finish_trace(third, 200)
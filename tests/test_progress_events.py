@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""上傳進度事件：SSE觀看者上限只計算佔用工作執行緒的連線"""
+
+import pytest
+
+from progress_events import EventHub, EventStreamFull, subscriber_limit
+
+
+def test_subscriber_limit_is_half_of_threads():
+    assert subscriber_limit(32) == 16
+    assert subscriber_limit(1) == 1
+
+
+def test_local_subscribers_do_not_take_slots():
+    hub = EventHub(max_subscribers=1)
+    window = hub.subscribe(local=True)
+    watcher = hub.subscribe()
+    assert hub.subscribers == 1
+    with pytest.raises(EventStreamFull):
+        hub.subscribe()
+
+    window.close()
+    assert hub.subscribers == 1
+    watcher.close()
+    assert hub.subscribers == 0
+    hub.subscribe().close()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""QR Code快取與無介面模式的延遲載入"""
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from qr_codes import QR_DISPLAY_SIZE, QRCodeCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_cache_renders_each_url_once():
+    pytest.importorskip('qrcode')
+    cache = QRCodeCache()
+
+    image = cache.get('http://192.168.1.5:5000')
+
+    assert image.size == (QR_DISPLAY_SIZE, QR_DISPLAY_SIZE)
+    assert cache.get('http://192.168.1.5:5000') is image
+
+
+def test_prefetch_fills_cache():
+    pytest.importorskip('qrcode')
+    cache = QRCodeCache(size=100)
+    urls = ['http://10.0.0.2:5000', 'http://10.0.0.3:5000']
+
+    cache.prefetch(urls)
+    deadline = time.monotonic() + 10
+    while len(cache._images) < len(urls) and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    assert set(cache._images) == set(urls)
+
+
+def test_import_does_not_load_gui_modules(tmp_path):
+    code = ('import sys; import app_improved; '
+            'print(sorted(m for m in ("tkinter", "qrcode", "PIL.ImageTk") if m in sys.modules))')
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run([sys.executable, '-c', code], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=60)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == '[]'
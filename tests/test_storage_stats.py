@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""資料夾統計：遞迴計算檔案數，只重新掃描修改時間改變的資料夾"""
+
+import os
+import shutil
+
+import pytest
+
+from storage_stats import StorageStats
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = tmp_path / 'uploads'
+    (root / '2024' / '05').mkdir(parents=True)
+    (root / '.transfer' / 'incoming').mkdir(parents=True)
+    (root / 'a.jpg').write_bytes(b'a' * 10)
+    (root / '2024' / 'b.jpg').write_bytes(b'b' * 20)
+    (root / '2024' / '05' / 'c.jpg').write_bytes(b'c' * 30)
+    (root / '.transfer' / 'index.db').write_bytes(b'x' * 1000)
+    (root / '.transfer' / 'incoming' / 'tmp.part').write_bytes(b'x' * 1000)
+    return root
+
+
+def make_stats(root, tmp_path):
+    return StorageStats(str(root), str(tmp_path / 'stats.json'), exclude={'.transfer'})
+
+
+def count_scans(stats, monkeypatch):
+    scanned = []
+    original = stats._scan_dir
+
+    def scan(key, dirpath):
+        scanned.append(key)
+        return original(key, dirpath)
+
+    monkeypatch.setattr(stats, '_scan_dir', scan)
+    return scanned
+
+
+def touch_dir(path):
+    """確保資料夾的修改時間確實改變（不受檔案系統時間精度影響）"""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_counts_nested_folders_and_skips_excluded(root, tmp_path):
+    stats = make_stats(root, tmp_path)
+    stats.reconcile()
+    assert stats.snapshot() == (3, 60)
+
+
+def test_only_changed_folders_are_rescanned(root, tmp_path, monkeypatch):
+    stats = make_stats(root, tmp_path)
+    stats.reconcile()
+    scanned = count_scans(stats, monkeypatch)
+
+    stats.reconcile()
+    assert scanned == []
+
+    (root / '2024' / '05' / 'd.jpg').write_bytes(b'd' * 40)
+    touch_dir(root / '2024' / '05')
+    stats.reconcile()
+    assert scanned == ['2024/05']
+    assert stats.snapshot() == (4, 100)
+
+
+def test_removed_folder_is_dropped(root, tmp_path):
+    stats = make_stats(root, tmp_path)
+    stats.reconcile()
+
+    shutil.rmtree(root / '2024')
+    touch_dir(root)
+    stats.reconcile()
+
+    assert stats.snapshot() == (1, 10)
+
+
+def test_added_file_is_counted_once(root, tmp_path):
+    stats = make_stats(root, tmp_path)
+    stats.reconcile()
+
+    path = root / '2024' / 'e.jpg'
+    path.write_bytes(b'e' * 5)
+    stats.add_file(str(path), 5)
+    assert stats.snapshot() == (4, 65)
+    # 背景同步時重新掃描該資料夾，不會重複計算
+    stats.reconcile()
+    assert stats.snapshot() == (4, 65)
+
+
+def test_snapshot_is_available_before_first_scan(root, tmp_path, monkeypatch):
+    make_stats(root, tmp_path).reconcile()
+
+    restarted = make_stats(root, tmp_path)
+    assert restarted.snapshot() == (3, 60)
+    scanned = count_scans(restarted, monkeypatch)
+    restarted.reconcile()
+    assert scanned == []
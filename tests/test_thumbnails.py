@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""縮圖：一次解碼輸出所有尺寸，背景產生後可從快取取得"""
+
+import os
+import time
+
+import pytest
+
+PIL = pytest.importorskip('PIL')
+from PIL import Image
+
+from thumbnails import ThumbnailService, is_image_file, render_thumbnails
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / 'photo.jpg'
+    Image.new('RGB', (1200, 800), (200, 40, 40)).save(path, 'JPEG')
+    return path
+
+
+def test_is_image_file():
+    assert is_image_file('IMG_0001.JPG')
+    assert is_image_file('scan.tiff')
+    assert not is_image_file('notes.txt')
+
+
+def test_render_writes_every_size(photo, tmp_path):
+    targets = [(size, str(tmp_path / f'thumb_{size}.jpg')) for size in (128, 320)]
+
+    render_thumbnails(str(photo), targets)
+
+    for size, path in targets:
+        with Image.open(path) as image:
+            assert max(image.size) == size
+            assert image.size == (size, size * 2 // 3)
+        assert not os.path.exists(path + '.tmp')
+
+
+def test_service_renders_in_background(photo, tmp_path):
+    service = ThumbnailService(str(tmp_path / 'cache'), workers=1, sizes=(64, 128))
+    key = service.cache_key('ab' * 32, 123)
+    assert service.get(key, 64) is None
+
+    service.schedule(str(photo), key)
+    deadline = time.monotonic() + 30
+    while service.get(key, 64) is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    try:
+        for size in (64, 128):
+            path = service.get(key, size)
+            assert path is not None
+            with Image.open(path) as image:
+                assert max(image.size) == size
+    finally:
+        service.shutdown()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""分層儲存：搬移日誌重播、去重只查落地層、儲存層介面"""
+
+import hashlib
+import json
+import threading
+
+import pytest
+
+from file_index import FileIndex
+from post_processing import Job
+from tiered_storage import (ARCHIVE_TEMP_SUFFIX, ArchiveMover, LocalDirectoryTarget,
+                            StorageTarget)
+
+CONTENT = b'archived photo'
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+@pytest.fixture
+def tiers(tmp_path):
+    landing = tmp_path / 'uploads'
+    archive = tmp_path / 'nas'
+    landing.mkdir()
+    archive.mkdir()
+    index = FileIndex(str(tmp_path / 'index.db'), str(landing))
+    path = landing / 'a.jpg'
+    path.write_bytes(CONTENT)
+    index.add(str(path), SHA256)
+    yield landing, archive, index
+    index.close()
+
+
+def resume_mover(tmp_path, landing, archive, index):
+    """以尚未完成的搬移日誌啟動搬移器，等工作完成後回傳收到的 on_archived 呼叫"""
+    journal = tmp_path / 'archive.jsonl'
+    job = Job('job1', str(landing / 'a.jpg'), SHA256, ['archive'])
+    journal.write_text(json.dumps({'op': 'queued', 'job': job.to_dict()}) + '\n', encoding='utf-8')
+
+    archived = []
+    mover = ArchiveMover(str(journal), LocalDirectoryTarget('archive', str(archive)), index,
+                         on_archived=lambda *args: archived.append(args))
+    finished = threading.Event()
+    mover.queue.on_event = lambda job, state: state == 'done' and finished.set()
+    mover.start()
+    try:
+        assert finished.wait(5)
+        # /status 讀取搬移器執行緒檢查過的結果
+        assert mover.status()['available'] is True
+    finally:
+        mover.stop()
+    return archived
+
+
+def test_resume_after_copy_interrupted(tmp_path, tiers):
+    landing, archive, index = tiers
+    (archive / ('a.jpg' + ARCHIVE_TEMP_SUFFIX)).write_bytes(b'partial')
+
+    archived = resume_mover(tmp_path, landing, archive, index)
+
+    assert (archive / 'a.jpg').read_bytes() == CONTENT
+    assert not (archive / ('a.jpg' + ARCHIVE_TEMP_SUFFIX)).exists()
+    assert not (landing / 'a.jpg').exists()
+    assert index.get('a.jpg')['tier'] == 'archive'
+    assert len(archived) == 1
+
+
+def test_resume_after_index_updated(tmp_path, tiers):
+    landing, archive, index = tiers
+    # 模擬：已複製並更新檔案目錄，但在刪除落地層的檔案之前當機
+    (archive / 'a.jpg').write_bytes(CONTENT)
+    index.register_tier('archive', str(archive))
+    index.set_tier('a.jpg', 'archive')
+
+    archived = resume_mover(tmp_path, landing, archive, index)
+
+    assert not (landing / 'a.jpg').exists()
+    assert (archive / 'a.jpg').read_bytes() == CONTENT
+    assert len(archived) == 1
+
+
+def test_lookup_ignores_archived_files(tiers):
+    landing, archive, index = tiers
+    assert index.lookup(SHA256) == str(landing / 'a.jpg')
+
+    (archive / 'a.jpg').write_bytes(CONTENT)
+    index.register_tier('archive', str(archive))
+    index.set_tier('a.jpg', 'archive')
+    (landing / 'a.jpg').unlink()
+
+    assert index.lookup(SHA256) is None
+    assert index.get('a.jpg') is not None
+
+
+def test_storage_target_requires_implementation():
+    class Incomplete(StorageTarget):
+        kind = 'incomplete'
+
+        def available(self):
+            return True
+
+    with pytest.raises(TypeError):
+        Incomplete('x', '/tmp')
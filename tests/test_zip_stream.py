@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""即時打包zip：串流輸出可正常解開，文字檔壓縮、媒體檔直接儲存"""
+
+import io
+import os
+import zipfile
+
+import pytest
+
+from downloads import iter_zip_stream, should_deflate
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('notes.txt', True),
+    ('DATA.CSV', True),
+    ('config.json', True),
+    ('page.html', True),
+    ('logo.svg', True),
+    ('photo.jpg', False),
+    ('clip.mp4', False),
+    ('archive.zip', False),
+    ('no_extension', False),
+])
+def test_should_deflate(name, expected):
+    assert should_deflate(name) is expected
+
+
+def test_zip_stream_round_trip(tmp_path):
+    text = ('line\n' * 20000).encode()
+    media = os.urandom(300 * 1024)
+    (tmp_path / 'a.txt').write_bytes(text)
+    (tmp_path / 'b.jpg').write_bytes(media)
+    (tmp_path / 'empty.bin').write_bytes(b'')
+    entries = [(str(tmp_path / 'a.txt'), 'docs/a.txt'),
+               (str(tmp_path / 'b.jpg'), 'b.jpg'),
+               (str(tmp_path / 'empty.bin'), 'empty.bin')]
+
+    chunks = list(iter_zip_stream(entries, read_size=64 * 1024))
+
+    # 邊讀邊送：大檔案分成多段輸出，不是最後一次送出
+    assert len(chunks) > 3
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ['docs/a.txt', 'b.jpg', 'empty.bin']
+        assert archive.read('docs/a.txt') == text
+        assert archive.read('b.jpg') == media
+        assert archive.read('empty.bin') == b''
+        assert archive.getinfo('docs/a.txt').compress_type == zipfile.ZIP_DEFLATED
+        assert archive.getinfo('b.jpg').compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo('docs/a.txt').compress_size < len(text)
+
+
+def test_zip_stream_skips_missing_files(tmp_path, capsys):
+    (tmp_path / 'kept.txt').write_bytes(b'kept')
+    entries = [(str(tmp_path / 'gone.txt'), 'gone.txt'), (str(tmp_path / 'kept.txt'), 'kept.txt')]
+
+    data = b''.join(iter_zip_stream(entries))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == ['kept.txt']
+    assert 'gone.txt' in capsys.readouterr().out
+
+
+def test_zip_stream_old_timestamps_are_clamped(tmp_path):
+    path = tmp_path / 'old.txt'
+    path.write_bytes(b'old')
+    os.utime(path, (0, 0))
+
+    data = b''.join(iter_zip_stream([(str(path), 'old.txt')]))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.getinfo('old.txt').date_time == (1980, 1, 1, 0, 0, 0)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+縮圖產生
+上傳完成後交給背景的多程序工作池產生多種尺寸的縮圖（解碼分散到多個CPU核心），
+縮圖依內容雜湊與修改時間快取在磁碟上，已快取的縮圖直接回傳不需要重新解碼原圖
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+THUMBNAIL_SIZES = (128, 320, 640)
+THUMBNAIL_QUALITY = 80
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff'}
+
+
+def is_image_file(filename):
+    """是否為可產生縮圖的圖片"""
+    return os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+
+
+def render_thumbnails(source_path, targets):
+    """在工作程序中執行：解碼一次原圖並輸出所有尺寸 targets=[(尺寸, 輸出路徑)]"""
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as image:
+        largest = max(size for size, _ in targets)
+        # JPEG可直接以較低解析度解碼，大幅減少解碼時間
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        for size, dest_path in sorted(targets, reverse=True):
+            image.thumbnail((size, size))
+            tmp_path = dest_path + '.tmp'
+            image.save(tmp_path, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+            os.replace(tmp_path, dest_path)
+    return source_path
+
+
+class ThumbnailService:
+    """縮圖快取與背景產生"""
+
+    def __init__(self, cache_dir, workers=None, sizes=THUMBNAIL_SIZES):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.sizes = tuple(sizes)
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        os.makedirs(cache_dir, exist_ok=True)
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._dispatcher = None
+
+    def cache_key(self, sha256, mtime_ns):
+        """快取鍵：內容雜湊 + 修改時間（硬連結的重複檔案共用縮圖）"""
+        return f'{sha256}_{mtime_ns}'
+
+    def cache_path(self, key, size):
+        return os.path.join(self.cache_dir, key[:2], f'{key}_{size}.jpg')
+
+    def get(self, key, size):
+        """回傳已快取的縮圖路徑，尚未產生時回傳None"""
+        path = self.cache_path(key, size)
+        return path if os.path.exists(path) else None
+
+    def schedule(self, source_path, key):
+        """排入背景產生縮圖，立即返回"""
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._queue.put((source_path, key))
+        self._ensure_started()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name='thumbnail-dispatcher',
+                                                    daemon=True)
+                self._dispatcher.start()
+
+    def _dispatch(self):
+        """由獨立執行緒建立工作程序並送出工作，上傳請求不會因為啟動程序而被阻塞"""
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            source_path, key = item
+            targets = [(size, self.cache_path(key, size)) for size in self.sizes
+                       if not os.path.exists(self.cache_path(key, size))]
+            if not targets:
+                self._done(key)
+                continue
+            os.makedirs(os.path.dirname(targets[0][1]), exist_ok=True)
+            try:
+                future = self._executor.submit(render_thumbnails, source_path, targets)
+            except Exception as e:
+                print(f"無法產生縮圖 {source_path}: {e}")
+                self._done(key)
+                continue
+            future.add_done_callback(lambda f, key=key, path=source_path: self._finished(f, key, path))
+
+    def _finished(self, future, key, source_path):
+        error = None if future.cancelled() else future.exception()
+        if error is not None:
+            print(f"產生縮圖失敗 {os.path.basename(source_path)}: {error}")
+        self._done(key)
+
+    def _done(self, key):
+        with self._lock:
+            self._pending.discard(key)
+
+    def shutdown(self):
+        """伺服器停止時呼叫：停止送出工作並關閉工作程序（未完成的縮圖下次瀏覽時重新排入）"""
+        with self._lock:
+            dispatcher = self._dispatcher
+        if dispatcher is None:
+            return
+        self._queue.put(None)
+        dispatcher.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
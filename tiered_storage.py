@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分層儲存：快速的落地層與背景搬移的封存層
+上傳只寫入上傳資料夾（落地層，例如本機SSD）就回應手機；後處理完成後由搬移器在背景
+以有限的工作執行緒與頻寬將檔案複製到封存層（例如掛載的NAS或外接硬碟），
+重新讀取封存的副本比對SHA-256無誤後，才更新檔案目錄並刪除落地層的檔案。
+檔案在搬移前、中、後都以同一個名稱（檔案目錄中的相對路徑）下載，
+封存層暫時無法使用時檔案留在落地層，稍後重試
+"""
+
+import os
+import abc
+import hashlib
+import threading
+import time
+
+from atomic_store import fsync_dir
+from bandwidth import TokenBucket
+from post_processing import JobQueue, JobError
+
+ARCHIVE_TIER = 'archive'
+COPY_BUFFER_SIZE = 1024 * 1024
+DEFAULT_ARCHIVE_WORKERS = 1
+ARCHIVE_MAX_ATTEMPTS = 20           # 封存層可能長時間離線（重試間隔最多5分鐘）
+ARCHIVE_TEMP_SUFFIX = '.archiving'
+AVAILABILITY_CHECK_INTERVAL = 30    # 背景檢查封存層是否可用的間隔（秒）
+
+
+class StorageTarget(abc.ABC):
+    """
+    儲存層：以相對路徑存放檔案
+    搬移後的檔案直接從 local_path 讀取（下載、縮圖、打包），因此儲存層必須能以本機路徑存取
+    """
+
+    kind = None
+
+    def __init__(self, name, root):
+        self.name = name
+        self.root = root
+
+    def local_path(self, path):
+        """相對路徑在這個儲存層的實際路徑"""
+        return os.path.join(self.root, *path.split('/'))
+
+    @abc.abstractmethod
+    def available(self):
+        """目前是否可以寫入（可能很慢，例如NAS離線時；只在搬移器的執行緒中呼叫）"""
+
+    @abc.abstractmethod
+    def store(self, source, path, throttle=None):
+        """將 source 複製到 path，回傳 (實際路徑, SHA-256)；throttle(位元組數) 在每次讀取後呼叫"""
+
+    def describe(self):
+        return {'name': self.name, 'kind': self.kind, 'root': os.path.abspath(self.root)}
+
+
+class LocalDirectoryTarget(StorageTarget):
+    """本機資料夾（掛載的網路磁碟、外接硬碟等）"""
+
+    kind = 'dir'
+
+    def available(self):
+        return os.path.isdir(self.root) and os.access(self.root, os.W_OK)
+
+    def store(self, source, path, throttle=None):
+        dest = self.local_path(path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # 固定的暫存檔名：中斷後重試會覆蓋上次留下的暫存檔
+        tmp_path = dest + ARCHIVE_TEMP_SUFFIX
+        digest = hashlib.sha256()
+        try:
+            with open(source, 'rb') as src, open(tmp_path, 'wb') as dst:
+                while True:
+                    block = src.read(COPY_BUFFER_SIZE)
+                    if not block:
+                        break
+                    digest.update(block)
+                    dst.write(block)
+                    if throttle is not None:
+                        throttle(len(block))
+                dst.flush()
+                os.fsync(dst.fileno())
+            stat = os.stat(source)
+            os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            os.replace(tmp_path, dest)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        fsync_dir(os.path.dirname(dest))
+        return dest, digest.hexdigest()
+
+
+TARGET_TYPES = {
+    LocalDirectoryTarget.kind: LocalDirectoryTarget,
+}
+
+
+def make_target(name, spec):
+    """
+    由設定建立儲存層：類型:位置（例如 dir:/mnt/nas/photos），只寫路徑時視為本機資料夾
+    """
+    kind, sep, location = spec.partition(':')
+    # 沒有類型或是Windows磁碟代號（D:\\photos）
+    if not sep or (kind not in TARGET_TYPES and len(kind) == 1):
+        kind, location = LocalDirectoryTarget.kind, spec
+    if kind not in TARGET_TYPES:
+        raise ValueError(f'不支援的儲存層類型: {kind}（可用: {", ".join(TARGET_TYPES)}）')
+    if not location:
+        raise ValueError(f'儲存層未指定位置: {spec}')
+    return TARGET_TYPES[kind](name, location)
+
+
+class ArchiveMover:
+    """
+    背景將落地層的檔案搬到封存層
+    工作記錄在獨立的日誌中（伺服器重新啟動後繼續），每個步驟都可重複執行：
+    已複製並驗證的檔案（檔案目錄已標記儲存層）只會補做刪除落地層的動作。
+    on_archived(落地層路徑, 封存層路徑, 大小) 在刪除落地層的檔案後呼叫（更新統計等）
+    """
+
+    def __init__(self, journal_path, target, file_index, workers=DEFAULT_ARCHIVE_WORKERS,
+                 bandwidth=None, on_archived=None, delay=0):
+        self.target = target
+        self.file_index = file_index
+        self.on_archived = on_archived
+        self.delay = delay
+        self.bandwidth = bandwidth
+        self._bucket = TokenBucket(bandwidth) if bandwidth else None
+        self._bucket_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._stopped = threading.Event()
+        # 封存層是否可用：由搬移器的執行緒更新，/status 只讀取快取，不會卡在離線的NAS上
+        self._available = None
+        self._probe = None
+        self.moved_files = 0
+        self.moved_bytes = 0
+        file_index.register_tier(target.name, target.root)
+        self.queue = JobQueue(journal_path, workers=workers, max_attempts=ARCHIVE_MAX_ATTEMPTS,
+                              name='archive')
+        self.queue.register_step('archive', self._archive)
+
+    def start(self):
+        self.queue.start()
+        self._probe = threading.Thread(target=self._run_probe, name='archive-probe', daemon=True)
+        self._probe.start()
+
+    def stop(self):
+        """停止搬移（進行中的複製會中斷，下次啟動重新開始）"""
+        self._stopping = True
+        self._stopped.set()
+        self.queue.stop()
+
+    def _check_available(self):
+        available = self.target.available()
+        self._available = available
+        return available
+
+    def _run_probe(self):
+        """定期檢查封存層是否可用（沒有搬移工作時 /status 也能反映目前狀態）"""
+        while True:
+            try:
+                self._check_available()
+            except Exception as e:
+                print(f"檢查封存層失敗: {e}")
+            if self._stopped.wait(AVAILABILITY_CHECK_INTERVAL):
+                return
+
+    def schedule(self, filepath, sha256):
+        """排入搬移，delay 秒後開始（讓剛上傳的檔案先在落地層被瀏覽與下載）"""
+        self.queue.enqueue(filepath, sha256, ['archive'], delay=self.delay)
+
+    def _throttle(self, nbytes):
+        """限制搬移佔用的頻寬（所有搬移工作共用），伺服器停止時中斷"""
+        if self._stopping:
+            raise OSError('伺服器停止中')
+        if self._bucket is None:
+            return
+        with self._bucket_lock:
+            wait = self._bucket.take(nbytes, time.monotonic())
+        if wait > 0:
+            time.sleep(wait)
+
+    def _hash(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(COPY_BUFFER_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+                self._throttle(len(block))
+        return digest.hexdigest()
+
+    def _archive(self, job):
+        path = self.file_index.relative_path(job.path)
+        entry = self.file_index.get(path)
+        if entry is None:
+            # 搬移前已被刪除或移動
+            return None
+        if entry['tier'] != self.target.name:
+            if not self._check_available():
+                raise OSError(f'封存層目前無法使用: {self.target.root}')
+            dest, digest = self.target.store(job.path, path, self._throttle)
+            if digest != job.sha256:
+                os.remove(dest)
+                raise JobError('落地層的檔案內容與上傳時不符，保留在落地層')
+            # 重新讀取封存的副本，確認寫入的內容正確才刪除落地層的檔案
+            if self._hash(dest) != digest:
+                os.remove(dest)
+                raise OSError('封存的副本驗證失敗')
+            self.file_index.set_tier(path, self.target.name)
+        else:
+            dest = self.target.local_path(path)
+        try:
+            size = os.path.getsize(job.path)
+            os.remove(job.path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.moved_files += 1
+            self.moved_bytes += size
+        if self.on_archived is not None:
+            self.on_archived(job.path, dest, size)
+        return None
+
+    def status(self):
+        with self._lock:
+            moved = {'files': self.moved_files, 'bytes': self.moved_bytes}
+        return {
+            'target': self.target.describe(),
+            'available': self._available,
+            'bandwidth': self.bandwidth,
+            'delay_seconds': self.delay,
+            'moved': moved,
+            **self.queue.status(),
+        }